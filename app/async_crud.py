@@ -0,0 +1,164 @@
+# app/async_crud.py
+#
+# Versión asíncrona (AsyncSession) de las operaciones de crud.py que usan los
+# endpoints más frecuentes. crud.py sigue siendo la capa síncrona para el
+# startup, los endpoints de administración y los procesos por lotes.
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas, patient_search, patient_stats, versioning
+from .fingerprint import feature_row, features_fingerprint
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+async def update_user_password_hash(db: AsyncSession, db_user: models.User, hashed_password: str):
+    db_user.hashed_password = hashed_password
+    await db.commit()
+    return db_user
+
+async def get_patients_by_owner(db: AsyncSession, owner_id: int, skip: int = 0, limit: int = 100, after_id: int | None = None,
+                                filters: schemas.PatientFilters | None = None,
+                                sort: schemas.PatientSort = schemas.PatientSort.id, after_key: tuple | None = None):
+    """
+    Página del listado con filtros y orden (ver app/patient_search.py). Con cursor
+    (`after_key` = (valor de orden, id), o `after_id` en el orden por id) se pagina
+    por clave sobre el índice (owner_id, columna, id); sin él, con `skip`.
+    """
+    if after_key is None and after_id is not None:
+        after_key = (after_id, after_id)
+    query = patient_search.listing_statement(owner_id, db.get_bind().dialect.name, filters, sort, after_key)
+    if after_key is None:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+async def get_patient_rows_by_owner(db: AsyncSession, owner_id: int, columns: list[str], skip: int = 0, limit: int = 100,
+                                    filters: schemas.PatientFilters | None = None,
+                                    sort: schemas.PatientSort = schemas.PatientSort.id, after_key: tuple | None = None):
+    """Como get_patients_by_owner, pero devuelve filas con solo `columns` (sin objetos ORM)."""
+    query = patient_search.listing_statement(
+        owner_id, db.get_bind().dialect.name, filters, sort, after_key, columns=columns
+    )
+    if after_key is None:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.all()
+
+async def create_user_patient(db: AsyncSession, patient: schemas.PatientCreate, user_id: int):
+    data = patient.model_dump()
+    db_patient = models.Patient(**data, owner_id=user_id, features_hash=features_fingerprint(feature_row(data)))
+    db.add(db_patient)
+    await patient_stats.apply_deltas_async(db, [patient_stats.patient_delta(user_id, None, data)])
+    await versioning.bump_roster_async(db, user_id)
+    await db.commit()
+    await db.refresh(db_patient)
+    return db_patient
+
+
+# --- Operaciones sobre un paciente del médico (una sola sentencia) ---
+# Leen o escriben la fila por id y owner_id (y versión, con If-Match): una petición
+# sobre un paciente ajeno no escribe ni bloquea su fila. Solo si la sentencia no
+# devuelve nada se lee (owner_id, version) para distinguir 404, 403 y 412.
+
+async def get_patient(db: AsyncSession, patient_id: int):
+    result = await db.execute(select(models.Patient).where(models.Patient.id == patient_id))
+    return result.scalars().first()
+
+async def get_patient_version(db: AsyncSession, patient_id: int):
+    """Solo (owner_id, version, updated_at) del paciente, para responder 304 sin cargarlo."""
+    result = await db.execute(
+        select(models.Patient.owner_id, models.Patient.version, models.Patient.updated_at)
+        .where(models.Patient.id == patient_id)
+    )
+    return result.first()
+
+async def _current_owner(db: AsyncSession, patient_id: int):
+    result = await db.execute(select(models.Patient.owner_id).where(models.Patient.id == patient_id))
+    return result.scalar_one_or_none()
+
+async def update_owned_patient(db: AsyncSession, patient_id: int, owner_id: int, patient_update: schemas.PatientUpdate,
+                               expected_versions: list[int] | None = None):
+    """
+    UPDATE ... WHERE id = ? AND owner_id = ? [AND version IN (...)] RETURNING *.
+    Devuelve (owner_id de la fila, paciente): (None, None) si no existe; el paciente
+    es None si es de otro médico o si, con `expected_versions` (If-Match), su
+    versión no es ninguna de ellas. En esos casos no se escribe nada.
+    """
+    values = patient_update.model_dump(exclude_unset=True)
+    # La predicción guardada solo queda desactualizada si cambia la huella de las variables
+    if all(name in values for name in schemas.PREDICTION_FEATURES):
+        values["features_hash"] = features_fingerprint(feature_row(values))
+    # Las estadísticas se ajustan antes del UPDATE, cuando aún se leen los valores anteriores
+    # (con las mismas condiciones: si el UPDATE no encuentra la fila, no cambia nada)
+    if any(name in values for name in patient_stats.STAT_FIELDS):
+        await db.execute(patient_stats.feature_change_statement(patient_id, owner_id, values, expected_versions))
+    statement = update(models.Patient).where(models.Patient.id == patient_id, models.Patient.owner_id == owner_id)
+    if expected_versions is not None:
+        statement = statement.where(versioning.version_in(expected_versions))
+    statement = statement.values(**values).returning(models.Patient).execution_options(synchronize_session=False)
+    db_patient = (await db.execute(statement)).scalars().first()
+    if db_patient is None:
+        await db.rollback()
+        return await _current_owner(db, patient_id), None
+    await versioning.bump_roster_async(db, owner_id)
+    await db.commit()
+    return owner_id, db_patient
+
+async def delete_owned_patient(db: AsyncSession, patient_id: int, owner_id: int):
+    """
+    DELETE ... WHERE id = ? AND owner_id = ? RETURNING owner_id. Devuelve el
+    owner_id de la fila (None si no existe); si es de otro médico no se borra nada.
+    """
+    await db.execute(patient_stats.removal_statement(patient_id, owner_id))
+    statement = (
+        delete(models.Patient)
+        .where(models.Patient.id == patient_id, models.Patient.owner_id == owner_id)
+        .returning(models.Patient.owner_id)
+    )
+    if (await db.execute(statement)).scalar_one_or_none() is None:
+        await db.rollback()
+        return await _current_owner(db, patient_id)
+    await versioning.bump_roster_async(db, owner_id)
+    await db.commit()
+    return owner_id
+
+async def update_owned_patient_prediction(db: AsyncSession, patient_id: int, owner_id: int, profile: int, description: str,
+                                          model_version: str | None = None, probabilities: list | None = None,
+                                          features_hash: str | None = None, previous: models.Patient | None = None):
+    """
+    `features_hash` es la huella de las variables con las que se predijo.
+    `previous` es el paciente tal como lo leyó el endpoint: con él la aportación a
+    las estadísticas cambia de grupo sin volver a leerlo (y no se toca si el perfil
+    no cambia); sin él se mueve con subconsultas.
+    """
+    if previous is None:
+        dialect_name = db.get_bind().dialect.name
+        await db.execute(patient_stats.removal_statement(patient_id, owner_id))
+        await db.execute(patient_stats.addition_statement(dialect_name, patient_id, owner_id, profile))
+    elif previous.prediction_profile != profile:
+        await patient_stats.apply_deltas_async(db, [
+            patient_stats.patient_delta(owner_id, previous.prediction_profile, previous, sign=-1),
+            patient_stats.patient_delta(owner_id, profile, previous),
+        ])
+    statement = (
+        update(models.Patient)
+        .where(models.Patient.id == patient_id, models.Patient.owner_id == owner_id)
+        .values(prediction_profile=profile, prediction_description=description,
+                prediction_model_version=model_version, prediction_probabilities=probabilities,
+                prediction_features_hash=features_hash,
+                # Los pacientes anteriores a la huella la reciben aquí sin pisar una más reciente
+                features_hash=func.coalesce(models.Patient.features_hash, features_hash))
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(statement)
+    await versioning.bump_roster_async(db, owner_id)
+    await db.commit()
+
+async def get_patient_stats_rows(db: AsyncSession, owner_id: int):
+    result = await db.execute(
+        select(models.PatientStats).where(models.PatientStats.owner_id == owner_id).order_by(models.PatientStats.profile)
+    )
+    return result.scalars().all()
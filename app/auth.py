@@ -6,15 +6,29 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import threading
+import time
 import os
 
 # Imports para la función de autenticación
-from . import crud, schemas
+from . import async_crud, schemas, metrics
 
 # --- Configuración de Seguridad ---
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Factor de coste de bcrypt. Si cambia, los hashes antiguos se re-generan
+# de forma oportunista en el siguiente login del usuario.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Pool dedicado para el trabajo de bcrypt (cientos de ms de CPU por llamada):
+# número de hilos y máximo de operaciones esperando en cola.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "16"))
 
 # CORRECCIÓN CRÍTICA: Se obtiene SECRET_KEY con un valor por defecto
 # En producción (Render), DEBE estar configurada como variable de entorno
@@ -43,25 +57,109 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
 
 # --- Funciones de Contraseña ---
 
-def verify_password(plain_password, hashed_password):
-    """Verifica que una contraseña en texto plano coincida con su versión hasheada."""
-    return pwd_context.verify(plain_password, hashed_password)
+def _timed(operation, fn, *args):
+    """Ejecuta una operación de bcrypt registrando su duración en las métricas."""
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        metrics.record_password_hash(operation, time.perf_counter() - start)
 
 def get_password_hash(password):
     """Genera el hash de una contraseña en texto plano."""
-    return pwd_context.hash(password)
+    return _timed("hash", pwd_context.hash, password)
+
+# --- Pool de Hashing de Contraseñas ---
+
+class PasswordPoolSaturated(Exception):
+    """El pool de bcrypt tiene todos los hilos ocupados y la cola llena."""
+
+
+class PasswordHashPool:
+    """
+    Ejecuta bcrypt en un pool de hilos propio y acotado, fuera del event loop y
+    del thread pool de Starlette (bcrypt libera el GIL mientras calcula).
+    Si hay más de `workers + max_queue` operaciones pendientes se rechaza la nueva
+    con PasswordPoolSaturated, que los endpoints traducen a un 429.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_QUEUE_SIZE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _done(self, _future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+        self._slots.release()
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordPoolSaturated()
+        with self._lock:
+            self.pending += 1
+        try:
+            # Con el contexto copiado, el tiempo de bcrypt se atribuye a la petición
+            future = self._executor.submit(contextvars.copy_context().run, fn, *args)
+        except BaseException:
+            # p. ej. el executor ya está cerrado (recarga o apagado): se devuelve el hueco
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.pending,
+                "queued": max(0, self.pending - self.workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+# Instancia compartida por todo el proceso
+password_pool = PasswordHashPool()
+
+async def get_password_hash_async(password):
+    """Como get_password_hash, pero ejecutado en el pool de bcrypt."""
+    return await password_pool.run(_timed, "hash", pwd_context.hash, password)
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    """
+    Verifica la contraseña en el pool de bcrypt. Devuelve (valida, nuevo_hash);
+    nuevo_hash no es None si el hash guardado usa otro factor de coste.
+    """
+    return await password_pool.run(_timed, "verify", pwd_context.verify_and_update, plain_password, hashed_password)
 
 # --- Función de Autenticación de Usuario ---
 
-def authenticate_user(db: Session, email: str, password: str):
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
     """
     Autentica a un usuario. Devuelve el objeto de usuario si es exitoso, si no, None.
+    bcrypt se ejecuta en el pool dedicado. Si el hash usa un factor de coste
+    distinto de BCRYPT_ROUNDS se guarda el hash re-generado.
     """
-    user = crud.get_user_by_email(db, email=email)
+    user = await async_crud.get_user_by_email(db, email=email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_and_update_password_async(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        await async_crud.update_user_password_hash(db, user, new_hash)
     return user
 
 # --- Funciones de Token JWT ---
@@ -0,0 +1,91 @@
+# app/auth_cache.py
+
+import os
+import threading
+import time
+from typing import NamedTuple
+
+# Segundos que se reutiliza la resolución token -> usuario antes de volver a la BD
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+
+class UserSnapshot(NamedTuple):
+    """Copia inmutable de los datos del usuario que necesitan las dependencias de seguridad."""
+    id: int
+    email: str
+    full_name: str
+    role: str
+    is_active: bool
+
+
+class AuthCache:
+    """
+    Caché en memoria token JWT -> UserSnapshot.
+
+    Cada entrada vive como máximo AUTH_CACHE_TTL segundos y nunca más allá del
+    'exp' del propio token. Al desactivar un usuario se invalidan sus entradas
+    (en este proceso; los demás workers lo verán al expirar el TTL).
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, maxsize: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> UserSnapshot | None:
+        entry = self._data.get(token)
+        if entry is None:
+            return None
+        snapshot, expires_at = entry
+        if expires_at <= time.time():
+            with self._lock:
+                self._remove(token)
+            return None
+        return snapshot
+
+    def set(self, token: str, snapshot: UserSnapshot, token_exp: float):
+        if self.ttl <= 0:
+            return
+        expires_at = min(time.time() + self.ttl, token_exp)
+        with self._lock:
+            if token not in self._data and len(self._data) >= self.maxsize:
+                self._evict()
+            self._data[token] = (snapshot, expires_at)
+            self._tokens_by_user.setdefault(snapshot.id, set()).add(token)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in self._tokens_by_user.pop(user_id, ()):
+                self._data.pop(token, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tokens_by_user.clear()
+
+    def _remove(self, token: str):
+        entry = self._data.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user.get(entry[0].id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[entry[0].id]
+
+    def _evict(self):
+        # Primero se descartan las entradas expiradas; si no basta, la más antigua
+        now = time.time()
+        for token in [t for t, (_, expires_at) in self._data.items() if expires_at <= now]:
+            self._remove(token)
+        if len(self._data) >= self.maxsize:
+            self._remove(next(iter(self._data)))
+
+
+# Instancia compartida por todo el proceso
+auth_cache = AuthCache()
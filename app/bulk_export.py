@@ -0,0 +1,65 @@
+# app/bulk_export.py
+
+import csv
+import io
+import json
+from datetime import date
+
+from . import crud, schemas
+from .database import SessionLocal
+
+# Filas que se leen de la BD (y se escriben en la salida) en cada bloque de la exportación
+EXPORT_CHUNK_SIZE = 1000
+
+
+def export_file_info(export_format: schemas.DataFormat) -> tuple:
+    """(media type, nombre de archivo) de una exportación."""
+    if export_format == schemas.DataFormat.csv:
+        return "text/csv; charset=utf-8", "pacientes.csv"
+    return "application/x-ndjson", "pacientes.ndjson"
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def iter_export_chunks(owner_id: int, export_format: schemas.DataFormat, progress=None, db=None):
+    """
+    Genera la exportación por bloques de texto. Sin `db` usa su propia sesión,
+    porque el generador se consume después de que el endpoint haya devuelto la
+    respuesta. Los campos coinciden con `schemas.Patient`. `progress(filas)` se
+    llama tras cada bloque.
+    """
+    columns = schemas.PATIENT_FIELDS
+    exported = 0
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        if export_format == schemas.DataFormat.csv:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue()  # la cabecera sale antes de consultar la BD
+            for rows in crud.iter_patient_rows(db, owner_id, columns, chunk_size=EXPORT_CHUNK_SIZE):
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                exported += len(rows)
+                if progress is not None:
+                    progress(exported)
+        else:
+            for rows in crud.iter_patient_rows(db, owner_id, columns, chunk_size=EXPORT_CHUNK_SIZE):
+                yield "".join(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + "\n"
+                    for row in rows
+                )
+                exported += len(rows)
+                if progress is not None:
+                    progress(exported)
+    finally:
+        if own_session:
+            db.close()
@@ -0,0 +1,108 @@
+# app/bulk_import.py
+
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from . import crud, schemas
+from .inference import get_loaded_model, predict_detailed, round_probabilities, describe_profile
+from .fingerprint import features_fingerprint
+
+# Pacientes válidos que se insertan (y se predicen) en cada bloque
+IMPORT_CHUNK_SIZE = 500
+
+# Máximo de filas con error que se detallan en el informe (el total se cuenta siempre)
+MAX_REPORTED_ERRORS = 1000
+
+
+def iter_records(stream, data_format: schemas.DataFormat):
+    """
+    Lee el archivo subido fila a fila y devuelve (número de fila, dict | error).
+    En CSV el número de fila es el de la línea del archivo (la cabecera es la 1).
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if data_format == schemas.DataFormat.csv:
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, ValueError(f"JSON no válido: {e.msg}")
+            continue
+        if not isinstance(record, dict):
+            yield line_number, ValueError("Cada línea debe ser un objeto JSON")
+            continue
+        yield line_number, record
+
+
+def _flush(db: Session, owner_id: int, patients: list[dict], loaded) -> int:
+    if loaded is not None:
+        rows = [tuple(patient[name] for name in schemas.PREDICTION_FEATURES) for patient in patients]
+        detail = predict_detailed(rows, loaded=loaded)
+        for patient, row, prediction, probabilities in zip(patients, rows, detail.profiles, detail.probabilities):
+            profile = int(prediction)
+            patient["features_hash"] = patient["prediction_features_hash"] = features_fingerprint(row)
+            patient["prediction_profile"] = profile
+            patient["prediction_description"] = describe_profile(profile)
+            patient["prediction_model_version"] = loaded.version
+            patient["prediction_probabilities"] = round_probabilities(probabilities)
+    return crud.bulk_create_user_patients(db, patients, user_id=owner_id)
+
+
+def import_patients(db: Session, owner_id: int, stream, data_format: schemas.DataFormat, score: bool = False,
+                    progress=None) -> dict:
+    """
+    Valida cada fila contra `schemas.PatientCreate` a medida que se lee y la
+    inserta en bloques de IMPORT_CHUNK_SIZE. Las filas con error se saltan y se
+    informan sin abortar las demás.
+
+    Con `score=True` cada bloque se predice con una sola llamada al modelo
+    antes de insertarlo. `progress(insertados)` se llama tras cada bloque.
+    """
+    loaded = get_loaded_model() if score else None
+    inserted = 0
+    error_count = 0
+    errors = []
+    pending = []
+
+    for row_number, record in iter_records(stream, data_format):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            pending.append(schemas.PatientCreate.model_validate(record).model_dump())
+        except (ValidationError, ValueError) as e:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                if isinstance(e, ValidationError):
+                    messages = [f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()]
+                else:
+                    messages = [str(e)]
+                errors.append({"row": row_number, "errors": messages})
+            continue
+
+        if len(pending) >= IMPORT_CHUNK_SIZE:
+            inserted += _flush(db, owner_id, pending, loaded)
+            pending = []
+            if progress is not None:
+                progress(inserted)
+
+    if pending:
+        inserted += _flush(db, owner_id, pending, loaded)
+        if progress is not None:
+            progress(inserted)
+
+    return {
+        "inserted": inserted,
+        "scored": inserted if score else 0,
+        "error_count": error_count,
+        "errors": errors,
+    }
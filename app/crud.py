@@ -1,7 +1,10 @@
 # app/crud.py
 
+from sqlalchemy import bindparam, func, insert, or_, select, update
 from sqlalchemy.orm import Session
-from . import models, schemas, auth
+from . import models, schemas, auth, patient_search, patient_stats, versioning
+from .auth_cache import auth_cache
+from .fingerprint import feature_row, features_fingerprint
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -9,11 +12,19 @@ def get_user(db: Session, user_id: int):
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: int | None = None):
+    query = db.query(models.User).order_by(models.User.id)
+    # Con cursor (after_id) se pagina por clave: coste constante en páginas profundas
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = auth.get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str | None = None):
+    # El hash puede venir ya calculado (p. ej. en el pool de bcrypt de auth)
+    if hashed_password is None:
+        hashed_password = auth.get_password_hash(user.password)
     # <--- CORRECCIÓN CLAVE: Ahora 'user.role' viene del schema y funcionará
     db_user = models.User(
         email=user.email,
@@ -32,26 +43,87 @@ def update_user_activity(db: Session, user_id: int, is_active: bool):
         db_user.is_active = is_active
         db.commit()
         db.refresh(db_user)
+        # Los tokens ya resueltos de este usuario no deben seguir siendo válidos en caché
+        auth_cache.invalidate_user(user_id)
+    return db_user
+
+def update_user_password_hash(db: Session, db_user: models.User, hashed_password: str):
+    db_user.hashed_password = hashed_password
+    db.commit()
     return db_user
 
 def get_patient(db: Session, patient_id: int):
     return db.query(models.Patient).filter(models.Patient.id == patient_id).first()
 
 
-def get_patients_by_owner(db: Session, owner_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Patient).filter(models.Patient.owner_id == owner_id).offset(skip).limit(limit).all()
+def get_patients_by_owner(db: Session, owner_id: int, skip: int = 0, limit: int = 100, after_id: int | None = None,
+                          filters: schemas.PatientFilters | None = None,
+                          sort: schemas.PatientSort = schemas.PatientSort.id, after_key: tuple | None = None):
+    # Con cursor (after_id / after_key) se pagina por clave sobre el índice (owner_id, columna, id)
+    if after_key is None and after_id is not None:
+        after_key = (after_id, after_id)
+    query = patient_search.listing_statement(owner_id, db.get_bind().dialect.name, filters, sort, after_key)
+    if after_key is None:
+        query = query.offset(skip)
+    return db.execute(query.limit(limit)).scalars().all()
+
+def iter_patient_rows(db: Session, owner_id: int, columns: list[str], chunk_size: int = 1000):
+    """
+    Recorre todos los pacientes de un médico con un cursor del lado del servidor
+    (yield_per) y devuelve bloques de tuplas, sin construir objetos ORM.
+    """
+    statement = (
+        select(*[getattr(models.Patient, name) for name in columns])
+        .where(models.Patient.owner_id == owner_id)
+        .order_by(models.Patient.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    result = db.execute(statement)
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
 
 def create_user_patient(db: Session, patient: schemas.PatientCreate, user_id: int):
-    db_patient = models.Patient(**patient.model_dump(), owner_id=user_id)
+    data = patient.model_dump()
+    db_patient = models.Patient(**data, owner_id=user_id, features_hash=features_fingerprint(feature_row(data)))
     db.add(db_patient)
+    patient_stats.apply_deltas(db, [patient_stats.patient_delta(user_id, None, data)])
+    versioning.bump_rosters(db, [user_id])
     db.commit()
     db.refresh(db_patient)
     return db_patient
 
+def bulk_create_user_patients(db: Session, patients: list[dict], user_id: int):
+    """
+    Inserta muchos pacientes con un INSERT multi-fila y un único commit.
+    Cada elemento es el model_dump() de un PatientCreate (más, opcionalmente,
+    los campos de predicción). Si no trae 'features_hash' se calcula aquí.
+    """
+    if not patients:
+        return 0
+    db.execute(insert(models.Patient), [
+        {"features_hash": patient.get("features_hash") or features_fingerprint(feature_row(patient)),
+         **patient, "owner_id": user_id}
+        for patient in patients
+    ])
+    patient_stats.apply_deltas(db, [
+        patient_stats.patient_delta(user_id, patient.get("prediction_profile"), patient) for patient in patients
+    ])
+    versioning.bump_rosters(db, [user_id])
+    db.commit()
+    return len(patients)
+
 def update_patient(db: Session, db_patient: models.Patient, patient_update: schemas.PatientUpdate):
     update_data = patient_update.model_dump(exclude_unset=True)
+    removed = patient_stats.patient_delta(db_patient.owner_id, db_patient.prediction_profile, db_patient, sign=-1)
     for key, value in update_data.items():
         setattr(db_patient, key, value)
+    db_patient.features_hash = features_fingerprint(feature_row(db_patient))
+    patient_stats.apply_deltas(db, [
+        removed, patient_stats.patient_delta(db_patient.owner_id, db_patient.prediction_profile, db_patient)
+    ])
+    versioning.bump_rosters(db, [db_patient.owner_id])
     db.commit()
     db.refresh(db_patient)
     return db_patient
@@ -60,14 +132,162 @@ def delete_patient(db: Session, patient_id: int):
     db_patient = get_patient(db, patient_id)
     if db_patient:
         db.delete(db_patient)
+        patient_stats.apply_deltas(db, [
+            patient_stats.patient_delta(db_patient.owner_id, db_patient.prediction_profile, db_patient, sign=-1)
+        ])
+        versioning.bump_rosters(db, [db_patient.owner_id])
         db.commit()
     return db_patient
 
-def update_patient_prediction(db: Session, patient_id: int, profile: int, description: str):
+def update_patient_prediction(db: Session, patient_id: int, profile: int, description: str,
+                              model_version: str | None = None, probabilities: list | None = None):
     db_patient = get_patient(db, patient_id)
     if db_patient:
+        # La aportación del paciente pasa del grupo de su perfil anterior al del nuevo
+        patient_stats.apply_deltas(db, [
+            patient_stats.patient_delta(db_patient.owner_id, db_patient.prediction_profile, db_patient, sign=-1),
+            patient_stats.patient_delta(db_patient.owner_id, profile, db_patient),
+        ])
         db_patient.prediction_profile = profile
         db_patient.prediction_description = description
+        db_patient.prediction_model_version = model_version
+        db_patient.prediction_probabilities = probabilities
+        db_patient.features_hash = db_patient.prediction_features_hash = features_fingerprint(feature_row(db_patient))
+        versioning.bump_rosters(db, [db_patient.owner_id])
         db.commit()
         db.refresh(db_patient)
-    return db_patient
\ No newline at end of file
+    return db_patient
+
+# --- Operaciones por lotes para la predicción masiva ---
+
+def stale_prediction_filter(model_version: str):
+    """
+    Pacientes cuya predicción guardada falta o está desactualizada: sin predicción,
+    con datos que cambiaron después de predecir (o sin huella, anteriores a ella)
+    o predichos con una versión del modelo distinta de `model_version`.
+    """
+    patient = models.Patient
+    return or_(
+        patient.prediction_profile.is_(None),
+        patient.features_hash.is_(None),
+        patient.prediction_features_hash.is_(None),
+        patient.prediction_features_hash != patient.features_hash,
+        patient.prediction_model_version.is_(None),
+        patient.prediction_model_version != model_version,
+    )
+
+def get_patient_feature_rows(db: Session, owner_id: int | None, after_id: int = 0, limit: int = 500,
+                             patient_ids: list[int] | None = None, only_unscored: bool = False,
+                             stale_for_version: str | None = None):
+    """
+    Devuelve un bloque de filas (id + las 13 variables del modelo) de los pacientes
+    de un médico (o de todos si `owner_id` es None), ordenadas por id y a partir de
+    `after_id` (paginación por clave). Con `stale_for_version` solo devuelve los
+    que haya que volver a predecir con esa versión del modelo.
+    """
+    columns = [models.Patient.id] + [getattr(models.Patient, name) for name in schemas.PREDICTION_FEATURES]
+    query = db.query(*columns).filter(models.Patient.id > after_id)
+    if owner_id is not None:
+        query = query.filter(models.Patient.owner_id == owner_id)
+    if patient_ids is not None:
+        query = query.filter(models.Patient.id.in_(patient_ids))
+    if only_unscored:
+        query = query.filter(models.Patient.prediction_profile.is_(None))
+    if stale_for_version is not None:
+        query = query.filter(stale_prediction_filter(stale_for_version))
+    return query.order_by(models.Patient.id).limit(limit).all()
+
+def count_stale_patients(db: Session, model_version: str, owner_id: int | None = None) -> int:
+    query = select(func.count()).select_from(models.Patient).where(stale_prediction_filter(model_version))
+    if owner_id is not None:
+        query = query.where(models.Patient.owner_id == owner_id)
+    return db.execute(query).scalar_one()
+
+def bulk_update_patient_predictions(db: Session, predictions: list[dict]):
+    """
+    Guarda muchas predicciones con un único UPDATE por lotes (executemany por clave primaria).
+    Cada elemento debe tener las claves 'id', 'prediction_profile', 'prediction_description',
+    'prediction_model_version', 'prediction_probabilities' y 'prediction_features_hash'
+    (huella de las variables con las que se predijo).
+    """
+    if not predictions:
+        return 0
+    # Los pacientes del bloque pueden cambiar de perfil: se resta su aportación
+    # agrupada antes del UPDATE y se suma la de después
+    patient_ids = [prediction["id"] for prediction in predictions]
+    before = patient_stats.snapshot(db, patient_ids)
+    statement = (
+        update(models.Patient)
+        .where(models.Patient.id == bindparam("b_id"))
+        .values(
+            prediction_profile=bindparam("b_profile"),
+            prediction_description=bindparam("b_description"),
+            prediction_model_version=bindparam("b_model_version"),
+            prediction_probabilities=bindparam("b_probabilities", type_=models.Patient.prediction_probabilities.type),
+            prediction_features_hash=bindparam("b_features_hash"),
+            # Los pacientes anteriores a la huella la reciben aquí sin pisar una más reciente
+            features_hash=func.coalesce(models.Patient.features_hash, bindparam("b_features_hash")),
+        )
+    )
+    # Por la conexión (executemany de Core): el "bulk update" del ORM no admite este WHERE
+    db.connection().execute(statement, [
+        {
+            "b_id": prediction["id"],
+            "b_profile": prediction["prediction_profile"],
+            "b_description": prediction["prediction_description"],
+            "b_model_version": prediction["prediction_model_version"],
+            "b_probabilities": prediction["prediction_probabilities"],
+            "b_features_hash": prediction["prediction_features_hash"],
+        }
+        for prediction in predictions
+    ])
+    patient_stats.apply_deltas(db, patient_stats.snapshot_deltas(before, patient_stats.snapshot(db, patient_ids)))
+    # La instantánea de antes tiene un grupo por cada médico con pacientes en el bloque
+    versioning.bump_rosters(db, [row["owner_id"] for row in before])
+    db.commit()
+    return len(predictions)
+
+# --- Trabajos en segundo plano (app/jobs.py) ---
+
+def create_job(db: Session, kind: str, owner_id: int | None, params: dict, created_at):
+    db_job = models.Job(kind=kind, owner_id=owner_id, params=params, status="queued",
+                        progress=0, attempts=0, created_at=created_at)
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_job(db: Session, job_id: int, owner_id: int | None = None):
+    """Con `owner_id` solo devuelve el trabajo si pertenece a ese médico."""
+    query = db.query(models.Job).filter(models.Job.id == job_id)
+    if owner_id is not None:
+        query = query.filter(models.Job.owner_id == owner_id)
+    return query.first()
+
+def get_jobs(db: Session, owner_id: int | None = None, status: list[str] | None = None, kind: str | None = None,
+             limit: int = 100, before_id: int | None = None, only_global: bool = False):
+    """
+    Trabajos del más reciente al más antiguo (paginación por clave: id < before_id).
+    `only_global` devuelve solo los de administración (sin médico).
+    """
+    query = db.query(models.Job)
+    if owner_id is not None:
+        query = query.filter(models.Job.owner_id == owner_id)
+    elif only_global:
+        query = query.filter(models.Job.owner_id.is_(None))
+    if status:
+        query = query.filter(models.Job.status.in_(status))
+    if kind is not None:
+        query = query.filter(models.Job.kind == kind)
+    if before_id is not None:
+        query = query.filter(models.Job.id < before_id)
+    return query.order_by(models.Job.id.desc()).limit(limit).all()
+
+# --- Estadísticas precalculadas (app/patient_stats.py) ---
+
+def get_patient_stats_rows(db: Session, owner_id: int | None = None):
+    """Filas de patient_stats de un médico (o de todos, ordenadas por médico)."""
+    query = db.query(models.PatientStats)
+    if owner_id is not None:
+        query = query.filter(models.PatientStats.owner_id == owner_id)
+    return query.order_by(models.PatientStats.owner_id, models.PatientStats.profile).all()
@@ -1,8 +1,12 @@
 # app/database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 import os
+import time
+
+from .metrics import instrument_engine
 
 # Lee la URL de la base de datos desde una variable de entorno
 # IMPORTANTE: Render proporciona la URL con formato postgresql:// 
@@ -11,29 +15,167 @@ DATABASE_URL = os.getenv(
     "DATABASE_URL",
     "sqlite:///./test.db"  # Fallback para desarrollo local
 )
+# Réplica de solo lectura opcional: los endpoints de lectura (listado, detalle,
+# estadísticas) usan get_read_db / get_async_read_db, que apuntan aquí si existe
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+
+# --- Pool de conexiones ---
+# Cada worker de uvicorn (WEB_CONCURRENCY) tiene dos pools, uno síncrono y otro
+# asíncrono. Por defecto los pools se reparten DB_MAX_CONNECTIONS en lugar de
+# abrir 10 + 20 conexiones cada uno. Con un solo worker salen 10 + 20 por pool.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "60"))
+_PER_POOL = max(2, DB_MAX_CONNECTIONS // (WEB_CONCURRENCY * 2))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(max(1, _PER_POOL // 3))))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(max(0, _PER_POOL - DB_POOL_SIZE))))
+# Segundos de espera por una conexión libre antes de fallar
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Las conexiones con más de estos segundos se cierran y se abren de nuevo (-1 = nunca)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Comprobación de la conexión al sacarla del pool:
+#   always: SELECT 1 en cada checkout (un viaje de ida y vuelta más por petición)
+#   idle:   solo si la conexión lleva más de DB_POOL_PING_IDLE segundos sin usarse
+#   off:    nunca (las conexiones caídas se detectan al fallar la sentencia)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "idle").lower()
+DB_POOL_PING_IDLE = float(os.getenv("DB_POOL_PING_IDLE", "30"))
+# Tiempo máximo de cada sentencia en PostgreSQL, en ms (0 = sin límite)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# SQLite (desarrollo y carga local): modo WAL, para que las lecturas no esperen a
+# las escrituras, y espera máxima (ms) cuando la BD está bloqueada
+SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() in ("1", "true", "yes")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _sync_url(url: str) -> str:
+    # Conversión necesaria para Render (psycopg2)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+psycopg2://", 1)
+    return url
+
+
+def _async_url(url: str) -> str:
+    # asyncpg en PostgreSQL, aiosqlite en local
+    if url.startswith("postgresql+psycopg2://"):
+        return url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+def _engine_options(url: str, is_async: bool) -> dict:
+    if url.startswith("sqlite"):
+        # SQLite usa el pool por defecto; deshabilita la comprobación de hilo
+        return {} if is_async else {"connect_args": {"check_same_thread": False}}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING == "always",
+    }
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        if SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            # En WAL, NORMAL solo sincroniza en los checkpoints (seguro ante caídas del proceso)
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA cache_size=-20000")  # ~20 MB de caché de páginas
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def _install_idle_ping(sync_engine):
+    """Comprueba con un ping solo las conexiones que llevan un rato sin usarse."""
+    dialect = sync_engine.dialect
+
+    @event.listens_for(sync_engine, "checkin")
+    def _mark_checkin(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(sync_engine, "checkout")
+    def _ping_if_idle(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.get("checked_in_at")
+        if checked_in_at is None or time.monotonic() - checked_in_at < DB_POOL_PING_IDLE:
+            return
+        try:
+            dialect.do_ping(dbapi_connection)
+        except Exception:
+            # El pool descarta esta conexión y lo reintenta con una nueva
+            raise exc.DisconnectionError()
+
+
+def _configure(sync_engine, url: str):
+    if url.startswith("sqlite"):
+        event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+    elif DB_POOL_PRE_PING == "idle":
+        _install_idle_ping(sync_engine)
+
+
+def _create_engines(url: str):
+    """Motor síncrono y asíncrono para una URL, con la configuración del pool."""
+    sync_url, async_url = _sync_url(url), _async_url(_sync_url(url))
+    sync_engine = create_engine(sync_url, **_engine_options(sync_url, is_async=False))
+    async_engine = create_async_engine(async_url, **_engine_options(async_url, is_async=True))
+    _configure(sync_engine, sync_url)
+    _configure(async_engine.sync_engine, async_url)
+    return sync_engine, async_engine
 
-# Conversión necesaria para Render (psycopg2)
-if DATABASE_URL and DATABASE_URL.startswith("postgresql://"):
-    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg2://", 1)
-
-# Crea el motor de SQLAlchemy
-# Para SQLite en desarrollo, deshabilita validación de foreign keys
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL, 
-        connect_args={"check_same_thread": False}
-    )
+
+DATABASE_URL = _sync_url(DATABASE_URL)
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
+# Motores de la BD principal: síncrono (startup, admin, trabajos) y asíncrono
+# (los endpoints 'async def', que así no dependen del thread pool de Starlette)
+engine, async_engine = _create_engines(DATABASE_URL)
+
+# Motores de lectura: los de la réplica si hay, si no los principales
+if DATABASE_REPLICA_URL:
+    read_engine, async_read_engine = _create_engines(DATABASE_REPLICA_URL)
 else:
-    # Para PostgreSQL en producción
-    engine = create_engine(
-        DATABASE_URL,
-        pool_size=10,
-        max_overflow=20,
-        pool_pre_ping=True  # Verifica conexiones antes de usarlas
-    )
+    read_engine, async_read_engine = engine, async_engine
 
 # Crea una clase SessionLocal para las sesiones de la base de datos
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# expire_on_commit=False: tras el commit los objetos se pueden seguir leyendo
+# sin lanzar una carga perezosa (no permitida en modo asíncrono).
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+# Métricas de sentencias SQL y de espera del pool (ver app/metrics.py)
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+if DATABASE_REPLICA_URL:
+    instrument_engine(read_engine, "sync_replica")
+    instrument_engine(async_read_engine.sync_engine, "async_replica")
+
+
+def _pool_capacity(url: str) -> int | None:
+    """Conexiones máximas del pool (pool_size + max_overflow); None si no las fija _engine_options (SQLite)."""
+    options = _engine_options(url, is_async=False)
+    return options["pool_size"] + options["max_overflow"] if "pool_size" in options else None
+
+
+def engine_pools() -> list:
+    """(nombre, pool, capacidad) de cada motor, para las métricas de ocupación."""
+    capacity = _pool_capacity(DATABASE_URL)
+    pools = [("sync", engine.pool, capacity), ("async", async_engine.pool, capacity)]
+    if DATABASE_REPLICA_URL:
+        capacity = _pool_capacity(DATABASE_REPLICA_URL)
+        pools += [("sync_replica", read_engine.pool, capacity), ("async_replica", async_read_engine.pool, capacity)]
+    return pools
 
 # Base para que nuestros modelos ORM hereden de ella
 Base = declarative_base()
@@ -44,4 +186,55 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Dependencia equivalente para los endpoints asíncronos
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Sesiones de solo lectura (réplica si DATABASE_REPLICA_URL está definida). La
+# réplica puede ir unos instantes por detrás: no usarlas para leer algo recién escrito.
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+def create_missing_indexes():
+    """
+    create_all() no añade índices nuevos a tablas que ya existen;
+    esta función crea los que falten (útil tras desplegar índices nuevos).
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+def create_missing_columns():
+    """
+    create_all() tampoco añade columnas nuevas a tablas existentes; esta función
+    añade las que falten (solo columnas opcionales, que no necesitan valor por defecto).
+    """
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    print(f"⚠ La columna obligatoria {table.name}.{column.name} debe añadirse a mano")
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {column_type}"
+                ))
+                print(f"✓ Columna {table.name}.{column.name} añadida")
@@ -1,19 +1,29 @@
 # app/dependencies.py
 
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+import secrets
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # CORRECCIÓN 1: Se importa 'models' para usar los tipos de la base de datos
-from . import schemas, crud, auth, models
-from .database import get_db
+from . import schemas, async_crud, auth, models, pagination
+from .database import get_db, get_async_db, get_read_db, get_async_read_db
+from .auth_cache import auth_cache, UserSnapshot
+from .rate_limit import rate_limiter, LIST_ROWS_PER_TOKEN
+from .metrics import METRICS_TOKEN
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
 
-# CORRECCIÓN 2: Se simplifican las funciones a síncronas (se quita 'async')
-# ya que no realizan operaciones de I/O que requieran 'await'.
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+# La resolución del usuario es asíncrona (AsyncSession): en caso de fallo de caché
+# la consulta a la BD no ocupa un hilo del thread pool de Starlette.
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> UserSnapshot:
+    # Si el token ya se resolvió hace poco no se vuelve a decodificar ni a consultar la BD
+    cached_user = auth_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudieron validar las credenciales",
@@ -29,19 +39,25 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         raise credentials_exception
     
     # CORRECCIÓN 3: El tipo de 'user' es 'models.User', que es lo que devuelve CRUD
-    user: models.User = crud.get_user_by_email(db=db, email=token_data.email)
+    user: models.User = await async_crud.get_user_by_email(db=db, email=token_data.email)
     if user is None:
         raise credentials_exception
-    return user
 
-# El tipo de 'current_user' es 'models.User' porque eso es lo que devuelve 'get_current_user'
-def get_current_active_user(current_user: models.User = Depends(get_current_user)) -> models.User:
+    # Se guarda una copia inmutable (no el objeto ORM, ligado a esta sesión)
+    snapshot = UserSnapshot(
+        id=user.id, email=user.email, full_name=user.full_name, role=user.role, is_active=user.is_active
+    )
+    auth_cache.set(token, snapshot, token_exp=payload.get("exp", float("inf")))
+    return snapshot
+
+# 'current_user' es un UserSnapshot con los mismos campos que usan los endpoints de 'models.User'
+def get_current_active_user(current_user: UserSnapshot = Depends(get_current_user)) -> UserSnapshot:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Usuario inactivo")
     return current_user
 
 # CORRECCIÓN 4: Renombrada de 'is_admin' a 'get_current_active_admin' por consistencia
-def get_current_active_admin(current_user: models.User = Depends(get_current_active_user)) -> models.User:
+def get_current_active_admin(current_user: UserSnapshot = Depends(get_current_active_user)) -> UserSnapshot:
     # Se compara directamente con el string del rol para mayor claridad
     if current_user.role != "admin":
         raise HTTPException(
@@ -52,11 +68,72 @@ def get_current_active_admin(current_user: models.User = Depends(get_current_act
 
 # CORRECCIÓN 5: Renombrada de 'is_physician' a 'get_current_active_medico'
 # ESTA ES LA CORRECCIÓN PRINCIPAL QUE SOLUCIONA EL ERROR DE DESPLIEGUE
-def get_current_active_medico(current_user: models.User = Depends(get_current_active_user)) -> models.User:
+def get_current_active_medico(current_user: UserSnapshot = Depends(get_current_active_user)) -> UserSnapshot:
     # Se compara con 'médico' para alinearse con el Enum de 'schemas.py'
     if current_user.role != "médico":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Operación no permitida. Se requiere rol de médico."
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+def inference_queue_full_exception() -> HTTPException:
+    """Respuesta 503 cuando la cola de micro-batching de predicciones está llena."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Demasiadas predicciones en curso. Intenta de nuevo en unos segundos.",
+        headers={"Retry-After": "1"},
+    )
+
+def password_pool_saturated_exception() -> HTTPException:
+    """Respuesta 429 cuando el pool de bcrypt no admite más trabajo."""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Demasiadas operaciones de autenticación en curso. Intenta de nuevo en unos segundos.",
+        headers={"Retry-After": "1"},
+    )
+
+# --- Límite de peticiones (app/rate_limit.py) ---
+# Se usan en `dependencies=[...]` de cada ruta; comparten con el endpoint la
+# resolución del usuario y el formulario de login (FastAPI las cachea por petición).
+
+async def rate_limit_login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    """Por IP y por cuenta (el correo enviado), antes de verificar la contraseña con bcrypt."""
+    await rate_limiter.hit(request, "login", user=form_data.username.strip().lower() or None)
+
+async def rate_limit_predict(request: Request, current_user: UserSnapshot = Depends(get_current_active_user)):
+    await rate_limiter.hit(request, "predict", user=current_user.id)
+
+async def rate_limit_listing(request: Request, limit: int = pagination.limit_query(100),
+                             current_user: UserSnapshot = Depends(get_current_active_user)):
+    """Cada LIST_ROWS_PER_TOKEN filas pedidas en `limit` cuestan una ficha."""
+    await rate_limiter.hit(request, "list", user=current_user.id, cost=max(1, -(-limit // LIST_ROWS_PER_TOKEN)))
+
+async def prediction_slot(current_user: UserSnapshot = Depends(get_current_active_user)):
+    """Ocupa una plaza de predicción simultánea del usuario mientras dura la petición."""
+    acquired = await rate_limiter.acquire_prediction_slot(current_user.id)
+    try:
+        yield
+    finally:
+        if acquired:
+            await rate_limiter.release_prediction_slot(current_user.id)
+
+# --- GET /metrics ---
+
+async def require_metrics_access(
+    credentials: HTTPAuthorizationCredentials | None = Depends(HTTPBearer(auto_error=False)),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Con METRICS_TOKEN, ese token (el que envía Prometheus); sin él, el de un administrador."""
+    unauthorized = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="No se pudieron validar las credenciales",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if credentials is None:
+        raise unauthorized
+    if METRICS_TOKEN:
+        if not secrets.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+            raise unauthorized
+        return
+    get_current_active_admin(get_current_active_user(await get_current_user(credentials.credentials, db)))
@@ -0,0 +1,24 @@
+# app/fingerprint.py
+#
+# Huella de las 13 variables del modelo de un paciente. Se guarda en
+# Patient.features_hash cada vez que se escriben sus datos y en
+# Patient.prediction_features_hash cuando se guarda una predicción: si no
+# coinciden, la predicción guardada ya no corresponde a los datos actuales.
+
+import hashlib
+import json
+
+from . import schemas
+
+
+def feature_row(source) -> tuple:
+    """Fila canónica (orden de PREDICTION_FEATURES) a partir de un dict o de un objeto con atributos."""
+    if isinstance(source, dict):
+        return tuple(source[name] for name in schemas.PREDICTION_FEATURES)
+    return tuple(getattr(source, name) for name in schemas.PREDICTION_FEATURES)
+
+
+def features_fingerprint(row) -> str:
+    """Hash corto (16 caracteres hex) de una fila canónica de variables."""
+    payload = json.dumps(list(row), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
@@ -0,0 +1,550 @@
+# app/inference.py
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.dummy import DummyClassifier
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
+
+from . import metrics, model_registry, schemas
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', 'model', 'model_pipeline.joblib')
+
+
+class LoadedModel(NamedTuple):
+    model: object
+    engine: "CompiledPipeline | None"
+    version: str
+    loaded_at: float
+    manifest: dict | None = None  # None para el archivo clásico model_pipeline.joblib
+
+
+class PredictionDetail(NamedTuple):
+    profiles: np.ndarray
+    # (filas, perfiles): probabilidad de cada perfil, en el orden de classes_ del modelo
+    probabilities: np.ndarray
+    # (filas, variables de entrada): contribución de cada variable al perfil
+    # predicho, o None si no se pidió o el modelo no está compilado
+    contributions: np.ndarray | None
+
+
+# Descripciones asociadas a cada perfil que devuelve el modelo
+PROFILE_DESCRIPTIONS = {
+    0: "Perfil de Barreras Bajas",
+    1: "Perfil de Barreras Moderadas",
+    2: "Perfil de Barreras Altas"
+}
+
+# Variables (las de mayor contribución) que se devuelven al explicar una predicción
+EXPLANATION_TOP_K = int(os.getenv("EXPLANATION_TOP_K", "3"))
+
+# Cada cuántos segundos se comprueba si cambió la versión activa del modelo
+MODEL_CHECK_INTERVAL = float(os.getenv("MODEL_CHECK_INTERVAL", "5"))
+
+# Hilos dedicados a la inferencia desde endpoints asíncronos (trabajo de CPU
+# que no debe ejecutarse en el event loop)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+
+# Filas a partir de las cuales se usa el pipeline de sklearn en vez del motor
+# compilado: el compilado gana en filas sueltas y lotes pequeños, pero su
+# recorrido de los árboles con NumPy escala peor que el de sklearn (ver
+# benchmarks/bench_model.py). Las explicaciones usan siempre el compilado.
+COMPILED_MAX_ROWS = int(os.getenv("COMPILED_MAX_ROWS", "200"))
+_inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+
+# Fila de ejemplo para calentar el modelo tras cargarlo
+WARMUP_ROW = (42, 'Masculino', 'Heterosexual', 'Accidente de tránsito', 'NO', 'SI', 25, 50, 75, 100, 50, 25, 55)
+
+# Modelo, motor compilado y versión se sustituyen juntos (cargados lazily)
+_loaded: LoadedModel | None = None
+_load_lock = threading.Lock()
+_reload_thread: threading.Thread | None = None
+_last_check = 0.0
+
+
+class CompiledPipeline:
+    """
+    Versión "compilada" del pipeline entrenado (ColumnTransformer + GradientBoostingClassifier)
+    para predecir sin construir DataFrames de pandas.
+
+    Al crearse precalcula:
+      - los arrays min_/scale_ del MinMaxScaler,
+      - un diccionario categoría -> columna one-hot por cada variable categórica,
+      - todos los árboles del boosting aplanados en arrays de NumPy,
+      - la variable de entrada de la que sale cada columna transformada
+        (para repartir las contribuciones de las explicaciones).
+
+    Las filas de entrada son secuencias de valores en el orden de `input_features`.
+    """
+
+    # Se guarda en los artefactos del registro; si cambian los atributos de la
+    # clase hay que incrementarlo para que los motores antiguos se recompilen.
+    FORMAT_VERSION = 2
+
+    def __init__(self, pipeline, input_features=None):
+        preprocessor = pipeline.steps[0][1]
+        classifier = pipeline.steps[-1][1]
+        if len(pipeline.steps) != 2 or not isinstance(preprocessor, ColumnTransformer):
+            raise TypeError("Solo se soportan pipelines (ColumnTransformer, clasificador)")
+        if not isinstance(classifier, GradientBoostingClassifier):
+            raise TypeError(f"Clasificador no soportado: {type(classifier).__name__}")
+
+        self.input_features = list(input_features or preprocessor.feature_names_in_)
+        position = {name: i for i, name in enumerate(self.input_features)}
+
+        self._compile_preprocessor(preprocessor, position)
+        self._compile_trees(classifier)
+
+    # --- Compilación ---
+
+    def _compile_preprocessor(self, preprocessor, position):
+        num_src, num_dst, mins, scales, clip = [], [], [], [], []
+        self._cat_lookups = []
+        input_of = []
+        offset = 0
+
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == 'drop' or len(columns) == 0:
+                continue
+            # ColumnTransformer guarda el remainder como índices de columna
+            columns = [preprocessor.feature_names_in_[c] if not isinstance(c, str) else c for c in columns]
+
+            if isinstance(transformer, MinMaxScaler) or transformer == 'passthrough':
+                for j, column in enumerate(columns):
+                    num_src.append(position[column])
+                    num_dst.append(offset + j)
+                    input_of.append(position[column])
+                    if transformer == 'passthrough':
+                        mins.append(0.0)
+                        scales.append(1.0)
+                        clip.append(None)
+                    else:
+                        mins.append(transformer.min_[j])
+                        scales.append(transformer.scale_[j])
+                        clip.append(transformer.feature_range if transformer.clip else None)
+                offset += len(columns)
+
+            elif isinstance(transformer, OneHotEncoder):
+                if transformer.drop_idx_ is not None or transformer._infrequent_enabled:
+                    raise TypeError("OneHotEncoder con 'drop' o categorías infrecuentes no soportado")
+                if transformer.handle_unknown == 'error':
+                    raise TypeError("OneHotEncoder con handle_unknown='error' no soportado")
+                for column, categories in zip(columns, transformer.categories_):
+                    lookup = {category: offset + k for k, category in enumerate(categories.tolist())}
+                    self._cat_lookups.append((position[column], lookup))
+                    input_of.extend([position[column]] * len(categories))
+                    offset += len(categories)
+
+            else:
+                raise TypeError(f"Transformador no soportado: {type(transformer).__name__}")
+
+        self.n_features_out = offset
+        self._num_src = np.asarray(num_src, dtype=np.intp)
+        self._num_dst = np.asarray(num_dst, dtype=np.intp)
+        self._num_min = np.asarray(mins, dtype=np.float64)
+        self._num_scale = np.asarray(scales, dtype=np.float64)
+        self._num_clip = [(j, bounds) for j, bounds in enumerate(clip) if bounds is not None]
+        self._input_of = np.asarray(input_of, dtype=np.intp)
+
+    def _compile_trees(self, classifier):
+        if not (classifier.init_ == 'zero' or
+                (isinstance(classifier.init_, DummyClassifier) and classifier.init_.strategy == 'prior')):
+            raise TypeError("Solo se soporta el estimador inicial 'zero' o 'prior'")
+
+        # Con init 'prior' la predicción inicial es la misma constante para cualquier fila
+        dummy = np.zeros((1, self.n_features_out), dtype=np.float32)
+        self._init_raw = classifier._raw_predict_init(dummy)[0].astype(np.float64)
+        self._learning_rate = float(classifier.learning_rate)
+        self.classes_ = classifier.classes_
+
+        estimators = classifier.estimators_
+        self._n_stages, self._n_trees_per_stage = estimators.shape
+
+        left, right, feature, threshold, value, roots = [], [], [], [], [], []
+        node_offset = 0
+        max_depth = 0
+        # Orden etapa-mayor: el árbol t corresponde a la etapa t // K y la clase t % K
+        for estimator in estimators.ravel():
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            # Las hojas apuntan a sí mismas para poder recorrer todos los árboles
+            # con el mismo número de pasos (la profundidad máxima).
+            left.append(np.where(is_leaf, nodes, tree.children_left) + node_offset)
+            right.append(np.where(is_leaf, nodes, tree.children_right) + node_offset)
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(tree.threshold)
+            value.append(tree.value[:, 0, 0])
+            roots.append(node_offset)
+            node_offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        self._left = np.concatenate(left).astype(np.intp)
+        self._right = np.concatenate(right).astype(np.intp)
+        self._feature = np.concatenate(feature).astype(np.intp)
+        self._threshold = np.concatenate(threshold).astype(np.float64)
+        self._value = np.concatenate(value).astype(np.float64)
+        self._roots = np.asarray(roots, dtype=np.intp)
+        self._max_depth = max_depth
+
+    # --- Inferencia ---
+
+    def transform(self, rows):
+        """Equivalente a `preprocessor.transform` para una lista de filas."""
+        X = np.zeros((len(rows), self.n_features_out), dtype=np.float64)
+
+        if len(self._num_src):
+            numeric = np.array([[row[i] for i in self._num_src] for row in rows], dtype=np.float64)
+            numeric *= self._num_scale
+            numeric += self._num_min
+            for j, (low, high) in self._num_clip:
+                np.clip(numeric[:, j], low, high, out=numeric[:, j])
+            X[:, self._num_dst] = numeric
+
+        for r, row in enumerate(rows):
+            for src, lookup in self._cat_lookups:
+                column = lookup.get(row[src])
+                if column is not None:  # categorías desconocidas se ignoran
+                    X[r, column] = 1.0
+        return X
+
+    def _raw_predict(self, rows, explain=False):
+        """
+        Suma cruda del boosting con una sola transformación y un solo recorrido
+        de los árboles. Con `explain` devuelve también, por fila y clase, la
+        contribución de cada variable de entrada: en cada paso del recorrido el
+        cambio de valor entre un nodo y su hijo se atribuye a la variable que
+        decide el corte (descomposición por caminos de Saabas). Se cumple
+        raw = bias + contribuciones.sum(axis=-1).
+        """
+        X = self.transform(rows)
+        # Los árboles de sklearn comparan en float32
+        X = X.astype(np.float32)
+        n_rows = X.shape[0]
+        n_trees = self._roots.size
+        K = self._n_trees_per_stage
+        row_index = np.arange(n_rows)[:, None]
+
+        nodes = np.broadcast_to(self._roots, (n_rows, n_trees))
+        if explain:
+            n_inputs = len(self.input_features)
+            # Índice plano (fila, clase del árbol) al que se suma cada paso
+            base = (row_index * K + np.arange(n_trees) % K) * n_inputs
+            contributions = np.zeros(n_rows * K * n_inputs, dtype=np.float64)
+        for _ in range(self._max_depth):
+            feature = self._feature[nodes]
+            goes_left = X[row_index, feature] <= self._threshold[nodes]
+            children = np.where(goes_left, self._left[nodes], self._right[nodes])
+            if explain:
+                # En las hojas (que apuntan a sí mismas) la diferencia es 0
+                delta = self._value[children] - self._value[nodes]
+                contributions += np.bincount(
+                    (base + self._input_of[feature]).ravel(), weights=delta.ravel(),
+                    minlength=contributions.size,
+                )
+            nodes = children
+
+        leaves = self._value[nodes].reshape(n_rows, self._n_stages, K)
+        raw = self._init_raw + self._learning_rate * leaves.sum(axis=1)
+        if not explain:
+            return raw, None
+        contributions = self._learning_rate * contributions.reshape(n_rows, K, n_inputs)
+        return raw, contributions
+
+    @staticmethod
+    def _raw_to_proba(raw):
+        # Misma función de enlace que la pérdida de sklearn: sigmoide para
+        # clasificación binaria y softmax para multiclase.
+        if raw.shape[1] == 1:
+            positive = 1.0 / (1.0 + np.exp(-raw[:, 0]))
+            return np.column_stack([1.0 - positive, positive])
+        exp = np.exp(raw - raw.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def decision_function(self, rows):
+        """Suma cruda del boosting (equivalente a `classifier.decision_function`)."""
+        raw, _ = self._raw_predict(rows)
+        return raw[:, 0] if self._n_trees_per_stage == 1 else raw
+
+    def predict(self, rows):
+        """Equivalente a `pipeline.predict` para una lista de filas."""
+        raw = self.decision_function(rows)
+        if raw.ndim == 1:
+            return self.classes_[(raw > 0).astype(int)]
+        return self.classes_[np.argmax(raw, axis=1)]
+
+    def predict_proba(self, rows):
+        """Equivalente a `pipeline.predict_proba` para una lista de filas."""
+        raw, _ = self._raw_predict(rows)
+        return self._raw_to_proba(raw)
+
+    def predict_detailed(self, rows, explain=False):
+        """
+        Perfil, probabilidades y (con `explain`) contribuciones de cada variable
+        de entrada al perfil predicho, todo de la misma pasada por el modelo.
+        Las contribuciones están en la escala cruda del boosting (log-odds).
+        """
+        raw, contributions = self._raw_predict(rows, explain=explain)
+        proba = self._raw_to_proba(raw)
+        predicted = np.argmax(proba, axis=1)
+        if contributions is not None:
+            if self._n_trees_per_stage == 1:
+                # Binaria: los árboles suman hacia la clase positiva
+                sign = np.where(predicted == 1, 1.0, -1.0)
+                contributions = contributions[:, 0, :] * sign[:, None]
+            else:
+                contributions = contributions[np.arange(len(predicted)), predicted, :]
+        return self.classes_[predicted], proba, contributions
+
+
+def _source_version():
+    """
+    Versión activa del registro de modelos (model/registry/ACTIVE) o, si no hay
+    registro, la del archivo clásico model_pipeline.joblib ('file:' + mtime + tamaño).
+    """
+    version = model_registry.get_active_version()
+    if version is not None:
+        return version
+    stat = os.stat(MODEL_PATH)
+    return f"file:{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def _compile(model):
+    try:
+        engine = CompiledPipeline(model, input_features=schemas.PREDICTION_FEATURES)
+        print("✓ Motor de inferencia compilado")
+        return engine
+    except (TypeError, AttributeError, KeyError) as e:
+        print(f"⚠ No se pudo compilar el modelo, se usará pandas + sklearn: {e}")
+        return None
+
+
+def _load(version) -> LoadedModel:
+    """Carga, compila y calienta el modelo. No toca el modelo activo."""
+    if version.startswith("file:"):
+        try:
+            model = joblib.load(MODEL_PATH)
+            print(f"✓ Modelo cargado desde: {MODEL_PATH}")
+        except Exception as e:
+            raise RuntimeError(f"Error al cargar el modelo: {e}")
+        engine, manifest = _compile(model), None
+    else:
+        try:
+            # mmap: los arrays del artefacto se comparten entre los workers
+            model, engine, manifest = model_registry.load_version(version)
+            print(f"✓ Modelo {version} cargado desde el registro")
+        except Exception as e:
+            raise RuntimeError(f"Error al cargar el modelo {version}: {e}")
+        if engine is None:
+            engine = _compile(model)
+
+    loaded = LoadedModel(model=model, engine=engine, version=version, loaded_at=time.time(), manifest=manifest)
+
+    # Predicción de calentamiento: la primera llamada real no paga
+    # las importaciones ni las inicializaciones perezosas de sklearn.
+    predict_profiles([WARMUP_ROW], loaded=loaded)
+    if loaded.engine is not None:
+        loaded.model.predict(pd.DataFrame([WARMUP_ROW], columns=schemas.PREDICTION_FEATURES))
+    return loaded
+
+
+def _reload_in_background():
+    global _loaded, _reload_thread
+
+    try:
+        version = _source_version()
+        if _loaded is None or _loaded.version != version:
+            # El intercambio es una única asignación: las peticiones en curso
+            # terminan con el modelo anterior y las nuevas usan el nuevo.
+            _loaded = _load(version)
+            print(f"✓ Modelo recargado en caliente (versión {version})")
+    except Exception as e:
+        print(f"⚠ No se pudo recargar el modelo, se mantiene la versión anterior: {e}")
+    finally:
+        with _load_lock:
+            _reload_thread = None
+
+
+def reload_model_async() -> bool:
+    """
+    Lanza la recarga del modelo en un hilo de fondo.
+    Devuelve False si ya había una recarga en curso.
+    """
+    global _reload_thread
+
+    with _load_lock:
+        if _reload_thread is not None:
+            return False
+        _reload_thread = threading.Thread(target=_reload_in_background, name="model-reload", daemon=True)
+        _reload_thread.start()
+        return True
+
+
+def is_reloading() -> bool:
+    return _reload_thread is not None
+
+
+def get_loaded_model() -> LoadedModel:
+    """
+    Devuelve el modelo activo. La primera vez se carga de forma síncrona;
+    después, si cambia la versión activa del registro (o el archivo clásico en
+    disco), el nuevo modelo se carga en segundo plano mientras se sigue sirviendo el actual.
+    """
+    global _loaded, _last_check
+
+    loaded = _loaded
+    if loaded is None:
+        with _load_lock:
+            if _loaded is None:
+                try:
+                    version = _source_version()
+                except FileNotFoundError:
+                    raise RuntimeError(
+                        f"⚠️ No hay versión activa en {model_registry.REGISTRY_DIR} "
+                        f"ni archivo del modelo en: {MODEL_PATH}\n"
+                        "Por favor, ejecuta: python model/train_model.py"
+                    )
+                _loaded = _load(version)
+            return _loaded
+
+    now = time.monotonic()
+    if now - _last_check >= MODEL_CHECK_INTERVAL:
+        _last_check = now
+        try:
+            version = _source_version()
+        except FileNotFoundError:
+            # Si el archivo desaparece se sigue usando el modelo ya cargado
+            version = None
+        if version is not None and version != loaded.version:
+            reload_model_async()
+    return loaded
+
+
+def warm_up():
+    """Carga y calienta el modelo (se llama en el evento de startup de cada worker)."""
+    return get_loaded_model()
+
+
+def get_model():
+    """Devuelve el pipeline de sklearn cargado."""
+    return get_loaded_model().model
+
+
+def get_engine():
+    """
+    Devuelve la versión compilada del modelo, o None si el pipeline
+    tiene algún paso que el motor compilado no soporta.
+    """
+    return get_loaded_model().engine
+
+
+def get_model_version():
+    """Identificador de la versión del modelo cargado."""
+    return get_loaded_model().version
+
+
+def _use_engine(loaded: LoadedModel, rows, explain: bool = False) -> bool:
+    return loaded.engine is not None and (explain or len(rows) <= COMPILED_MAX_ROWS)
+
+
+def predict_profiles(rows, loaded: LoadedModel | None = None):
+    """
+    Predice el perfil de una lista de filas (valores en el orden de
+    `schemas.PREDICTION_FEATURES`). Usa el motor compilado si está disponible
+    y el lote no pasa de COMPILED_MAX_ROWS filas.
+    """
+    loaded = loaded or get_loaded_model()
+    start = time.perf_counter()
+    if _use_engine(loaded, rows):
+        predictions = loaded.engine.predict(rows)
+        engine = "compiled"
+    else:
+        input_df = pd.DataFrame(list(rows), columns=schemas.PREDICTION_FEATURES)
+        predictions = loaded.model.predict(input_df)
+        engine = "sklearn"
+    metrics.record_model_inference(engine, len(predictions), time.perf_counter() - start)
+    return predictions
+
+
+def predict_detailed(rows, loaded: LoadedModel | None = None, explain: bool = False) -> PredictionDetail:
+    """
+    Como predict_profiles, pero devuelve también las probabilidades de cada
+    perfil y, con `explain`, la contribución de cada variable. El preprocesado
+    y el recorrido de los árboles se hacen una sola vez para todo. Sin motor
+    compilado no hay contribuciones (sklearn no las calcula para el boosting),
+    así que con `explain` se usa el compilado sea cual sea el tamaño del lote.
+    """
+    loaded = loaded or get_loaded_model()
+    start = time.perf_counter()
+    if _use_engine(loaded, rows, explain):
+        profiles, probabilities, contributions = loaded.engine.predict_detailed(rows, explain=explain)
+        engine = "compiled"
+    else:
+        input_df = pd.DataFrame(list(rows), columns=schemas.PREDICTION_FEATURES)
+        # predict() de sklearn es el argmax de predict_proba(): una sola pasada
+        probabilities = loaded.model.predict_proba(input_df)
+        profiles = loaded.model.classes_[np.argmax(probabilities, axis=1)]
+        contributions = None
+        engine = "sklearn"
+    metrics.record_model_inference(engine, len(profiles), time.perf_counter() - start)
+    return PredictionDetail(profiles, probabilities, contributions)
+
+
+def round_probabilities(probabilities) -> list:
+    """Probabilidades de una fila como lista de floats redondeados (se guardan en el paciente)."""
+    return [round(float(p), 6) for p in probabilities]
+
+
+def top_contributions(row, contributions, k: int = EXPLANATION_TOP_K) -> list:
+    """Las `k` variables que más pesan en la predicción de una fila (por valor absoluto)."""
+    order = np.argsort(-np.abs(contributions), kind="stable")[:k]
+    return [
+        {
+            "feature": schemas.PREDICTION_FEATURES[i],
+            "value": row[i],
+            "contribution": round(float(contributions[i]), 6),
+        }
+        for i in order
+        if contributions[i] != 0
+    ]
+
+
+async def get_loaded_model_async() -> LoadedModel:
+    """Como get_loaded_model; si hay que cargar el modelo se hace fuera del event loop."""
+    if _loaded is not None:
+        return get_loaded_model()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_inference_executor, get_loaded_model)
+
+
+async def predict_profiles_async(rows, loaded: LoadedModel | None = None):
+    """Ejecuta predict_profiles en el pool de inferencia, sin bloquear el event loop."""
+    loaded = loaded or await get_loaded_model_async()
+    loop = asyncio.get_running_loop()
+    # Se copia el contexto para que el tiempo de inferencia se sume a la petición
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_inference_executor, context.run, predict_profiles, rows, loaded)
+
+
+async def predict_detailed_async(rows, loaded: LoadedModel | None = None, explain: bool = False) -> PredictionDetail:
+    """Ejecuta predict_detailed en el pool de inferencia, sin bloquear el event loop."""
+    loaded = loaded or await get_loaded_model_async()
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _inference_executor, context.run, predict_detailed, rows, loaded, explain
+    )
+
+
+def describe_profile(profile: int) -> str:
+    return PROFILE_DESCRIPTIONS.get(profile, "Perfil no determinado")
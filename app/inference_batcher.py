@@ -0,0 +1,136 @@
+# app/inference_batcher.py
+
+import asyncio
+import contextvars
+import os
+import time
+
+from . import metrics
+from .inference import LoadedModel, predict_detailed_async, round_probabilities
+
+# Micro-batching de las predicciones individuales: las peticiones concurrentes
+# se agrupan durante como máximo INFERENCE_BATCH_MAX_WAIT_MS milisegundos (o hasta
+# INFERENCE_BATCH_MAX_SIZE filas) y se predicen con una sola llamada al modelo.
+INFERENCE_BATCH_MAX_WAIT_MS = float(os.getenv("INFERENCE_BATCH_MAX_WAIT_MS", "2"))
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "64"))
+# Filas esperando (en el lote abierto o en el pool de inferencia) antes de rechazar con 503
+INFERENCE_BATCH_QUEUE_SIZE = int(os.getenv("INFERENCE_BATCH_QUEUE_SIZE", "1024"))
+
+
+class InferenceQueueFull(Exception):
+    """Hay INFERENCE_BATCH_QUEUE_SIZE filas pendientes de predecir."""
+
+
+class InferenceBatcher:
+    """
+    Agrupa las predicciones individuales que llegan a la vez en el event loop.
+
+    La primera fila de un lote arranca un temporizador de `max_wait` segundos; el
+    lote se envía al pool de inferencia cuando vence o cuando alcanza
+    `max_batch_size` filas, y cada petición recibe su resultado por un Future.
+    Un lote solo contiene filas de la misma versión del modelo.
+    """
+
+    def __init__(self, max_wait: float = INFERENCE_BATCH_MAX_WAIT_MS / 1000,
+                 max_batch_size: int = INFERENCE_BATCH_MAX_SIZE, max_queue: int = INFERENCE_BATCH_QUEUE_SIZE):
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self._pending = []
+        self._pending_model: LoadedModel | None = None
+        self._timer = None
+        self._tasks = set()
+        self.queued = 0
+        self.batches = 0
+        self.rows = 0
+        self.rejected = 0
+
+    async def predict(self, row, loaded: LoadedModel) -> tuple:
+        """
+        Predice una fila junto con las que lleguen en la misma ventana.
+        Devuelve (perfil, probabilidades de cada perfil).
+        """
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise InferenceQueueFull()
+
+        start = time.perf_counter()
+        if self.max_batch_size <= 1 or self.max_wait <= 0:
+            self.queued += 1
+            try:
+                self._record_batch([start], time.perf_counter())
+                detail = await predict_detailed_async([row], loaded=loaded)
+                return int(detail.profiles[0]), round_probabilities(detail.probabilities[0])
+            finally:
+                self.queued -= 1
+
+        loop = asyncio.get_running_loop()
+        if self._pending and self._pending_model is not loaded:
+            self._flush()
+        future = loop.create_future()
+        self._pending.append((row, future, start))
+        self._pending_model = loaded
+        self.queued += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        result = await future
+        # El lote se ejecuta fuera del contexto de las peticiones: aquí se suma a
+        # cada una (cabecera Server-Timing) su espera más la inferencia del lote.
+        metrics.add_request_model_time(time.perf_counter() - start)
+        return result
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, loaded = self._pending, self._pending_model
+        self._pending, self._pending_model = [], None
+        if not batch:
+            return
+        # Contexto vacío: el tiempo del lote no se atribuye a la petición que lo disparó
+        task = asyncio.get_running_loop().create_task(self._run(batch, loaded), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _record_batch(self, enqueued_at: list, dispatched_at: float):
+        self.batches += 1
+        self.rows += len(enqueued_at)
+        metrics.INFERENCE_BATCH_SIZE.observe(len(enqueued_at))
+        for start in enqueued_at:
+            metrics.INFERENCE_BATCH_WAIT.observe(dispatched_at - start)
+
+    async def _run(self, batch: list, loaded: LoadedModel):
+        self._record_batch([start for _, _, start in batch], time.perf_counter())
+        try:
+            detail = await predict_detailed_async([row for row, _, _ in batch], loaded=loaded)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future, _), profile, probabilities in zip(batch, detail.profiles, detail.probabilities):
+                # La petición pudo cancelarse (cliente desconectado) mientras esperaba
+                if not future.done():
+                    future.set_result((int(profile), round_probabilities(probabilities)))
+        finally:
+            self.queued -= len(batch)
+
+    def stats(self) -> dict:
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_batch_size,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+            "rejected": self.rejected,
+        }
+
+
+# Instancia compartida por todo el proceso (usada desde el event loop del worker)
+inference_batcher = InferenceBatcher()
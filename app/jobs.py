@@ -0,0 +1,411 @@
+# app/jobs.py
+#
+# Trabajos en segundo plano guardados en la propia BD (tabla `jobs`): la petición
+# HTTP solo encola el trabajo y responde 202; un runner por proceso de la API
+# reclama los trabajos pendientes y los ejecuta en un pool de procesos, de modo
+# que las predicciones masivas, importaciones y exportaciones no ocupan workers
+# HTTP ni compiten por el GIL con ellos.
+#
+# Reclamar un trabajo es atómico entre procesos y máquinas:
+#   - PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED (cada runner salta las filas
+#     que otro está reclamando en ese momento).
+#   - SQLite: no tiene FOR UPDATE; se usa un UPDATE condicional
+#     (... WHERE id = ? AND status = 'queued'), atómico porque SQLite serializa las escrituras.
+#
+# Mientras un trabajo corre, un hilo de run_job actualiza su latido (heartbeat_at)
+# cada JOBS_HEARTBEAT_INTERVAL segundos. Un trabajo en 'running' cuyo latido tiene
+# más de JOBS_STALE_AFTER segundos se considera abandonado (proceso caído) y se
+# vuelve a reclamar, hasta JOBS_MAX_ATTEMPTS intentos. Las importaciones no se
+# reintentan: confirman cada bloque, y repetirlas duplicaría los pacientes ya
+# insertados; se marcan como fallidas.
+
+import functools
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, or_, select, update
+
+from . import bulk_export, bulk_import, crud, models, patient_stats, rescoring, schemas
+from .database import SessionLocal
+from .inference import get_loaded_model
+
+# Procesos del pool de trabajos por proceso de la API (0 = un hilo, sin pool de procesos)
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "1"))
+# Arranca el runner en el startup de la API. Cada runner levanta su propio pool de
+# procesos: actívalo en un solo proceso (no en cada worker de uvicorn)
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "false").lower() in ("1", "true", "yes")
+# Cada cuántos segundos se buscan trabajos pendientes (al encolar desde el mismo proceso es inmediato)
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "2"))
+JOBS_STALE_AFTER = float(os.getenv("JOBS_STALE_AFTER", "600"))
+JOBS_HEARTBEAT_INTERVAL = float(os.getenv("JOBS_HEARTBEAT_INTERVAL", str(min(30.0, JOBS_STALE_AFTER / 3))))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# Archivos de entrada (importaciones) y de resultado (exportaciones). Con varias
+# máquinas debe ser un directorio compartido.
+JOBS_STORAGE_DIR = os.getenv("JOBS_STORAGE_DIR", os.path.join(tempfile.gettempdir(), "hybrid-jobs"))
+# 'spawn' evita heredar hilos y conexiones abiertas del proceso de la API
+JOBS_START_METHOD = os.getenv("JOBS_START_METHOD", "spawn")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def storage_path(name: str) -> str:
+    os.makedirs(JOBS_STORAGE_DIR, exist_ok=True)
+    return os.path.join(JOBS_STORAGE_DIR, os.path.basename(name))
+
+
+# --- Encolar y reclamar ---
+
+def enqueue(db, kind: schemas.JobKind, owner_id: int | None = None, params: dict | None = None) -> models.Job:
+    """Guarda un trabajo pendiente y avisa al runner de este proceso."""
+    job = crud.create_job(db, kind=kind.value, owner_id=owner_id, params=params or {}, created_at=_now())
+    job_runner.notify()
+    return job
+
+
+# Tipos de trabajo que no se vuelven a ejecutar si se abandonan
+NON_RETRYABLE_KINDS = (schemas.JobKind.import_patients.value,)
+
+
+def _abandoned(now: datetime):
+    return and_(
+        models.Job.status == schemas.JobStatus.running.value,
+        models.Job.heartbeat_at < now - timedelta(seconds=JOBS_STALE_AFTER),
+    )
+
+
+def _claimable(now: datetime):
+    retryable = and_(
+        _abandoned(now),
+        models.Job.attempts < JOBS_MAX_ATTEMPTS,
+        models.Job.kind.not_in(NON_RETRYABLE_KINDS),
+    )
+    return or_(models.Job.status == schemas.JobStatus.queued.value, retryable)
+
+
+def _fail_exhausted(db, now: datetime):
+    """Marca como fallidos los trabajos abandonados que no se pueden reintentar."""
+    db.execute(
+        update(models.Job)
+        .where(_abandoned(now), models.Job.kind.in_(NON_RETRYABLE_KINDS))
+        .values(status=schemas.JobStatus.failed.value, finished_at=now,
+                error="La importación se interrumpió (proceso caído); los bloques ya importados "
+                      "(ver 'progress') se conservan y no se reintenta para no duplicarlos")
+    )
+    db.execute(
+        update(models.Job)
+        .where(_abandoned(now), models.Job.attempts >= JOBS_MAX_ATTEMPTS)
+        .values(status=schemas.JobStatus.failed.value, finished_at=now,
+                error="El trabajo se abandonó demasiadas veces (proceso caído)")
+    )
+    db.commit()
+
+
+def claim_next_job(db, worker: str) -> int | None:
+    """Reclama el trabajo pendiente más antiguo para `worker`; devuelve su id o None."""
+    now = _now()
+    _fail_exhausted(db, now)
+    claimed = {
+        "status": schemas.JobStatus.running.value,
+        "attempts": models.Job.attempts + 1,
+        "worker": worker,
+        "heartbeat_at": now,
+        "started_at": now,
+    }
+
+    if db.get_bind().dialect.name == "postgresql":
+        job_id = db.execute(
+            select(models.Job.id).where(_claimable(now)).order_by(models.Job.id).limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar_one_or_none()
+        if job_id is not None:
+            db.execute(update(models.Job).where(models.Job.id == job_id).values(**claimed))
+        db.commit()
+        return job_id
+
+    # Sin FOR UPDATE: si otro proceso gana la carrera el UPDATE no afecta a ninguna fila y se reintenta
+    for _ in range(3):
+        job_id = db.execute(
+            select(models.Job.id).where(_claimable(now)).order_by(models.Job.id).limit(1)
+        ).scalar_one_or_none()
+        if job_id is None:
+            db.commit()
+            return None
+        result = db.execute(
+            update(models.Job).where(models.Job.id == job_id, _claimable(now)).values(**claimed)
+        )
+        db.commit()
+        if result.rowcount == 1:
+            return job_id
+    return None
+
+
+def _set_job(db, job_id: int, **values):
+    db.execute(update(models.Job).where(models.Job.id == job_id).values(**values))
+    db.commit()
+
+
+# --- Tipos de trabajo (se ejecutan en el pool de procesos) ---
+
+def _run_rescore(db, job_id, owner_id, params, progress):
+    loaded = get_loaded_model()
+    progress(0, total=crud.count_stale_patients(db, loaded.version, owner_id=owner_id))
+    processed = rescoring.rescore_stale(db, loaded=loaded, owner_id=owner_id, progress=progress)
+    return {"processed": processed, "model_version": loaded.version}
+
+
+def _run_predict_batch(db, job_id, owner_id, params, progress):
+    loaded = get_loaded_model()
+    patient_ids = params.get("patient_ids")
+    only_unscored, only_stale = params.get("only_unscored", False), params.get("only_stale", False)
+    processed_ids = []
+    for updates in rescoring.iter_predict_patients(
+        db, loaded, owner_id, patient_ids, only_unscored, only_stale
+    ):
+        processed_ids.extend(item["id"] for item in updates)
+        progress(len(processed_ids))
+    not_found = []
+    if patient_ids is not None and not (only_unscored or only_stale):
+        found = set(processed_ids)
+        not_found = [patient_id for patient_id in patient_ids if patient_id not in found]
+    return {"processed": len(processed_ids), "not_found": not_found, "model_version": loaded.version}
+
+
+def _run_import(db, job_id, owner_id, params, progress):
+    path = storage_path(params["file"])
+    try:
+        with open(path, "rb") as stream:
+            return bulk_import.import_patients(
+                db, owner_id, stream, schemas.DataFormat(params["format"]),
+                score=params.get("score", False), progress=progress,
+            )
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _run_export(db, job_id, owner_id, params, progress):
+    export_format = schemas.DataFormat(params["format"])
+    media_type, filename = bulk_export.export_file_info(export_format)
+    name = f"export-{job_id}.{export_format.value}"
+    path = storage_path(name)
+    rows = 0
+
+    def count_rows(exported):
+        nonlocal rows
+        rows = exported
+        progress(exported)
+
+    with open(path + ".tmp", "w", encoding="utf-8", newline="") as f:
+        # En SQLite una lectura abierta en otra conexión bloquea las escrituras del
+        # progreso: se lee con la sesión del trabajo. En PostgreSQL se usa otra sesión
+        # (el commit del progreso cerraría el cursor del servidor de yield_per).
+        read_db = db if db.get_bind().dialect.name == "sqlite" else None
+        for chunk in bulk_export.iter_export_chunks(owner_id, export_format, progress=count_rows, db=read_db):
+            f.write(chunk)
+    os.replace(path + ".tmp", path)
+    return {"file": name, "rows": rows, "media_type": media_type, "filename": filename}
+
+
+def _run_reconcile_stats(db, job_id, owner_id, params, progress):
+    return patient_stats.reconcile(db)
+
+
+JOB_HANDLERS = {
+    schemas.JobKind.rescore.value: _run_rescore,
+    schemas.JobKind.predict_batch.value: _run_predict_batch,
+    schemas.JobKind.import_patients.value: _run_import,
+    schemas.JobKind.export_patients.value: _run_export,
+    schemas.JobKind.reconcile_stats.value: _run_reconcile_stats,
+}
+
+
+def _heartbeat(job_id: int, stop: threading.Event):
+    """Actualiza el latido del trabajo hasta que termina, aunque su handler no llame a progress()."""
+    while not stop.wait(JOBS_HEARTBEAT_INTERVAL):
+        db = SessionLocal()
+        try:
+            _set_job(db, job_id, heartbeat_at=_now())
+        except Exception as e:
+            print(f"⚠ No se pudo actualizar el latido del trabajo {job_id}: {e}")
+        finally:
+            db.close()
+
+
+def run_job(job_id: int) -> str:
+    """
+    Ejecuta un trabajo ya reclamado y guarda su resultado (se llama dentro del pool).
+    Devuelve el estado final.
+    """
+    status = schemas.JobStatus.failed.value
+    db = SessionLocal()
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop_heartbeat), name=f"job-{job_id}-heartbeat",
+                     daemon=True).start()
+    try:
+        job = db.get(models.Job, job_id)
+        handler = JOB_HANDLERS[job.kind]
+        owner_id, params = job.owner_id, dict(job.params or {})
+        db.commit()
+
+        def progress(done: int, total: int | None = None):
+            values = {"progress": done, "heartbeat_at": _now()}
+            if total is not None:
+                values["total"] = total
+            _set_job(db, job_id, **values)
+
+        result = handler(db, job_id, owner_id, params, progress)
+        status = schemas.JobStatus.succeeded.value
+        _set_job(db, job_id, status=status, result=result, finished_at=_now())
+    except Exception as e:
+        db.rollback()
+        _set_job(db, job_id, status=schemas.JobStatus.failed.value, error=str(e) or type(e).__name__,
+                 finished_at=_now())
+    finally:
+        stop_heartbeat.set()
+        db.close()
+    return status
+
+
+# --- Runner ---
+
+class JobRunner:
+    """
+    Hilo que reclama trabajos mientras haya procesos libres en el pool y los
+    envía a ejecutar. Se activa con JOBS_ENABLED en un solo proceso; si varios
+    lo activan (varias máquinas) reclaman de la misma tabla sin pisarse.
+    """
+
+    def __init__(self, workers: int = JOBS_WORKERS, poll_interval: float = JOBS_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = None
+        self._thread = None
+        self._slots = threading.Semaphore(max(workers, 1))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        # running se sube en el hilo del runner y se baja en el del callback del pool
+        self._lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _new_executor(self):
+        if self.workers <= 0:
+            return ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=multiprocessing.get_context(JOBS_START_METHOD))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._executor = self._new_executor()
+        self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """Despierta al runner (hay un trabajo nuevo)."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._slots.acquire()
+            if self._stop.is_set():
+                break
+            try:
+                db = SessionLocal()
+                try:
+                    job_id = claim_next_job(db, self.worker_id)
+                finally:
+                    db.close()
+            except Exception as e:
+                print(f"⚠ No se pudo reclamar un trabajo: {e}")
+                job_id = None
+
+            if job_id is None:
+                self._slots.release()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            with self._lock:
+                self.running += 1
+            try:
+                future = self._submit(job_id)
+            except Exception as e:
+                # Sin pool utilizable: el trabajo vuelve a la cola y se reintenta más tarde
+                print(f"⚠ No se pudo enviar el trabajo {job_id} al pool: {e}")
+                self._release_slot()
+                self._update_job(job_id, status=schemas.JobStatus.queued.value, worker=None)
+                self._stop.wait(self.poll_interval)
+                continue
+            future.add_done_callback(functools.partial(self._job_done, job_id))
+
+    def _submit(self, job_id: int):
+        try:
+            return self._executor.submit(run_job, job_id)
+        except BrokenProcessPool:
+            # Un proceso del pool murió: se crea un pool nuevo
+            self._executor = self._new_executor()
+            return self._executor.submit(run_job, job_id)
+
+    def _release_slot(self):
+        with self._lock:
+            self.running -= 1
+        self._slots.release()
+
+    def _job_done(self, job_id: int, future):
+        self._release_slot()
+        if future.cancelled():
+            # El runner se detuvo antes de empezarlo: vuelve a la cola
+            self._update_job(job_id, status=schemas.JobStatus.queued.value, worker=None)
+            return
+        error = future.exception()
+        if error is None:
+            with self._lock:
+                if future.result() == schemas.JobStatus.succeeded.value:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            return
+        # El proceso murió (p. ej. sin memoria): run_job no llegó a guardar el fallo
+        with self._lock:
+            self.failed += 1
+        self._update_job(job_id, status=schemas.JobStatus.failed.value, finished_at=_now(),
+                         error=f"El proceso del trabajo terminó de forma inesperada: {error}")
+
+    def _update_job(self, job_id: int, **values):
+        db = SessionLocal()
+        try:
+            _set_job(db, job_id, **values)
+        except Exception as e:
+            print(f"⚠ No se pudo actualizar el trabajo {job_id}: {e}")
+        finally:
+            db.close()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._slots.release()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "running": self.running,
+                    "completed": self.completed, "failed": self.failed}
+
+
+# Instancia compartida por todo el proceso
+job_runner = JobRunner()
@@ -1,12 +1,23 @@
 # app/main.py
 
-from fastapi import FastAPI
-from .database import engine, Base, SessionLocal
+from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
+from .database import engine, async_engine, engine_pools, Base, SessionLocal, create_missing_columns, create_missing_indexes
 from .routers import users, patients, admin
-from . import crud, schemas
+from . import crud, dependencies, schemas, inference, metrics, jobs, patient_search, patient_stats
+from .auth import password_pool
+from .auth_cache import auth_cache
+from .inference_batcher import inference_batcher
+from .prediction_cache import prediction_cache
+from .rate_limit import rate_limiter, RateLimitHeadersMiddleware
 from fastapi.middleware.cors import CORSMiddleware
+from .pagination import NEXT_CURSOR_HEADER
 import os
 
+# Expone GET /metrics (formato de texto de Prometheus). Desactivado por defecto:
+# revela rutas y ocupación de la BD, así que además pide token (ver dependencies.py)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+
 app = FastAPI(
     title="API de Perfilamiento de Discapacidad v3.1",
     description="API para la gestión de pacientes y predicción de perfiles de discapacidad. Desarrollado por:\n Ing. Julián Andres Quimbayo Castro - Ing. Jose Miguel Llanos Mosquera - Ing. Cindy Vargas Duque y Est. Willians Aguilar Rodriguez",
@@ -30,28 +41,60 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"], 
     allow_headers=["*"],
+    expose_headers=[
+        NEXT_CURSOR_HEADER, "Server-Timing", "ETag", "Last-Modified",
+        "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy", "Retry-After",
+    ],
 )
 
+# Cabeceras RateLimit-* de las rutas con límite de peticiones (app/rate_limit.py)
+app.add_middleware(RateLimitHeadersMiddleware)
+
+# Latencia por ruta, sentencias SQL por petición y, con METRICS_ENABLED, cabecera
+# Server-Timing (también revela tiempos internos a cualquier cliente).
+# Se añade después de CORS para quedar por fuera y medir la petición completa.
+app.add_middleware(metrics.MetricsMiddleware, server_timing=METRICS_ENABLED)
+
 @app.on_event("startup")
 def on_startup():
     """
     Evento de startup que:
-    1. Intenta crear las tablas si no existen
-    2. Crea el usuario administrador por defecto si no existe
+    1. Carga y calienta el modelo ML (una predicción de prueba)
+    2. Intenta crear las tablas si no existen
+    3. Crea el usuario administrador por defecto si no existe
     
     Es tolerante a errores de conexión para que la app siga funcionando
     aunque la BD no esté lista inicialmente.
     """
+    # Cada worker de uvicorn carga el modelo al arrancar, así la primera
+    # predicción no paga la carga de joblib ni las importaciones de sklearn.
+    try:
+        inference.warm_up()
+        print("✓ Modelo ML cargado y calentado")
+    except RuntimeError as e:
+        print(f"⚠ No se pudo precargar el modelo: {e}")
+
     try:
         # Intentar crear las tablas
         print("Inicializando esquema de base de datos...")
         Base.metadata.create_all(bind=engine)
+        create_missing_columns()
+        create_missing_indexes()
         print("✓ Esquema de base de datos listo")
     except Exception as e:
         print(f"⚠ Advertencia durante inicialización de BD: {e}")
         print("Continuando con el startup... Las tablas se crearán cuando se necesiten.")
         return
     
+    # Índice de búsqueda por nombre (pg_trgm necesita permiso para crear la
+    # extensión; sin él la búsqueda funciona igual, sin índice)
+    try:
+        search_index = patient_search.create_search_index()
+        if search_index:
+            print(f"✓ Índice de búsqueda por nombre listo ({search_index})")
+    except Exception as e:
+        print(f"⚠ No se pudo crear el índice de búsqueda por nombre: {e}")
+
     # Crear usuario admin si no existe
     try:
         db = SessionLocal()
@@ -70,6 +113,28 @@ def on_startup():
         print(f"⚠ No se pudo crear usuario admin: {e}")
         # No es crítico si falla
 
+    # Estadísticas precalculadas: la primera vez se calculan desde la tabla patients
+    try:
+        db = SessionLocal()
+        if patient_stats.backfill_if_empty(db):
+            print("✓ Estadísticas de pacientes calculadas")
+        db.close()
+    except Exception as e:
+        print(f"⚠ No se pudieron calcular las estadísticas de pacientes: {e}")
+
+    # Runner de trabajos en segundo plano (necesita la tabla jobs)
+    if jobs.JOBS_ENABLED:
+        jobs.job_runner.start()
+        print(f"✓ Runner de trabajos iniciado ({jobs.JOBS_WORKERS} procesos)")
+    else:
+        print("⚠ Runner de trabajos desactivado (JOBS_ENABLED): los trabajos esperan en la cola")
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # Los trabajos sin empezar vuelven a la cola; los que estaban en curso los
+    # reclama otro runner cuando su latido caduca (JOBS_STALE_AFTER)
+    jobs.job_runner.stop()
+
 # ======================================================================
 # CORRECCIÓN CLAVE: Asegurarse de que TODOS los routers están incluidos
 # correctamente con sus prefijos. Esta sección es la que resuelve el 404.
@@ -82,4 +147,88 @@ app.include_router(admin.router, prefix="/admin", tags=["Admin"])
 @app.get("/", tags=["Root"])
 def read_root():
     """Endpoint raíz de bienvenida."""
-    return {"message": "Bienvenido a la API de Perfilamiento de Discapacidad v3.1"}
\ No newline at end of file
+    return {"message": "Bienvenido a la API de Perfilamiento de Discapacidad v3.1"}
+
+
+# --- Métricas ---
+
+metrics.register_collector(
+    "prediction_cache_events_total", "Aciertos, fallos y desalojos de la caché de predicciones", "counter",
+    lambda: [({"event": event}, prediction_cache.stats()[event]) for event in ("hits", "misses", "evictions")],
+)
+metrics.register_collector(
+    "prediction_cache_entries", "Entradas en la caché de predicciones", "gauge",
+    lambda: [({}, prediction_cache.stats()["size"])],
+)
+metrics.register_collector(
+    "inference_batcher_queued", "Filas esperando en el micro-batching de predicciones", "gauge",
+    lambda: [({}, inference_batcher.queued)],
+)
+metrics.register_collector(
+    "inference_batcher_rejected_total", "Predicciones rechazadas por cola de micro-batching llena", "counter",
+    lambda: [({}, inference_batcher.rejected)],
+)
+metrics.register_collector(
+    "auth_cache_entries", "Tokens en la caché de autenticación", "gauge",
+    lambda: [({}, len(auth_cache))],
+)
+metrics.register_collector(
+    "password_pool_in_flight", "Operaciones bcrypt en curso o en cola", "gauge",
+    lambda: [({}, password_pool.stats()["in_flight"])],
+)
+metrics.register_collector(
+    "password_pool_rejected_total", "Operaciones bcrypt rechazadas por pool saturado", "counter",
+    lambda: [({}, password_pool.stats()["rejected"])],
+)
+metrics.register_collector(
+    "jobs_running", "Trabajos en segundo plano en curso en este proceso", "gauge",
+    lambda: [({}, jobs.job_runner.stats()["running"])],
+)
+metrics.register_collector(
+    "jobs_finished_total", "Trabajos en segundo plano terminados en este proceso", "counter",
+    lambda: [
+        ({"status": "succeeded"}, jobs.job_runner.stats()["completed"]),
+        ({"status": "failed"}, jobs.job_runner.stats()["failed"]),
+    ],
+)
+metrics.register_collector(
+    "db_pool_connections", "Conexiones del pool de la BD en uso (checked_out) y libres (idle)", "gauge",
+    lambda: [
+        ({"engine": name, "state": state}, value)
+        for name, pool, _ in engine_pools() if hasattr(pool, "checkedout")
+        for state, value in (("checked_out", pool.checkedout()), ("idle", pool.checkedin()))
+    ],
+)
+metrics.register_collector(
+    "db_pool_capacity", "Conexiones máximas del pool de la BD (pool_size + max_overflow)", "gauge",
+    lambda: [
+        ({"engine": name}, capacity)
+        for name, _, capacity in engine_pools() if capacity is not None
+    ],
+)
+metrics.register_collector(
+    "db_pool_utilization", "Fracción de la capacidad del pool de la BD en uso", "gauge",
+    lambda: [
+        ({"engine": name}, round(pool.checkedout() / max(1, capacity), 4))
+        for name, pool, capacity in engine_pools() if capacity is not None and hasattr(pool, "checkedout")
+    ],
+)
+metrics.register_collector(
+    "rate_limit_rejections_total", "Peticiones rechazadas (429) por el límite de peticiones, por regla", "counter",
+    lambda: [
+        ({"rule": key.split(":")[0], "scope": key.split(":")[1]}, value)
+        for key, value in rate_limiter.stats()["limited"].items()
+    ],
+)
+metrics.register_collector(
+    "rate_limit_backend_errors_total", "Errores del backend del límite de peticiones (peticiones dejadas pasar)", "counter",
+    lambda: [({}, rate_limiter.backend_errors)],
+)
+
+
+if METRICS_ENABLED:
+    @app.get("/metrics", tags=["Root"], response_class=PlainTextResponse,
+             dependencies=[Depends(dependencies.require_metrics_access)])
+    def read_metrics():
+        """Métricas del proceso en formato de texto de Prometheus."""
+        return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
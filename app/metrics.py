@@ -0,0 +1,299 @@
+# app/metrics.py
+#
+# Métricas de rendimiento en formato de texto de Prometheus, sin dependencias
+# externas. Los valores son por proceso: con varios workers de uvicorn cada uno
+# expone los suyos (Prometheus los distingue por la instancia que scrapea).
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# Token (Bearer) que debe enviar Prometheus a GET /metrics; sin él solo lo puede
+# leer un administrador con su token de acceso
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Límites (en segundos) de los buckets de los histogramas de latencia
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_registry = []
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+
+def register_collector(name: str, documentation: str, metric_type: str, collect):
+    """
+    Registra una métrica calculada al momento de exponerla.
+    `collect` devuelve una lista de (labels: dict, valor).
+    """
+    _collectors.append((name, documentation, metric_type, collect))
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for name, documentation, metric_type, collect in _collectors:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in collect():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Métricas de la aplicación ---
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta",
+    labelnames=("method", "route", "status"),
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Sentencias SQL ejecutadas por petición",
+    labelnames=("method", "route"), buckets=COUNT_BUCKETS,
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Duración de cada sentencia SQL", labelnames=("engine",),
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Espera para obtener una conexión del pool", labelnames=("engine",),
+)
+MODEL_INFERENCE_DURATION = Histogram(
+    "model_inference_seconds", "Duración de cada llamada al modelo", labelnames=("engine",),
+)
+MODEL_INFERENCE_ROWS = Counter(
+    "model_inference_rows_total", "Filas predichas por el modelo", labelnames=("engine",),
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    "inference_batch_size", "Filas por lote del micro-batching de predicciones individuales",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+INFERENCE_BATCH_WAIT = Histogram(
+    "inference_batch_wait_seconds", "Espera de cada fila hasta que su lote se envía al modelo",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_seconds", "Duración de las operaciones bcrypt", labelnames=("operation",),
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0),
+)
+
+
+# --- Tiempos por petición (para la cabecera Server-Timing) ---
+
+class RequestTimings:
+    __slots__ = ("db_queries", "db_seconds", "pool_wait_seconds", "model_seconds", "bcrypt_seconds")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.model_seconds = 0.0
+        self.bcrypt_seconds = 0.0
+
+
+# Objeto mutable compartido por la petición; el contexto se copia a los hilos
+# del thread pool y a los pools de inferencia / bcrypt, así que todos suman aquí.
+current_timings: contextvars.ContextVar[RequestTimings | None] = contextvars.ContextVar(
+    "current_timings", default=None
+)
+
+
+def record_model_inference(engine: str, rows: int, seconds: float):
+    MODEL_INFERENCE_DURATION.observe(seconds, engine=engine)
+    MODEL_INFERENCE_ROWS.inc(rows, engine=engine)
+    add_request_model_time(seconds)
+
+
+def add_request_model_time(seconds: float):
+    """Suma tiempo de modelo a la petición en curso (si la hay)."""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.model_seconds += seconds
+
+
+def record_password_hash(operation: str, seconds: float):
+    PASSWORD_HASH_DURATION.observe(seconds, operation=operation)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.bcrypt_seconds += seconds
+
+
+# --- Instrumentación de SQLAlchemy ---
+
+def instrument_engine(engine, name: str):
+    """
+    Registra duración y número de sentencias (eventos de cursor) y la espera
+    para obtener conexión del pool. `engine` es un Engine síncrono (para uno
+    asíncrono, pasar `async_engine.sync_engine`).
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        DB_QUERY_DURATION.observe(elapsed, engine=name)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.db_queries += 1
+            timings.db_seconds += elapsed
+
+    # El pool no tiene un evento "antes del checkout": se mide Engine.raw_connection(),
+    # la llamada pública con la que engine.connect() (y la Session) piden la conexión
+    # al pool (incluye la espera a que haya una libre y, si hace falta, abrir una
+    # nueva). Se envuelve en el Engine y no en el pool porque dispose() cambia el pool.
+    raw_connection = engine.raw_connection
+
+    def _timed_raw_connection():
+        start = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_POOL_CHECKOUT_WAIT.observe(elapsed, engine=name)
+            timings = current_timings.get()
+            if timings is not None:
+                timings.pool_wait_seconds += elapsed
+
+    engine.raw_connection = _timed_raw_connection
+
+
+# --- Middleware ASGI ---
+
+class MetricsMiddleware:
+    """
+    Mide cada petición HTTP (latencia por ruta y sentencias SQL) y, con
+    `server_timing`, añade la cabecera Server-Timing con el desglose
+    db / pool / model / bcrypt / app.
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            if message["type"] == "http.response.start" and self.server_timing:
+                total_ms = (time.perf_counter() - start) * 1000
+                server_timing = (
+                    f'db;dur={timings.db_seconds * 1000:.2f};desc="{timings.db_queries} queries", '
+                    f"pool;dur={timings.pool_wait_seconds * 1000:.2f}, "
+                    f"model;dur={timings.model_seconds * 1000:.2f}, "
+                    f"bcrypt;dur={timings.bcrypt_seconds * 1000:.2f}, "
+                    f"app;dur={total_ms:.2f}"
+                )
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", server_timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start, method=method, route=route_path, status=str(status_code)
+            )
+            HTTP_REQUEST_DB_QUERIES.observe(timings.db_queries, method=method, route=route_path)
+            current_timings.reset(token)
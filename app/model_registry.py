@@ -0,0 +1,208 @@
+# app/model_registry.py
+#
+# Registro de versiones del modelo:
+#
+#   model/registry/
+#     ACTIVE                        <- versión activa (una línea)
+#     20261017T120000Z-1a2b3c4d/
+#       model.joblib                <- pipeline + motor compilado, sin comprimir
+#       manifest.json               <- esquema de variables, estadísticas, sha256, created_at
+#
+# Los artefactos se guardan sin comprimir para cargarlos con mmap_mode='r': los
+# arrays de NumPy (p. ej. los del motor compilado) se mapean desde el archivo y
+# los workers de uvicorn comparten esas páginas en lugar de tener una copia cada uno.
+
+import hashlib
+import json
+import os
+import platform
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+import joblib
+import sklearn
+
+REGISTRY_DIR = os.getenv(
+    "MODEL_REGISTRY_DIR",
+    os.path.join(os.path.dirname(__file__), '..', 'model', 'registry')
+)
+ACTIVE_POINTER = "ACTIVE"
+ARTIFACT_NAME = "model.joblib"
+MANIFEST_NAME = "manifest.json"
+
+
+class ModelRegistryError(RuntimeError):
+    """Versión inexistente, artefacto corrupto o incompatible con la API."""
+
+
+def _version_dir(version: str, registry_dir: str = REGISTRY_DIR) -> str:
+    if not version or os.sep in version or version.startswith("."):
+        raise ModelRegistryError(f"Versión de modelo no válida: {version!r}")
+    return os.path.join(registry_dir, version)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, content: str):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def describe_features(pipeline) -> list:
+    """Esquema de entrada del pipeline: rango de las numéricas y categorías de las categóricas."""
+    preprocessor = pipeline.steps[0][1]
+    features = []
+    for name, transformer, columns in preprocessor.transformers_:
+        if transformer == 'drop' or len(columns) == 0:
+            continue
+        columns = [preprocessor.feature_names_in_[c] if not isinstance(c, str) else c for c in columns]
+        if hasattr(transformer, "categories_"):
+            for column, categories in zip(columns, transformer.categories_):
+                features.append({"name": column, "type": "categorical", "categories": categories.tolist()})
+        elif hasattr(transformer, "data_min_"):
+            for j, column in enumerate(columns):
+                features.append({
+                    "name": column, "type": "numeric",
+                    "min": float(transformer.data_min_[j]), "max": float(transformer.data_max_[j]),
+                })
+        else:
+            features.extend({"name": column, "type": "numeric"} for column in columns)
+    # Mismo orden que las columnas de entrada
+    order = {name: i for i, name in enumerate(preprocessor.feature_names_in_)}
+    return sorted(features, key=lambda feature: order[feature["name"]])
+
+
+# --- Escritura ---
+
+def register_model(pipeline, training: dict | None = None, activate: bool = True,
+                   registry_dir: str = REGISTRY_DIR) -> str:
+    """
+    Guarda `pipeline` como una nueva versión del registro y devuelve su id.
+    El motor compilado se precalcula y se guarda junto al pipeline para que los
+    workers no tengan que compilarlo al cargar. `training` son estadísticas
+    libres (filas, distribución de perfiles, tiempos...) que van al manifiesto.
+    """
+    from . import schemas
+    from .inference import CompiledPipeline
+
+    try:
+        engine = CompiledPipeline(pipeline, input_features=schemas.PREDICTION_FEATURES)
+    except (TypeError, AttributeError, KeyError):
+        engine = None
+
+    os.makedirs(registry_dir, exist_ok=True)
+    created_at = datetime.now(timezone.utc)
+    staging_dir = tempfile.mkdtemp(dir=registry_dir, prefix=".staging-")
+    try:
+        artifact_path = os.path.join(staging_dir, ARTIFACT_NAME)
+        # Sin compresión: es requisito para poder cargarlo con mmap_mode='r'
+        joblib.dump({
+            "pipeline": pipeline,
+            "engine": engine,
+            "engine_format": CompiledPipeline.FORMAT_VERSION if engine is not None else None,
+        }, artifact_path, compress=0)
+        sha256 = _sha256(artifact_path)
+        version = f"{created_at:%Y%m%dT%H%M%SZ}-{sha256[:8]}"
+
+        manifest = {
+            "version": version,
+            "created_at": created_at.isoformat(),
+            "sha256": sha256,
+            "size_bytes": os.path.getsize(artifact_path),
+            "classifier": type(pipeline.steps[-1][1]).__name__,
+            "compiled": engine is not None,
+            "features": describe_features(pipeline),
+            "training": training or {},
+            "sklearn_version": sklearn.__version__,
+            "python_version": platform.python_version(),
+        }
+        with open(os.path.join(staging_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+        os.rename(staging_dir, _version_dir(version, registry_dir))
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    if activate:
+        set_active_version(version, registry_dir)
+    return version
+
+
+def set_active_version(version: str, registry_dir: str = REGISTRY_DIR):
+    """Apunta ACTIVE a `version` (escritura atómica: los workers nunca leen un puntero a medias)."""
+    read_manifest(version, registry_dir)  # valida que la versión existe
+    _write_atomic(os.path.join(registry_dir, ACTIVE_POINTER), version + "\n")
+
+
+# --- Lectura ---
+
+def get_active_version(registry_dir: str = REGISTRY_DIR) -> str | None:
+    """Versión activa, o None si el registro no existe o no tiene ninguna activa."""
+    try:
+        with open(os.path.join(registry_dir, ACTIVE_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(version: str, registry_dir: str = REGISTRY_DIR) -> dict:
+    try:
+        with open(os.path.join(_version_dir(version, registry_dir), MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ModelRegistryError(f"La versión de modelo {version} no existe en el registro")
+
+
+def list_versions(registry_dir: str = REGISTRY_DIR) -> list:
+    """Manifiestos de todas las versiones, de la más reciente a la más antigua."""
+    if not os.path.isdir(registry_dir):
+        return []
+    manifests = []
+    for name in os.listdir(registry_dir):
+        if name.startswith(".") or not os.path.isfile(os.path.join(registry_dir, name, MANIFEST_NAME)):
+            continue
+        manifests.append(read_manifest(name, registry_dir))
+    return sorted(manifests, key=lambda manifest: manifest["created_at"], reverse=True)
+
+
+def load_version(version: str, mmap: bool = True, registry_dir: str = REGISTRY_DIR):
+    """
+    Carga una versión: devuelve (pipeline, motor compilado o None, manifiesto).
+    Comprueba el sha256 del artefacto y que sus variables coinciden con las de la API.
+    """
+    from . import schemas
+    from .inference import CompiledPipeline
+
+    manifest = read_manifest(version, registry_dir)
+    artifact_path = os.path.join(_version_dir(version, registry_dir), ARTIFACT_NAME)
+    if _sha256(artifact_path) != manifest["sha256"]:
+        raise ModelRegistryError(f"El artefacto de la versión {version} no coincide con su sha256")
+
+    features = [feature["name"] for feature in manifest["features"]]
+    if features != schemas.PREDICTION_FEATURES:
+        raise ModelRegistryError(
+            f"La versión {version} espera las variables {features}, distintas de las de la API"
+        )
+
+    artifact = joblib.load(artifact_path, mmap_mode="r" if mmap else None)
+    engine = artifact.get("engine")
+    # Un motor guardado con otra versión del formato se descarta (se recompila al cargar)
+    if artifact.get("engine_format") != CompiledPipeline.FORMAT_VERSION:
+        engine = None
+    return artifact["pipeline"], engine, manifest
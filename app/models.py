@@ -1,9 +1,14 @@
 # app/models.py
 
-from sqlalchemy import Boolean, Column, Integer, String, Date, ForeignKey
+from datetime import datetime, timezone
+
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, Date, DateTime, ForeignKey, Index, JSON, literal_column
 from sqlalchemy.orm import relationship
 from .database import Base
 
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -40,6 +45,21 @@ class Patient(Base):
     
     prediction_profile = Column(Integer, nullable=True)
     prediction_description = Column(String, nullable=True)
+    # Versión del modelo (registro) que generó la predicción guardada
+    prediction_model_version = Column(String, nullable=True)
+    # Probabilidad de cada perfil (lista indexada por perfil) de la predicción guardada
+    prediction_probabilities = Column(JSON, nullable=True)
+    # Huella de las 13 variables del modelo (app/fingerprint.py): la actual y la
+    # de los datos con los que se hizo la predicción guardada. Si difieren (o la
+    # versión del modelo no es la activa) la predicción está desactualizada.
+    features_hash = Column(String, nullable=True)
+    prediction_features_hash = Column(String, nullable=True)
+
+    # Versión de la fila (ETag) y momento del último cambio (Last-Modified), ver
+    # app/versioning.py. Todo UPDATE de la tabla, del ORM o de Core, las avanza
+    # (onupdate). Son opcionales para poder añadirlas a tablas existentes: NULL = 0.
+    version = Column(Integer, nullable=True, default=1, onupdate=literal_column("coalesce(version, 0) + 1"))
+    updated_at = Column(DateTime(timezone=True), nullable=True, default=utcnow, onupdate=utcnow)
 
     # ======================================================================
     # CORRECCIÓN #2: ESTA ES LA SOLUCIÓN PRINCIPAL
@@ -50,4 +70,78 @@ class Patient(Base):
 
     # <--- CORRECCIÓN #3: Se establece la relación
     # Esto permite acceder a patient.owner para ver el objeto User del médico dueño
-    owner = relationship("User", back_populates="patients")
\ No newline at end of file
+    owner = relationship("User", back_populates="patients")
+
+    # Índice compuesto para listar los pacientes de un médico ordenados por id
+    # (paginación por cursor: WHERE owner_id = ? AND id > ? ORDER BY id), más los
+    # de los filtros y órdenes del listado (app/patient_search.py). El índice de
+    # búsqueda por nombre depende del motor y lo crea patient_search.create_search_index().
+    __table_args__ = (
+        Index("ix_patients_owner_id_id", "owner_id", "id"),
+        Index("ix_patients_owner_profile_id", "owner_id", "prediction_profile", "id"),
+        Index("ix_patients_owner_causa_id", "owner_id", "causa_deficiencia", "id"),
+        Index("ix_patients_owner_edad_id", "owner_id", "edad", "id"),
+        Index("ix_patients_owner_nivel_global_id", "owner_id", "nivel_global", "id"),
+        Index("ix_patients_owner_nombre_id", "owner_id", "nombre_apellidos", "id"),
+    )
+
+class PatientStats(Base):
+    """
+    Estadísticas precalculadas por médico y perfil predicho (app/patient_stats.py):
+    número de pacientes y suma de la edad y de cada nivel_*. Las medias se obtienen
+    dividiendo, sin recorrer la tabla patients.
+    """
+    __tablename__ = "patient_stats"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # Perfil predicho; -1 agrupa a los pacientes sin predicción
+    profile = Column(Integer, primary_key=True)
+    patient_count = Column(Integer, nullable=False, default=0)
+    sum_edad = Column(BigInteger, nullable=False, default=0)
+    sum_nivel_d1 = Column(BigInteger, nullable=False, default=0)
+    sum_nivel_d2 = Column(BigInteger, nullable=False, default=0)
+    sum_nivel_d3 = Column(BigInteger, nullable=False, default=0)
+    sum_nivel_d4 = Column(BigInteger, nullable=False, default=0)
+    sum_nivel_d5 = Column(BigInteger, nullable=False, default=0)
+    sum_nivel_d6 = Column(BigInteger, nullable=False, default=0)
+    sum_nivel_global = Column(BigInteger, nullable=False, default=0)
+
+class PatientRoster(Base):
+    """
+    Versión de la lista de pacientes de cada médico (app/versioning.py): sube con
+    cada alta, cambio o baja de uno de sus pacientes. Es el ETag del listado.
+    """
+    __tablename__ = "patient_rosters"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+class Job(Base):
+    """Trabajo en segundo plano (re-predicción, importación, exportación) de app/jobs.py."""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    # queued -> running -> succeeded | failed
+    status = Column(String, nullable=False, default="queued")
+    # Médico que lo lanzó (None para los trabajos de administración sobre todos los pacientes)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    params = Column(JSON, nullable=True)
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Proceso que lo ejecuta ("host:pid") y su último latido (para reintentar los abandonados)
+    worker = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Los runners buscan el trabajo pendiente más antiguo: WHERE status = ? ORDER BY id
+    __table_args__ = (
+        Index("ix_jobs_status_id", "status", "id"),
+        Index("ix_jobs_owner_id_id", "owner_id", "id"),
+    )
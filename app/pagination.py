@@ -0,0 +1,84 @@
+# app/pagination.py
+
+import base64
+import json
+import os
+
+from fastapi import HTTPException, Query, Response
+
+# Máximo de filas por página (`limit`) en los listados
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+
+def limit_query(default: int):
+    """Parámetro `limit` de un listado: entre 1 y MAX_PAGE_SIZE filas."""
+    return Query(default, ge=1, le=MAX_PAGE_SIZE)
+
+# Cabecera con el cursor de la página siguiente (el cuerpo sigue siendo una lista)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int, sort: str | None = None, sort_value=None) -> str:
+    """
+    Cursor opaco (base64 url-safe) que apunta a la última fila devuelta. Con un
+    orden distinto del id incluye ese orden y el valor de la columna en esa fila.
+    """
+    payload = {"id": last_id}
+    if sort is not None:
+        payload.update(s=sort, k=sort_value)
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _decode(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(payload["id"], int):
+            raise ValueError
+        return payload
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor de paginación no válido")
+
+
+def decode_cursor(cursor: str) -> int:
+    return _decode(cursor)["id"]
+
+
+def decode_sort_cursor(cursor: str, sort: str) -> tuple:
+    """
+    (valor de la columna de orden, id) de un cursor. Para el orden por id
+    ascendente sirven también los cursores simples; para los demás el cursor
+    tiene que venir de una página con ese mismo orden.
+    """
+    payload = _decode(cursor)
+    if sort == "id" and "s" not in payload:
+        return payload["id"], payload["id"]
+    # El valor es None si la última fila no tenía valor en esa columna
+    if payload.get("s") != sort or "k" not in payload or not isinstance(payload["k"], (int, str, type(None))):
+        raise HTTPException(status_code=400, detail="El cursor de paginación corresponde a otro orden")
+    return payload["k"], payload["id"]
+
+
+def cursor_headers(response: Response) -> dict:
+    """Cabecera del cursor fijada por paginate(), para copiarla a una respuesta construida a mano."""
+    cursor = response.headers.get(NEXT_CURSOR_HEADER)
+    return {NEXT_CURSOR_HEADER: cursor} if cursor else {}
+
+
+def paginate(response: Response, rows: list, limit: int, sort: str | None = None) -> list:
+    """
+    Recibe hasta `limit + 1` filas ya ordenadas. Si hay más de `limit` existe
+    otra página y se devuelve su cursor en la cabecera X-Next-Cursor. `sort`
+    es el orden del listado ("-edad", "nombre_apellidos"...; None o "id" = por id).
+    """
+    if limit <= 0:
+        return []
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if sort is None or sort == "id":
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.id)
+        else:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.id, sort, getattr(last, sort.lstrip("-")))
+    return rows
@@ -0,0 +1,196 @@
+# app/patient_search.py
+#
+# Filtros, orden y búsqueda por nombre del listado de pacientes (GET /patients/).
+# Todas las consultas van acotadas a un médico (owner_id = ?), por eso los índices
+# compuestos de models.Patient empiezan por owner_id:
+#   - (owner_id, prediction_profile, id): filtro por perfil (o sin predicción)
+#   - (owner_id, causa_deficiencia, id): filtro por causa de la deficiencia
+#   - (owner_id, edad, id), (owner_id, nivel_global, id), (owner_id, nombre_apellidos, id):
+#     rangos y orden por esas columnas, con paginación por clave sobre (columna, id)
+# El resto de filtros (género, orientación, categorías, nivel_d1..d6) se evalúan
+# sobre las filas que devuelve el índice elegido.
+#
+# Búsqueda por nombre (`q`), palabra a palabra:
+#   - PostgreSQL: índice GIN de trigramas (pg_trgm); cada palabra se busca como
+#     subcadena (ILIKE '%palabra%').
+#   - SQLite: tabla FTS5 `patients_fts` que mantienen unos triggers; cada palabra
+#     se busca como prefijo de una palabra del nombre, sin distinguir tildes.
+#   - Sin ninguno de los dos se usa LIKE sin índice.
+#
+# tests/test_query_plans.py comprueba con EXPLAIN que cada filtro usa su índice.
+
+import re
+
+from sqlalchemy import and_, column, or_, select, text, tuple_
+
+from . import models, schemas
+from .database import engine
+
+# Palabras de `q` que se buscan como máximo
+SEARCH_MAX_TERMS = 5
+
+CATEGORY_FIELDS = ("genero", "orientacion_sexual", "causa_deficiencia", "cat_fisica", "cat_psicosocial")
+RANGE_FIELDS = ("edad", "nivel_d1", "nivel_d2", "nivel_d3", "nivel_d4", "nivel_d5", "nivel_d6", "nivel_global")
+
+_WORD = re.compile(r"\w+")
+
+# Se activa en create_search_index() si la BD es SQLite y tiene FTS5
+_sqlite_fts = False
+
+_SQLITE_FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN
+        INSERT INTO patients_fts (rowid, nombre_apellidos) VALUES (new.id, new.nombre_apellidos);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN
+        INSERT INTO patients_fts (patients_fts, rowid, nombre_apellidos) VALUES ('delete', old.id, old.nombre_apellidos);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF nombre_apellidos ON patients BEGIN
+        INSERT INTO patients_fts (patients_fts, rowid, nombre_apellidos) VALUES ('delete', old.id, old.nombre_apellidos);
+        INSERT INTO patients_fts (rowid, nombre_apellidos) VALUES (new.id, new.nombre_apellidos);
+    END""",
+)
+
+
+def create_search_index(bind=engine) -> str | None:
+    """
+    Crea el índice de búsqueda por nombre si no existe (se llama en el startup,
+    después de create_all). Devuelve el tipo de índice disponible o None.
+    """
+    global _sqlite_fts
+    dialect_name = bind.dialect.name
+    if dialect_name == "postgresql":
+        with bind.begin() as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_patients_nombre_trgm "
+                "ON patients USING gin (nombre_apellidos gin_trgm_ops)"
+            ))
+        return "pg_trgm"
+    if dialect_name == "sqlite":
+        with bind.begin() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'")
+            ).first()
+            if not exists:
+                connection.execute(text(
+                    "CREATE VIRTUAL TABLE patients_fts USING fts5("
+                    "nombre_apellidos, content='patients', content_rowid='id', "
+                    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                ))
+                # Indexa los pacientes que ya existían
+                connection.execute(text("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')"))
+            for trigger in _SQLITE_FTS_TRIGGERS:
+                connection.execute(text(trigger))
+        _sqlite_fts = True
+        return "fts5"
+    return None
+
+
+def search_terms(q: str | None) -> list[str]:
+    """Palabras de la búsqueda (sin signos ni operadores), en minúsculas."""
+    return _WORD.findall(q.lower())[:SEARCH_MAX_TERMS] if q else []
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def name_search_condition(terms: list[str], dialect_name: str):
+    """Condición que exige todas las palabras en nombre_apellidos."""
+    if dialect_name == "sqlite" and _sqlite_fts:
+        # "palabra"* = prefijo de una palabra; varias palabras separadas por espacio = AND
+        match = " ".join(f'"{term}"*' for term in terms)
+        matches = (
+            select(column("rowid"))
+            .select_from(text("patients_fts"))
+            .where(text("patients_fts MATCH :search").bindparams(search=match))
+        )
+        return models.Patient.id.in_(matches)
+    return and_(*[
+        models.Patient.nombre_apellidos.ilike(f"%{_escape_like(term)}%", escape="\\") for term in terms
+    ])
+
+
+def filter_conditions(filters: schemas.PatientFilters | None, dialect_name: str) -> list:
+    if filters is None:
+        return []
+    patient = models.Patient
+    conditions = []
+    terms = search_terms(filters.q)
+    if terms:
+        conditions.append(name_search_condition(terms, dialect_name))
+    if filters.unscored:
+        conditions.append(patient.prediction_profile.is_(None))
+    elif filters.profile is not None:
+        conditions.append(patient.prediction_profile == filters.profile)
+    for name in CATEGORY_FIELDS:
+        value = getattr(filters, name)
+        if value is not None:
+            conditions.append(getattr(patient, name) == value)
+    for name in RANGE_FIELDS:
+        low, high = getattr(filters, f"{name}_min"), getattr(filters, f"{name}_max")
+        if low is not None:
+            conditions.append(getattr(patient, name) >= low)
+        if high is not None:
+            conditions.append(getattr(patient, name) <= high)
+    return conditions
+
+
+def sort_field(sort: schemas.PatientSort) -> tuple[str, bool]:
+    """(columna, descendente) de un valor de `sort`."""
+    return sort.value.lstrip("-"), sort.value.startswith("-")
+
+
+def nulls_are_largest(dialect_name: str) -> bool:
+    """
+    Dónde quedan los NULL de edad, nombre_apellidos y nivel_global (columnas
+    opcionales): donde los deja el índice (owner_id, columna, id) de cada base de
+    datos, para que siga dando el orden. PostgreSQL los trata como el valor más
+    grande (al final en orden ascendente); SQLite, como el más pequeño.
+    """
+    return dialect_name == "postgresql"
+
+
+def _after_condition(sort_column, value, last_id: int, descending: bool, nulls_first: bool):
+    """Filas posteriores a (value, last_id) en el orden del listado, con NULL en `value` o en la columna."""
+    patient = models.Patient
+    after_id = patient.id < last_id if descending else patient.id > last_id
+    if value is None:
+        # Entre los NULL manda el id; tras ellos vienen los demás si los NULL van primero
+        condition = and_(sort_column.is_(None), after_id)
+        return or_(condition, sort_column.is_not(None)) if nulls_first else condition
+    key = tuple_(sort_column, patient.id)
+    # Una comparación con NULL nunca es cierta: los NULL se añaden si van detrás
+    condition = key < (value, last_id) if descending else key > (value, last_id)
+    return condition if nulls_first else or_(condition, sort_column.is_(None))
+
+
+def listing_statement(owner_id: int, dialect_name: str, filters: schemas.PatientFilters | None = None,
+                      sort: schemas.PatientSort = schemas.PatientSort.id, after_key: tuple | None = None,
+                      columns: list[str] | None = None):
+    """
+    SELECT de una página del listado. `after_key` es (valor de la columna de orden,
+    id) de la última fila de la página anterior: la siguiente empieza justo después
+    (paginación por clave sobre el índice (owner_id, columna, id)). El valor puede
+    ser None: los NULL se ordenan como indica nulls_are_largest(). Con `columns`
+    se seleccionan solo esas columnas (filas) en lugar de objetos ORM.
+    """
+    patient = models.Patient
+    name, descending = sort_field(sort)
+    sort_column = getattr(patient, name)
+    selected = [getattr(patient, column) for column in columns] if columns else [patient]
+    statement = select(*selected).where(patient.owner_id == owner_id, *filter_conditions(filters, dialect_name))
+
+    if name == "id":
+        if after_key is not None:
+            last_id = after_key[1]
+            statement = statement.where(patient.id < last_id if descending else patient.id > last_id)
+        return statement.order_by(patient.id.desc() if descending else patient.id)
+
+    nulls_first = descending == nulls_are_largest(dialect_name)
+    if after_key is not None:
+        value, last_id = after_key
+        statement = statement.where(_after_condition(sort_column, value, last_id, descending, nulls_first))
+    ordered = sort_column.desc() if descending else sort_column.asc()
+    ordered = ordered.nulls_first() if nulls_first else ordered.nulls_last()
+    return statement.order_by(ordered, patient.id.desc() if descending else patient.id)
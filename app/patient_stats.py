@@ -0,0 +1,258 @@
+# app/patient_stats.py
+#
+# Estadísticas precalculadas de los pacientes (tabla patient_stats). Por cada
+# médico y perfil predicho se guarda el número de pacientes y la suma de la edad
+# y de cada nivel_*. Cada escritura de pacientes suma o resta su aportación en la
+# misma transacción, así que leer las estadísticas cuesta lo mismo con cien que
+# con un millón de pacientes.
+#
+# Si las sumas se desvían (escrituras concurrentes sobre el mismo paciente,
+# cambios hechos a mano en la BD), el trabajo 'reconcile_stats' las recalcula
+# desde la tabla patients.
+
+from sqlalchemy import delete, func, insert, literal, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, versioning
+from .inference import describe_profile
+
+# Variables numéricas cuya media se publica
+STAT_FIELDS = ("edad", "nivel_d1", "nivel_d2", "nivel_d3", "nivel_d4", "nivel_d5", "nivel_d6", "nivel_global")
+# Columnas acumulables de patient_stats
+COUNTER_COLUMNS = ("patient_count",) + tuple(f"sum_{name}" for name in STAT_FIELDS)
+# Valor de `profile` para los pacientes sin predicción (NULL no sirve en la clave primaria)
+UNSCORED = -1
+
+
+def bucket(profile: int | None) -> int:
+    return UNSCORED if profile is None else profile
+
+
+def patient_delta(owner_id: int, profile: int | None, values, sign: int = 1) -> dict:
+    """
+    Aportación de un paciente a su grupo (médico, perfil): `sign=1` al añadirlo,
+    `sign=-1` al quitarlo. `values` es un dict o un objeto con las variables.
+    """
+    get = values.get if isinstance(values, dict) else lambda name: getattr(values, name)
+    delta = {"owner_id": owner_id, "profile": bucket(profile), "patient_count": sign}
+    for name in STAT_FIELDS:
+        delta[f"sum_{name}"] = sign * (get(name) or 0)
+    return delta
+
+
+def merge_deltas(deltas) -> list[dict]:
+    """Suma las aportaciones del mismo grupo y descarta las que se anulan."""
+    merged = {}
+    for delta in deltas:
+        key = (delta["owner_id"], delta["profile"])
+        if key not in merged:
+            merged[key] = dict(delta)
+        else:
+            for column in COUNTER_COLUMNS:
+                merged[key][column] += delta[column]
+    return [delta for delta in merged.values() if any(delta[column] for column in COUNTER_COLUMNS)]
+
+
+def upsert_statement(dialect_name: str):
+    """
+    INSERT ... ON CONFLICT (owner_id, profile) DO UPDATE que suma cada aportación
+    a su grupo (o lo crea). Se ejecuta con una lista de aportaciones (executemany).
+    """
+    return _add_on_conflict(_dialect_insert(dialect_name)(models.PatientStats))
+
+
+def _dialect_insert(dialect_name: str):
+    return postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+
+
+def _add_on_conflict(statement):
+    return statement.on_conflict_do_update(
+        index_elements=[models.PatientStats.owner_id, models.PatientStats.profile],
+        set_={column: getattr(models.PatientStats, column) + statement.excluded[column]
+              for column in COUNTER_COLUMNS},
+    )
+
+
+def apply_deltas(db: Session, deltas) -> None:
+    """Aplica las aportaciones en la transacción de `db` (sin commit)."""
+    deltas = merge_deltas(deltas)
+    if deltas:
+        db.connection().execute(upsert_statement(db.get_bind().dialect.name), deltas)
+
+
+async def apply_deltas_async(db: AsyncSession, deltas) -> None:
+    deltas = merge_deltas(deltas)
+    if deltas:
+        await (await db.connection()).execute(upsert_statement(db.get_bind().dialect.name), deltas)
+
+
+# --- Sentencias para las escrituras de una sola sentencia de async_crud ---
+# Esas escrituras no leen antes el paciente: los valores que se restan se leen en
+# la propia sentencia (subconsultas por clave primaria) y, si el paciente no
+# existe o es de otro médico, no se toca ningún grupo.
+
+def _current(patient_id: int, owner_id: int, column, versions: list[int] | None = None):
+    statement = select(column).where(models.Patient.id == patient_id, models.Patient.owner_id == owner_id)
+    if versions is not None:
+        statement = statement.where(versioning.version_in(versions))
+    return statement.scalar_subquery()
+
+
+def _current_group(patient_id: int, owner_id: int, versions: list[int] | None = None):
+    stats = models.PatientStats
+    return (
+        stats.owner_id == owner_id,
+        stats.profile == _current(
+            patient_id, owner_id, func.coalesce(models.Patient.prediction_profile, UNSCORED), versions
+        ),
+    )
+
+
+def feature_change_statement(patient_id: int, owner_id: int, values: dict, versions: list[int] | None = None):
+    """
+    Cambia en su grupo los valores actuales del paciente por `values` (antes de su
+    UPDATE). Con `versions` (If-Match) solo si la versión del paciente es una de ellas.
+    """
+    stats = models.PatientStats
+    return (
+        update(stats)
+        .where(*_current_group(patient_id, owner_id, versions))
+        .values({
+            f"sum_{name}": getattr(stats, f"sum_{name}")
+            - _current(patient_id, owner_id, getattr(models.Patient, name), versions) + values[name]
+            for name in STAT_FIELDS if name in values
+        })
+    )
+
+
+def removal_statement(patient_id: int, owner_id: int):
+    """Resta al paciente de su grupo actual (antes de borrarlo o de cambiarle el perfil)."""
+    stats = models.PatientStats
+    values = {"patient_count": stats.patient_count - 1}
+    for name in STAT_FIELDS:
+        values[f"sum_{name}"] = getattr(stats, f"sum_{name}") - _current(patient_id, owner_id, getattr(models.Patient, name))
+    return update(stats).where(*_current_group(patient_id, owner_id)).values(values)
+
+
+def addition_statement(dialect_name: str, patient_id: int, owner_id: int, profile: int | None):
+    """Suma al paciente (con sus valores actuales) al grupo de `profile`."""
+    patient = models.Patient
+    source = select(
+        patient.owner_id, literal(bucket(profile)), literal(1),
+        *[getattr(patient, name) for name in STAT_FIELDS],
+    ).where(patient.id == patient_id, patient.owner_id == owner_id)
+    return _add_on_conflict(
+        _dialect_insert(dialect_name)(models.PatientStats).from_select(["owner_id", "profile", *COUNTER_COLUMNS], source)
+    )
+
+
+# --- Escrituras por lotes y reconciliación ---
+
+def aggregate_statement(patient_ids: list[int] | None = None):
+    """Agrupa los pacientes (todos o los de `patient_ids`) como lo hace patient_stats."""
+    patient = models.Patient
+    group = func.coalesce(patient.prediction_profile, UNSCORED)
+    statement = select(
+        patient.owner_id.label("owner_id"),
+        group.label("profile"),
+        func.count().label("patient_count"),
+        *[func.coalesce(func.sum(getattr(patient, name)), 0).label(f"sum_{name}") for name in STAT_FIELDS],
+    ).where(patient.owner_id.is_not(None))
+    if patient_ids is not None:
+        statement = statement.where(patient.id.in_(patient_ids))
+    return statement.group_by(patient.owner_id, group)
+
+
+def snapshot(db: Session, patient_ids: list[int]) -> list[dict]:
+    """Aportación actual de un bloque de pacientes, agrupada (para calcular deltas por lotes)."""
+    return [dict(row._mapping) for row in db.execute(aggregate_statement(patient_ids))]
+
+
+def snapshot_deltas(before: list[dict], after: list[dict]) -> list[dict]:
+    """Deltas que llevan de la aportación `before` a la `after` del mismo bloque."""
+    negated = [{**row, **{column: -row[column] for column in COUNTER_COLUMNS}} for row in before]
+    return negated + after
+
+
+def reconcile(db: Session) -> dict:
+    """
+    Recalcula patient_stats desde la tabla patients en una sola transacción y
+    devuelve cuántos grupos había y cuántos estaban desviados.
+    """
+    stats = models.PatientStats
+    if db.get_bind().dialect.name == "postgresql":
+        # Espera a las escrituras en curso y bloquea las nuevas hasta el commit
+        db.execute(text("LOCK TABLE patient_stats IN EXCLUSIVE MODE"))
+    # El DELETE toma también el bloqueo de escritura en SQLite antes de recalcular
+    stored = {
+        (row.owner_id, row.profile): tuple(getattr(row, column) for column in COUNTER_COLUMNS)
+        for row in db.execute(delete(stats).returning(stats.owner_id, stats.profile,
+                                                       *[getattr(stats, column) for column in COUNTER_COLUMNS]))
+    }
+    rows = [dict(row._mapping) for row in db.execute(aggregate_statement())]
+    if rows:
+        db.execute(insert(stats), rows)
+    db.commit()
+
+    expected = {(row["owner_id"], row["profile"]): tuple(row[column] for column in COUNTER_COLUMNS) for row in rows}
+    # Los grupos que quedaron a cero equivalen a no tener fila
+    stored = {key: value for key, value in stored.items() if any(value)}
+    drifted = sum(1 for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
+    return {"groups": len(expected), "drifted": drifted}
+
+
+def backfill_if_empty(db: Session) -> bool:
+    """Calcula las estadísticas la primera vez (tabla vacía con pacientes ya guardados)."""
+    if db.execute(select(models.PatientStats.owner_id).limit(1)).first() is not None:
+        return False
+    if db.execute(select(models.Patient.id).limit(1)).first() is None:
+        return False
+    reconcile(db)
+    return True
+
+
+# --- Lectura ---
+
+def _means(totals: dict, count: int) -> dict:
+    if count <= 0:
+        return {}
+    return {name: round(totals[f"sum_{name}"] / count, 2) for name in STAT_FIELDS}
+
+
+def summarize(rows) -> dict:
+    """
+    Resume las filas de patient_stats (de un médico o de varios) con la forma de
+    schemas.PatientStatsSummary. Las filas de varios médicos se suman por perfil.
+    """
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(row.profile, dict.fromkeys(COUNTER_COLUMNS, 0))
+        for column in COUNTER_COLUMNS:
+            group[column] += getattr(row, column)
+
+    totals = dict.fromkeys(COUNTER_COLUMNS, 0)
+    profiles = []
+    for profile in sorted(groups):
+        group = groups[profile]
+        count = group["patient_count"]
+        if count <= 0:
+            continue
+        for column in COUNTER_COLUMNS:
+            totals[column] += group[column]
+        scored = profile != UNSCORED
+        profiles.append({
+            "profile": profile if scored else None,
+            "description": describe_profile(profile) if scored else None,
+            "patients": count,
+            "means": _means(group, count),
+        })
+
+    unscored = groups.get(UNSCORED, {}).get("patient_count", 0)
+    return {
+        "patients": totals["patient_count"],
+        "unscored": max(unscored, 0),
+        "means": _means(totals, totals["patient_count"]),
+        "profiles": profiles,
+    }
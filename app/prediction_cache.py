@@ -0,0 +1,83 @@
+# app/prediction_cache.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Tamaño máximo (entradas) y tiempo de vida (segundos) de la caché de predicciones
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+
+
+class PredictionCache:
+    """
+    Caché LRU con expiración (TTL) para los resultados del modelo.
+
+    La clave es la tupla canónica de las 13 variables de `PredictionInput`.
+    Cada entrada pertenece a una versión del modelo: si la versión cambia
+    (el archivo del modelo se reemplazó) la caché se vacía por completo.
+    """
+
+    def __init__(self, maxsize: int = PREDICTION_CACHE_SIZE, ttl: float = PREDICTION_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._version = None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._data.clear()
+            self._version = version
+
+    def get(self, version, key):
+        """Devuelve el valor guardado para `key` o None si no existe o expiró."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._data.get((version, key))
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end((version, key))
+                    self.hits += 1
+                    return value
+                del self._data[(version, key)]
+            self.misses += 1
+            return None
+
+    def set(self, version, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._data[(version, key)] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end((version, key))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "model_version": self._version,
+            }
+
+
+# Instancia compartida por todo el proceso
+prediction_cache = PredictionCache()
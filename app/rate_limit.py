@@ -0,0 +1,466 @@
+# app/rate_limit.py
+#
+# Límite de peticiones por usuario y por IP en los endpoints caros (login con
+# bcrypt, predicción, listados grandes) con un cubo de fichas (token bucket): cada
+# regla "N/S" admite ráfagas de N peticiones y se rellena a N fichas cada S
+# segundos. Además limita las predicciones simultáneas de cada usuario.
+#
+# Backends:
+#   - memory (por defecto): en el proceso; con varios workers cada uno cuenta aparte.
+#   - redis: compartido por todos los workers e instancias (RATE_LIMIT_REDIS_URL).
+#     Cada operación es un script Lua atómico que usa la hora del servidor Redis.
+#   - local: el backend redis sobre LocalRedis, un sustituto en proceso del
+#     cliente que ejecuta los mismos scripts en Python (para pruebas sin servidor).
+# Si el backend compartido falla la petición se deja pasar (se cuenta el error).
+#
+# Las respuestas llevan las cabeceras RateLimit-Limit, RateLimit-Remaining,
+# RateLimit-Reset y RateLimit-Policy (borrador IETF); los 429 además Retry-After.
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from fastapi import HTTPException, Request, status
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # el backend redis es opcional
+    redis_asyncio = None
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# memory | redis | local
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_PREFIX = os.getenv("RATE_LIMIT_PREFIX", "ratelimit:")
+# Cubos que guarda como máximo el backend en memoria (se descartan los más antiguos)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Predicciones simultáneas por usuario (0 = sin límite)
+PREDICT_MAX_IN_FLIGHT_PER_USER = int(os.getenv("PREDICT_MAX_IN_FLIGHT_PER_USER", "4"))
+# Segundos tras los que el backend compartido olvida las plazas de un proceso caído
+PREDICT_SLOT_TTL = int(os.getenv("PREDICT_SLOT_TTL", "60"))
+# Filas del listado que cuestan una ficha (limit=1000 cuesta 10)
+LIST_ROWS_PER_TOKEN = int(os.getenv("RATE_LIMIT_LIST_ROWS_PER_TOKEN", "100"))
+
+
+class Rule(NamedTuple):
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    @property
+    def policy(self) -> str:
+        return f"{self.capacity};w={self.period:g}"
+
+    def __str__(self) -> str:
+        return f"{self.capacity}/{self.period:g}"
+
+
+def parse_rule(value: str | None) -> Rule | None:
+    """'N/S' -> Rule(N, S). Vacío, '0' u 'off' desactivan la regla."""
+    if not value or value.strip().lower() in ("0", "off"):
+        return None
+    try:
+        capacity, period = value.split("/")
+        rule = Rule(int(capacity), float(period))
+    except ValueError:
+        raise ValueError(f"Regla de límite no válida: '{value}' (formato: peticiones/segundos)")
+    if rule.capacity <= 0 or rule.period <= 0:
+        return None
+    return rule
+
+
+def _rule(route: str, scope: str, default: str) -> Rule | None:
+    return parse_rule(os.getenv(f"RATE_LIMIT_{route.upper()}_{scope.upper()}", default))
+
+
+# Reglas por ruta y ámbito; en 'list' la ficha es LIST_ROWS_PER_TOKEN filas pedidas
+RULES = {
+    "login": {"ip": _rule("login", "ip", "30/60"), "user": _rule("login", "user", "10/60")},
+    "predict": {"user": _rule("predict", "user", "120/60"), "ip": _rule("predict", "ip", "240/60")},
+    "list": {"user": _rule("list", "user", "600/60"), "ip": _rule("list", "ip", "1200/60")},
+}
+
+
+def take_tokens(tokens: float | None, updated: float | None, now: float, rule: Rule, cost: float):
+    """
+    Rellena el cubo por el tiempo transcurrido y, si alcanza, descuenta `cost`.
+    Devuelve (admitida, fichas que quedan). Un cubo nuevo (None) empieza lleno.
+    Un coste negativo devuelve fichas (sin pasar de la capacidad).
+    """
+    if tokens is None or updated is None:
+        tokens, updated = rule.capacity, now
+    tokens = min(rule.capacity, tokens + max(0.0, now - updated) * rule.rate)
+    allowed = tokens >= cost
+    if allowed:
+        tokens = min(rule.capacity, tokens - cost)
+    return allowed, tokens
+
+
+# --- Backends ---
+
+class MemoryBackend:
+    """Cubos y plazas en memoria del proceso."""
+    name = "memory"
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rule: Rule, cost: float):
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.pop(key, (None, None))
+            allowed, tokens = take_tokens(tokens, updated, now, rule, cost)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+    async def acquire(self, key: str, limit: int, ttl: int) -> bool:
+        with self._lock:
+            if self._slots.get(key, 0) >= limit:
+                return False
+            self._slots[key] = self._slots.get(key, 0) + 1
+            return True
+
+    async def release(self, key: str):
+        with self._lock:
+            remaining = self._slots.get(key, 0) - 1
+            if remaining > 0:
+                self._slots[key] = remaining
+            else:
+                self._slots.pop(key, None)
+
+
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1])
+local updated = tonumber(state[2])
+if tokens == nil or updated == nil then
+    tokens = capacity
+    updated = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return {allowed, tostring(tokens)}
+"""
+
+ACQUIRE_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count > tonumber(ARGV[1]) then
+    redis.call('DECR', KEYS[1])
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('DECR', KEYS[1]) <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+
+class RedisBackend:
+    """Cubos y plazas compartidos en Redis (o en LocalRedis)."""
+    name = "redis"
+
+    def __init__(self, client, prefix: str = RATE_LIMIT_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, key: str, rule: Rule, cost: float):
+        allowed, tokens = await self.client.eval(
+            TOKEN_BUCKET_SCRIPT, 1, self.prefix + key, rule.capacity, rule.rate, cost, math.ceil(rule.period)
+        )
+        return bool(int(allowed)), float(tokens)
+
+    async def acquire(self, key: str, limit: int, ttl: int) -> bool:
+        return bool(int(await self.client.eval(ACQUIRE_SCRIPT, 1, self.prefix + key, limit, ttl)))
+
+    async def release(self, key: str):
+        await self.client.eval(RELEASE_SCRIPT, 1, self.prefix + key)
+
+
+class LocalRedis:
+    """
+    Sustituto en proceso de redis.asyncio.Redis con lo único que usa RedisBackend:
+    eval() de sus tres scripts, reimplementados en Python con la misma semántica
+    (incluida la expiración de las claves).
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        if key in self._expires and self._expires[key] <= now:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def _set(self, key, value, ttl=None, now=None):
+        self._data[key] = value
+        if ttl is not None:
+            self._expires[key] = now + float(ttl)
+
+    def _delete(self, key):
+        self._data.pop(key, None)
+        self._expires.pop(key, None)
+
+    def _token_bucket(self, key, now, capacity, rate, cost, ttl):
+        rule = Rule(int(capacity), int(capacity) / float(rate))
+        tokens, updated = self._get(key, now) or (None, None)
+        allowed, tokens = take_tokens(tokens, updated, now, rule, float(cost))
+        self._set(key, (tokens, now), ttl, now)
+        return [int(allowed), str(tokens).encode()]
+
+    def _acquire(self, key, now, limit, ttl):
+        count = (self._get(key, now) or 0) + 1
+        if count > int(limit):
+            return 0
+        self._set(key, count, ttl, now)
+        return 1
+
+    def _release(self, key, now):
+        count = (self._get(key, now) or 0) - 1
+        if count <= 0:
+            self._delete(key)
+        else:
+            self._data[key] = count
+        return 1
+
+    async def eval(self, script: str, numkeys: int, *keys_and_args):
+        handler = {
+            TOKEN_BUCKET_SCRIPT: self._token_bucket,
+            ACQUIRE_SCRIPT: self._acquire,
+            RELEASE_SCRIPT: self._release,
+        }[script]
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        with self._lock:
+            return handler(*keys, time.time(), *args)
+
+
+def create_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "redis":
+        if redis_asyncio is None:
+            print("⚠ RATE_LIMIT_BACKEND=redis pero el paquete 'redis' no está instalado; se usa el backend en memoria")
+            return MemoryBackend()
+        return RedisBackend(redis_asyncio.from_url(RATE_LIMIT_REDIS_URL))
+    if name == "local":
+        return RedisBackend(LocalRedis())
+    return MemoryBackend()
+
+
+# --- Limitador ---
+
+class Decision(NamedTuple):
+    rule: Rule
+    allowed: bool
+    remaining: int
+    # Segundos hasta que el cubo vuelve a estar lleno / hasta que alcance para esta petición
+    reset: int
+    retry_after: int
+
+
+def _decision(rule: Rule, cost: float, allowed: bool, tokens: float) -> Decision:
+    return Decision(
+        rule=rule,
+        allowed=allowed,
+        remaining=max(0, math.floor(tokens)),
+        reset=math.ceil((rule.capacity - tokens) / rule.rate),
+        retry_after=0 if allowed else max(1, math.ceil((cost - tokens) / rule.rate)),
+    )
+
+
+def rate_limit_headers(decisions: list[Decision]) -> dict:
+    """Cabeceras RateLimit-* de la regla más restrictiva (y la política de todas)."""
+    tightest = min(decisions, key=lambda decision: (decision.allowed, decision.remaining))
+    headers = {
+        "RateLimit-Limit": str(tightest.rule.capacity),
+        "RateLimit-Remaining": str(tightest.remaining),
+        "RateLimit-Reset": str(tightest.reset),
+        "RateLimit-Policy": ", ".join(decision.rule.policy for decision in decisions),
+    }
+    if not tightest.allowed:
+        headers["Retry-After"] = str(tightest.retry_after)
+    return headers
+
+
+def client_ip(request: Request) -> str | None:
+    # Detrás de un proxy, uvicorn --proxy-headers pone aquí la IP del cliente
+    return request.client.host if request.client else None
+
+
+class RateLimiter:
+    def __init__(self, backend=None, rules: dict | None = None, enabled: bool = RATE_LIMIT_ENABLED,
+                 max_in_flight: int = PREDICT_MAX_IN_FLIGHT_PER_USER):
+        self.backend = backend if backend is not None else create_backend()
+        self.rules = RULES if rules is None else rules
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.allowed = 0
+        self.limited = {}
+        self.backend_errors = 0
+        self._lock = threading.Lock()
+
+    def _backend_error(self, error: Exception):
+        with self._lock:
+            self.backend_errors += 1
+            first = self.backend_errors == 1
+        if first:
+            print(f"⚠ Backend de límite de peticiones no disponible, se dejan pasar: {error}")
+
+    def _count_limited(self, rule_name: str, scope: str):
+        with self._lock:
+            key = f"{rule_name}:{scope}"
+            self.limited[key] = self.limited.get(key, 0) + 1
+
+    async def hit(self, request: Request, rule_name: str, user=None, cost: float = 1):
+        """
+        Descuenta `cost` fichas de los cubos de la regla para el usuario y la IP.
+        Si alguno no alcanza devuelve las fichas ya descontadas a los demás (un
+        cliente bloqueado no vacía el cubo de otro ámbito) y responde 429; si no,
+        deja las cabeceras RateLimit-* en request.state para RateLimitHeadersMiddleware.
+        Un coste mayor que la ráfaga de alguna regla no cabría nunca: responde 422.
+        """
+        if not self.enabled:
+            return
+        identities = {"user": user, "ip": client_ip(request)}
+        buckets = []
+        for scope, rule in self.rules.get(rule_name, {}).items():
+            identity = identities.get(scope)
+            if rule is None or identity is None:
+                continue
+            if cost > rule.capacity:
+                self._count_limited(rule_name, scope)
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=f"La petición cuesta {cost:g} fichas y el límite admite como máximo {rule.capacity}. Pide menos filas.",
+                )
+            buckets.append((scope, rule, f"{rule_name}:{scope}:{identity}"))
+
+        decisions, charged = [], []
+        for scope, rule, key in buckets:
+            try:
+                allowed, tokens = await self.backend.take(key, rule, cost)
+            except Exception as e:
+                self._backend_error(e)
+                continue
+            decisions.append(_decision(rule, cost, allowed, tokens))
+            if not allowed:
+                self._count_limited(rule_name, scope)
+                await self._refund(charged, cost)
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Demasiadas peticiones. Intenta de nuevo más tarde.",
+                    headers=rate_limit_headers(decisions),
+                )
+            charged.append((key, rule))
+        with self._lock:
+            self.allowed += 1
+        if decisions:
+            request.state.rate_limit_headers = rate_limit_headers(decisions)
+
+    async def _refund(self, charged: list, cost: float):
+        for key, rule in charged:
+            try:
+                await self.backend.take(key, rule, -cost)
+            except Exception as e:
+                self._backend_error(e)
+
+    async def acquire_prediction_slot(self, user) -> bool:
+        """
+        Ocupa una de las plazas de predicción simultánea del usuario (429 si no
+        quedan). Devuelve True si hay que liberarla con release_prediction_slot().
+        """
+        if not self.enabled or self.max_in_flight <= 0:
+            return False
+        try:
+            acquired = await self.backend.acquire(f"predict-slots:{user}", self.max_in_flight, PREDICT_SLOT_TTL)
+        except Exception as e:
+            self._backend_error(e)
+            return False
+        if not acquired:
+            self._count_limited("predict", "in_flight")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Demasiadas predicciones simultáneas para este usuario. Intenta de nuevo en unos segundos.",
+                headers={"Retry-After": "1"},
+            )
+        return True
+
+    async def release_prediction_slot(self, user):
+        try:
+            await self.backend.release(f"predict-slots:{user}")
+        except Exception as e:
+            self._backend_error(e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "backend": self.backend.name,
+                "allowed": self.allowed,
+                "limited": dict(self.limited),
+                "backend_errors": self.backend_errors,
+                "max_in_flight_predictions": self.max_in_flight,
+                "rules": {
+                    route: {scope: str(rule) for scope, rule in scopes.items() if rule is not None}
+                    for route, scopes in self.rules.items()
+                },
+            }
+
+
+class RateLimitHeadersMiddleware:
+    """Copia a la respuesta las cabeceras RateLimit-* que dejó RateLimiter.hit() en request.state."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # request.state guarda sus atributos en este mismo dict
+        state = scope.setdefault("state", {})
+
+        async def send_with_headers(message):
+            headers = state.get("rate_limit_headers")
+            if message["type"] == "http.response.start" and headers:
+                existing = list(message.get("headers", []))
+                # Los 429 ya traen las suyas
+                if not any(name.lower() == b"ratelimit-limit" for name, _ in existing):
+                    message["headers"] = existing + [
+                        (name.lower().encode(), value.encode()) for name, value in headers.items()
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+# Instancia compartida por todo el proceso
+rate_limiter = RateLimiter()
@@ -0,0 +1,98 @@
+# app/rescoring.py
+#
+# Predicción por lotes y re-predicción incremental. Los pacientes se procesan
+# por bloques: una consulta, una llamada al modelo y un UPDATE por lotes en cada
+# uno. La re-predicción incremental solo toca los pacientes sin predicción,
+# aquellos cuyas variables cambiaron desde la última (la huella features_hash no
+# coincide con prediction_features_hash) y los predichos con otra versión del modelo.
+
+import os
+
+from . import crud
+from .fingerprint import features_fingerprint
+from .inference import LoadedModel, describe_profile, get_loaded_model, predict_detailed, round_probabilities
+
+# Pacientes que se leen, se predicen y se guardan en cada bloque
+RESCORE_CHUNK_SIZE = int(os.getenv("RESCORE_CHUNK_SIZE", "1000"))
+
+
+def prediction_updates(rows, loaded: LoadedModel) -> list:
+    """
+    Predice un bloque de filas (id + las 13 variables) con una sola llamada al
+    modelo y devuelve los dicts que espera crud.bulk_update_patient_predictions.
+    """
+    features = [tuple(row[1:]) for row in rows]
+    detail = predict_detailed(features, loaded=loaded)
+    updates = []
+    for row, values, prediction, probabilities in zip(rows, features, detail.profiles, detail.probabilities):
+        profile = int(prediction)
+        updates.append({
+            "id": row[0],
+            "prediction_profile": profile,
+            "prediction_description": describe_profile(profile),
+            "prediction_model_version": loaded.version,
+            "prediction_probabilities": round_probabilities(probabilities),
+            "prediction_features_hash": features_fingerprint(values),
+        })
+    return updates
+
+
+def iter_feature_chunks(db, owner_id: int | None, patient_ids: list | None = None, only_unscored: bool = False,
+                        stale_for_version: str | None = None, chunk_size: int = RESCORE_CHUNK_SIZE):
+    """
+    Recorre los pacientes a predecir en bloques de `chunk_size` filas.
+    Con una lista de ids se trocea la propia lista (evita IN gigantes);
+    sin ella se avanza por clave (id > último id visto).
+    """
+    if patient_ids is not None:
+        for start in range(0, len(patient_ids), chunk_size):
+            rows = crud.get_patient_feature_rows(
+                db, owner_id=owner_id, limit=chunk_size,
+                patient_ids=patient_ids[start:start + chunk_size], only_unscored=only_unscored,
+                stale_for_version=stale_for_version
+            )
+            if rows:
+                yield rows
+        return
+
+    after_id = 0
+    while True:
+        rows = crud.get_patient_feature_rows(
+            db, owner_id=owner_id, after_id=after_id, limit=chunk_size, only_unscored=only_unscored,
+            stale_for_version=stale_for_version
+        )
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after_id = rows[-1].id
+
+
+def iter_predict_patients(db, loaded: LoadedModel, owner_id: int | None, patient_ids: list | None = None,
+                          only_unscored: bool = False, only_stale: bool = False,
+                          chunk_size: int = RESCORE_CHUNK_SIZE):
+    """
+    Predice y guarda los pacientes seleccionados bloque a bloque; devuelve
+    (generador) la lista de predicciones guardadas de cada bloque.
+    """
+    stale_for_version = loaded.version if only_stale else None
+    for rows in iter_feature_chunks(db, owner_id, patient_ids, only_unscored, stale_for_version, chunk_size):
+        updates = prediction_updates(rows, loaded)
+        crud.bulk_update_patient_predictions(db, updates)
+        yield updates
+
+
+def rescore_stale(db, loaded: LoadedModel | None = None, owner_id: int | None = None,
+                  chunk_size: int = RESCORE_CHUNK_SIZE, progress=None) -> int:
+    """
+    Vuelve a predecir los pacientes desactualizados (de un médico o de todos) y
+    devuelve cuántos se actualizaron. `progress(procesados)` se llama tras cada bloque.
+    """
+    loaded = loaded or get_loaded_model()
+    processed = 0
+    for updates in iter_predict_patients(db, loaded, owner_id, only_stale=True, chunk_size=chunk_size):
+        processed += len(updates)
+        if progress is not None:
+            progress(processed)
+    return processed
@@ -1,10 +1,16 @@
 # app/routers/admin.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Response
+from typing import List, Optional
 from sqlalchemy.orm import Session
 
-from .. import schemas, crud, dependencies, models
+from .. import schemas, crud, dependencies, models, auth, pagination
+from ..prediction_cache import prediction_cache
+from ..inference_batcher import inference_batcher
+from ..rate_limit import rate_limiter
+from .. import inference, model_registry, jobs, patient_stats
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter(
     tags=["Admin"]
@@ -12,26 +18,239 @@ router = APIRouter(
 
 @router.get("/users", response_model=List[schemas.User])
 def read_users(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = pagination.limit_query(100),
+    after: Optional[str] = None,
     db: Session = Depends(dependencies.get_db),
     current_user: models.User = Depends(dependencies.get_current_active_admin)
 ):
-    """Obtiene una lista de todos los usuarios. Solo para administradores."""
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+    """
+    Obtiene una lista de todos los usuarios. Solo para administradores.
+    Para paginar, enviar en `after` el valor de la cabecera X-Next-Cursor.
+    """
+    after_id = pagination.decode_cursor(after) if after else None
+    users = crud.get_users(db, skip=skip, limit=limit + 1, after_id=after_id)
+    return pagination.paginate(response, users, limit)
+
+def _model_status() -> dict:
+    loaded = inference.get_loaded_model()
+    manifest = loaded.manifest or {}
+    return {
+        "version": loaded.version,
+        "loaded_at": datetime.fromtimestamp(loaded.loaded_at),
+        "compiled": loaded.engine is not None,
+        "reloading": inference.is_reloading(),
+        "created_at": manifest.get("created_at"),
+        "sha256": manifest.get("sha256"),
+    }
+
+@router.get("/model", response_model=schemas.ModelStatus)
+def read_model_status(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Versión y estado del modelo cargado en este worker. Solo para administradores."""
+    try:
+        return _model_status()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.post("/model/reload", response_model=schemas.ModelStatus, status_code=status.HTTP_202_ACCEPTED)
+def reload_model(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """
+    Recarga el modelo desde disco en segundo plano, sin reiniciar el servicio.
+    Las peticiones siguen usando el modelo actual hasta que el nuevo está listo.
+    Solo afecta al worker que atiende la petición; el resto lo detecta por el
+    puntero ACTIVE del registro (o por la fecha de modificación del archivo clásico).
+    """
+    inference.reload_model_async()
+    try:
+        return _model_status()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.get("/model/versions", response_model=List[schemas.ModelVersion])
+def read_model_versions(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Versiones del registro de modelos (la más reciente primero). Solo para administradores."""
+    active = model_registry.get_active_version()
+    return [{**manifest, "active": manifest["version"] == active} for manifest in model_registry.list_versions()]
+
+@router.put("/model/active", response_model=schemas.ModelStatus, status_code=status.HTTP_202_ACCEPTED)
+def activate_model_version(
+    body: schemas.ModelActivate,
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """
+    Cambia la versión activa del registro (también sirve para volver a una anterior)
+    y la carga en segundo plano. Los demás workers la cargan al detectar el cambio.
+    """
+    try:
+        model_registry.set_active_version(body.version)
+    except model_registry.ModelRegistryError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    inference.reload_model_async()
+    try:
+        return _model_status()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def _latest_rescore_job(db: Session, status: list | None = None):
+    latest = crud.get_jobs(db, kind=schemas.JobKind.rescore.value, status=status, limit=1, only_global=True)
+    return latest[0] if latest else None
+
+@router.get("/model/rescore", response_model=schemas.RescoringStatus)
+def read_rescoring_status(
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Pacientes desactualizados y último trabajo de re-predicción. Solo para administradores."""
+    try:
+        stale = crud.count_stale_patients(db, inference.get_model_version())
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"stale": stale, "job": _latest_rescore_job(db)}
+
+@router.post("/model/rescore", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def start_rescoring(
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """
+    Encola la re-predicción de los pacientes desactualizados: sin predicción, con
+    datos modificados desde la última o predichos con otra versión del modelo
+    (p. ej. después de activar una nueva). Solo para administradores.
+    """
+    pending = [schemas.JobStatus.queued.value, schemas.JobStatus.running.value]
+    if _latest_rescore_job(db, status=pending) is not None:
+        raise HTTPException(status_code=409, detail="Ya hay una re-predicción en curso")
+    return jobs.enqueue(db, schemas.JobKind.rescore)
+
+@router.get("/stats", response_model=schemas.AdminStatsSummary)
+def read_stats(
+    db: Session = Depends(dependencies.get_read_db),
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """
+    Pacientes por perfil y medias de la edad y de cada nivel_*, en total y por
+    médico. Se lee de la tabla de estadísticas precalculadas (una fila por médico
+    y perfil), sin recorrer los pacientes. Solo para administradores.
+    """
+    rows = crud.get_patient_stats_rows(db)
+    by_owner = {}
+    for row in rows:
+        by_owner.setdefault(row.owner_id, []).append(row)
+    doctors = [{"owner_id": owner_id, **patient_stats.summarize(owner_rows)} for owner_id, owner_rows in by_owner.items()]
+    return {
+        "overall": patient_stats.summarize(rows),
+        "doctors": [doctor for doctor in doctors if doctor["patients"] > 0],
+    }
+
+@router.post("/stats/reconcile", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def reconcile_stats(
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """
+    Encola el recálculo de las estadísticas precalculadas desde la tabla de
+    pacientes (corrige cualquier desviación). Solo para administradores.
+    """
+    return jobs.enqueue(db, schemas.JobKind.reconcile_stats)
+
+@router.get("/jobs", response_model=List[schemas.Job])
+def read_jobs(
+    response: Response,
+    status: Optional[List[schemas.JobStatus]] = Query(None),
+    kind: Optional[schemas.JobKind] = None,
+    limit: int = pagination.limit_query(50),
+    after: Optional[str] = None,
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """
+    Trabajos de todos los usuarios, del más reciente al más antiguo, filtrables por
+    estado y tipo (cursor en X-Next-Cursor). Solo para administradores.
+    """
+    before_id = pagination.decode_cursor(after) if after else None
+    rows = crud.get_jobs(
+        db, status=[value.value for value in status] if status else None,
+        kind=kind.value if kind else None, limit=limit + 1, before_id=before_id,
+    )
+    return pagination.paginate(response, rows, limit)
+
+@router.get("/jobs/runner", response_model=schemas.JobRunnerStats)
+def read_job_runner_stats(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Trabajos en curso y terminados por el runner de este worker. Solo para administradores."""
+    return jobs.job_runner.stats()
+
+@router.get("/jobs/{job_id}", response_model=schemas.Job)
+def read_job(
+    job_id: int,
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Estado y progreso de cualquier trabajo. Solo para administradores."""
+    db_job = crud.get_job(db, job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return db_job
+
+@router.get("/model/cache", response_model=schemas.PredictionCacheStats)
+def read_prediction_cache_stats(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Estadísticas de la caché de predicciones (aciertos, fallos, tamaño). Solo para administradores."""
+    return prediction_cache.stats()
+
+@router.delete("/model/cache", status_code=status.HTTP_204_NO_CONTENT)
+def clear_prediction_cache(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Vacía la caché de predicciones. Solo para administradores."""
+    prediction_cache.clear()
+
+@router.get("/model/batcher", response_model=schemas.InferenceBatcherStats)
+def read_inference_batcher_stats(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Estado del micro-batching de predicciones de este worker. Solo para administradores."""
+    return inference_batcher.stats()
+
+@router.get("/auth/password-pool", response_model=schemas.PasswordPoolStats)
+def read_password_pool_stats(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Ocupación y cola del pool de bcrypt. Solo para administradores."""
+    return auth.password_pool.stats()
+
+@router.get("/rate-limit", response_model=schemas.RateLimitStats)
+def read_rate_limit_stats(
+    current_user: models.User = Depends(dependencies.get_current_active_admin)
+):
+    """Reglas y rechazos del límite de peticiones en este proceso. Solo para administradores."""
+    return rate_limiter.stats()
 
 @router.post("/users/register", response_model=schemas.User, status_code=status.HTTP_201_CREATED)
-def create_user_by_admin(
+async def create_user_by_admin(
     user: schemas.UserCreate,
     db: Session = Depends(dependencies.get_db),
     current_user: models.User = Depends(dependencies.get_current_active_admin)
 ):
     """Crea un nuevo usuario (médico o admin). Solo para administradores."""
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await run_in_threadpool(crud.get_user_by_email, db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="El correo electrónico ya está registrado")
-    return crud.create_user(db=db, user=user)
+    # El hash bcrypt se calcula en el pool dedicado, no en el thread pool de Starlette
+    try:
+        hashed_password = await auth.get_password_hash_async(user.password)
+    except auth.PasswordPoolSaturated:
+        raise dependencies.password_pool_saturated_exception()
+    return await run_in_threadpool(crud.create_user, db=db, user=user, hashed_password=hashed_password)
 
 @router.patch("/users/{user_id}/status", response_model=schemas.User)
 def toggle_user_activation(
@@ -1,158 +1,441 @@
 # app/routers/patients.py
 
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status, Request, Response, UploadFile, File
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from typing import List, Optional
 from sqlalchemy.orm import Session
-import pandas as pd
-import joblib
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
+import shutil
+import uuid
 
-from .. import schemas, crud, dependencies, models
+from .. import schemas, crud, async_crud, dependencies, models, pagination, bulk_import, bulk_export, rescoring, jobs, patient_stats, serialization, versioning
+from ..inference import (
+    get_loaded_model, get_loaded_model_async, predict_detailed_async,
+    round_probabilities, top_contributions, describe_profile,
+)
+from ..fingerprint import features_fingerprint
+from ..prediction_cache import prediction_cache
+from ..inference_batcher import inference_batcher, InferenceQueueFull
 
 router = APIRouter()
 
-MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'model', 'model_pipeline.joblib')
+# Número de pacientes que se cargan y se predicen en cada llamada al modelo
+BATCH_CHUNK_SIZE = 500
 
-# Variable global para almacenar el modelo (cargado lazily)
-_model = None
+# Los endpoints de un solo paciente y el listado son 'async def' sobre AsyncSession:
+# la concurrencia la limita la base de datos, no el thread pool de Starlette.
+@router.post("/", response_model=schemas.Patient, status_code=status.HTTP_201_CREATED)
+async def create_patient(patient: schemas.PatientCreate, db: AsyncSession = Depends(dependencies.get_async_db), current_user: models.User = Depends(dependencies.get_current_active_medico)):
+    return await async_crud.create_user_patient(db=db, patient=patient, user_id=current_user.id)
+@router.get("/", response_model=List[schemas.Patient], dependencies=[Depends(dependencies.rate_limit_listing)])
+async def read_patients(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = pagination.limit_query(100),
+    after: Optional[str] = None,
+    sort: schemas.PatientSort = schemas.PatientSort.id,
+    filters: schemas.PatientFilters = Depends(),
+    db: AsyncSession = Depends(dependencies.get_async_read_db),
+    current_user: models.User = Depends(dependencies.get_current_active_medico)
+):
+    """
+    Lista los pacientes del médico. Filtros (se combinan con AND):
+      - q: palabras del nombre
+      - profile / unscored: perfil predicho o solo los que no tienen predicción
+      - genero, orientacion_sexual, causa_deficiencia, cat_fisica, cat_psicosocial: valor exacto
+      - edad_min/edad_max y nivel_*_min/nivel_*_max: rangos (inclusivos)
+    `sort` ordena por id, nombre_apellidos, edad o nivel_global ('-' delante = descendente).
+    Para paginar, enviar en `after` el valor de la cabecera X-Next-Cursor de la
+    respuesta anterior, con los mismos filtros y orden (ignora `skip`).
+    El ETag es la versión de la lista del médico: con If-None-Match vigente se
+    responde 304 sin leer los pacientes. Las filas pedidas en `limit` cuentan
+    para el límite de peticiones del médico (app/rate_limit.py).
+    """
+    after_key = pagination.decode_sort_cursor(after, sort.value) if after else None
+    # La versión se lee antes que las filas: si entre medias cambia la lista, el
+    # ETag queda por detrás del contenido (la próxima petición lo vuelve a pedir),
+    # nunca por delante
+    roster_version, roster_updated_at = await versioning.get_roster_version(db, current_user.id)
+    etag = versioning.roster_etag(current_user.id, roster_version)
+    if versioning.is_not_modified(request.headers, etag, roster_updated_at):
+        return versioning.not_modified(etag, roster_updated_at)
+
+    # Camino rápido: solo las columnas de schemas.Patient, como tuplas, codificadas
+    # con orjson (sin validar cada fila con Pydantic). El JSON es el mismo.
+    rows = await async_crud.get_patient_rows_by_owner(
+        db=db, owner_id=current_user.id, columns=serialization.PATIENT_COLUMNS, skip=skip, limit=limit + 1,
+        filters=filters, sort=sort, after_key=after_key
+    )
+    rows = pagination.paginate(response, rows, limit, sort=sort.value)
+    return serialization.FastJSONResponse(
+        serialization.patient_rows_to_dicts(rows),
+        headers={**pagination.cursor_headers(response), **versioning.validator_headers(etag, roster_updated_at)},
+    )
 
-def get_model():
+@router.get("/stats", response_model=schemas.PatientStatsSummary)
+async def read_patient_stats(db: AsyncSession = Depends(dependencies.get_async_read_db), current_user: models.User = Depends(dependencies.get_current_active_medico)):
     """
-    Carga el modelo de manera perezosa (lazy loading).
-    Se carga la primera vez que se necesita en un endpoint.
+    Pacientes del médico por perfil predicho y medias de la edad y de cada nivel_*.
+    Se lee de la tabla de estadísticas precalculadas: el coste no depende del
+    número de pacientes.
     """
-    global _model
-    
-    if _model is not None:
-        return _model
-    
-    if not os.path.exists(MODEL_PATH):
-        raise RuntimeError(
-            f"⚠️ El archivo del modelo no se encontró en: {MODEL_PATH}\n"
-            "Por favor, ejecuta: python model/train_model.py"
-        )
-    
+    return patient_stats.summarize(await async_crud.get_patient_stats_rows(db, current_user.id))
+
+@router.get("/export")
+def export_patients(
+    format: schemas.DataFormat = schemas.DataFormat.ndjson,
+    current_user: models.User = Depends(dependencies.get_current_active_medico)
+):
+    """
+    Exporta todos los pacientes del médico en NDJSON (una línea JSON por paciente)
+    o CSV. La respuesta se envía en streaming: la memoria no crece con el tamaño
+    del listado. Los campos coinciden con `schemas.Patient`.
+    """
+    media_type, filename = bulk_export.export_file_info(format)
+    return StreamingResponse(
+        bulk_export.iter_export_chunks(current_user.id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# --- Trabajos en segundo plano (app/jobs.py) ---
+# Se declaran antes de /{patient_id} para que /jobs no se interprete como un id.
+
+def _accepted(job: models.Job) -> JSONResponse:
+    """202 con el trabajo encolado; la cabecera Location apunta a su estado."""
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=jsonable_encoder(schemas.Job.model_validate(job)),
+        headers={"Location": f"/patients/jobs/{job.id}"},
+    )
+
+@router.post("/export", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def export_patients_job(
+    format: schemas.DataFormat = schemas.DataFormat.ndjson,
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_medico)
+):
+    """
+    Encola la exportación de todos los pacientes del médico. Cuando el trabajo
+    termina, el archivo se descarga desde GET /patients/jobs/{job_id}/result.
+    """
+    return _accepted(jobs.enqueue(db, schemas.JobKind.export_patients, current_user.id, {"format": format.value}))
+
+@router.get("/jobs", response_model=List[schemas.Job])
+def read_jobs(
+    response: Response,
+    limit: int = pagination.limit_query(20),
+    after: Optional[str] = None,
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_medico)
+):
+    """Trabajos del médico, del más reciente al más antiguo (cursor en X-Next-Cursor)."""
+    before_id = pagination.decode_cursor(after) if after else None
+    rows = crud.get_jobs(db, owner_id=current_user.id, limit=limit + 1, before_id=before_id)
+    return pagination.paginate(response, rows, limit)
+
+def _get_owned_job(db: Session, job_id: int, owner_id: int) -> models.Job:
+    db_job = crud.get_job(db, job_id, owner_id=owner_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return db_job
+
+@router.get("/jobs/{job_id}", response_model=schemas.Job)
+def read_job(
+    job_id: int,
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_medico)
+):
+    """Estado y progreso de un trabajo del médico."""
+    return _get_owned_job(db, job_id, current_user.id)
+
+@router.get("/jobs/{job_id}/result")
+def download_job_result(
+    job_id: int,
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_medico)
+):
+    """Descarga el archivo generado por un trabajo de exportación terminado."""
+    db_job = _get_owned_job(db, job_id, current_user.id)
+    if db_job.kind != schemas.JobKind.export_patients.value:
+        raise HTTPException(status_code=400, detail="Este trabajo no genera ningún archivo")
+    if db_job.status != schemas.JobStatus.succeeded.value:
+        raise HTTPException(status_code=409, detail="El trabajo aún no ha terminado correctamente")
+    path = jobs.storage_path(db_job.result["file"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="El archivo del resultado ya no existe")
+    return FileResponse(path, media_type=db_job.result["media_type"], filename=db_job.result["filename"])
+
+@router.post("/bulk", response_model=schemas.BulkImportOutput, status_code=status.HTTP_201_CREATED,
+             responses={202: {"model": schemas.Job, "description": "Importación encolada (background=true)"}})
+def import_patients(
+    file: UploadFile = File(...),
+    format: Optional[schemas.DataFormat] = None,
+    score: bool = False,
+    background: bool = False,
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_medico)
+):
+    """
+    Importa pacientes desde un archivo CSV (con cabecera) o NDJSON.
+    Las filas se validan una a una y se insertan por bloques; las filas con
+    error se devuelven en el informe sin abortar las válidas. Con `score=true`
+    cada bloque se predice en una sola llamada al modelo.
+    Si no se indica `format` se deduce de la extensión del archivo.
+    Con `background=true` el archivo se guarda, la importación se encola y se
+    responde 202 con el trabajo (el informe queda en su `result`).
+    """
+    if format is None:
+        is_csv = (file.filename or "").lower().endswith(".csv") or file.content_type == "text/csv"
+        format = schemas.DataFormat.csv if is_csv else schemas.DataFormat.ndjson
+
+    if background:
+        name = f"import-{uuid.uuid4().hex}.{format.value}"
+        with open(jobs.storage_path(name), "wb") as f:
+            shutil.copyfileobj(file.file, f)
+        params = {"file": name, "format": format.value, "score": score}
+        return _accepted(jobs.enqueue(db, schemas.JobKind.import_patients, current_user.id, params))
+
     try:
-        _model = joblib.load(MODEL_PATH)
-        print(f"✓ Modelo cargado desde: {MODEL_PATH}")
-        return _model
-    except Exception as e:
-        raise RuntimeError(f"Error al cargar el modelo: {e}")
+        return bulk_import.import_patients(db, current_user.id, file.file, format, score=score)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El archivo debe estar codificado en UTF-8")
+
+def _check_owner(patient_owner: int | None, owner_id: int) -> None:
+    """
+    Con el owner_id de la fila (el de la sentencia que la leyó o, si una escritura
+    no la encontró, el de la consulta posterior): 404 si no existe, 403 si es de otro médico.
+    """
+    if patient_owner is None:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+    if patient_owner != owner_id:
+        raise HTTPException(status_code=403, detail="Operación no permitida. No eres el propietario de este paciente.")
+
+async def _get_owned_patient(db: AsyncSession, patient_id: int, owner_id: int) -> models.Patient:
+    # Una sola consulta por id; la propiedad se comprueba sobre la fila devuelta
+    db_patient = await async_crud.get_patient(db, patient_id=patient_id)
+    _check_owner(db_patient.owner_id if db_patient is not None else None, owner_id)
+    return db_patient
 
-# ... (Los endpoints GET, POST, PUT, DELETE se quedan exactamente igual) ...
-@router.post("/", response_model=schemas.Patient, status_code=status.HTTP_201_CREATED)
-def create_patient(patient: schemas.PatientCreate, db: Session = Depends(dependencies.get_db), current_user: models.User = Depends(dependencies.get_current_active_medico)):
-    return crud.create_user_patient(db=db, patient=patient, user_id=current_user.id)
-@router.get("/", response_model=List[schemas.Patient])
-def read_patients(skip: int = 0, limit: int = 100, db: Session = Depends(dependencies.get_db), current_user: models.User = Depends(dependencies.get_current_active_medico)):
-    return crud.get_patients_by_owner(db=db, owner_id=current_user.id, skip=skip, limit=limit)
 @router.get("/{patient_id}", response_model=schemas.Patient)
-def read_patient(
+async def read_patient(
     patient_id: int,
-    db: Session = Depends(dependencies.get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(dependencies.get_async_read_db),
     current_user: models.User = Depends(dependencies.get_current_active_medico)
 ):
     """
     Obtiene los detalles de un paciente específico.
     Solo el médico propietario puede ver su paciente.
+    Con If-None-Match (o If-Modified-Since) vigente responde 304 leyendo solo la versión.
     """
-    # --- LÍNEA CORREGIDA ---
-    # Cambiamos get_patient_by_id por la función correcta: get_patient
-    db_patient = crud.get_patient(db, patient_id=patient_id)
-    
-    if db_patient is None:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-    
-    # Verificación de propiedad
-    if db_patient.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Operación no permitida. No eres el propietario de este paciente.")
-    
+    if "if-none-match" in request.headers or "if-modified-since" in request.headers:
+        current = await async_crud.get_patient_version(db, patient_id=patient_id)
+        _check_owner(current.owner_id if current is not None else None, current_user.id)
+        etag = versioning.patient_etag(patient_id, current.version)
+        if versioning.is_not_modified(request.headers, etag, current.updated_at):
+            return versioning.not_modified(etag, current.updated_at)
+    db_patient = await _get_owned_patient(db, patient_id, current_user.id)
+    response.headers.update(
+        versioning.validator_headers(versioning.patient_etag(patient_id, db_patient.version), db_patient.updated_at)
+    )
     return db_patient
+
 @router.put("/{patient_id}", response_model=schemas.Patient)
-def update_patient_details(
+async def update_patient_details(
     patient_id: int,
     patient_update: schemas.PatientUpdate,
-    db: Session = Depends(dependencies.get_db),
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(dependencies.get_async_db),
     current_user: models.User = Depends(dependencies.get_current_active_medico)
 ):
     """
     Actualiza los detalles de un paciente específico.
     Solo el médico propietario puede actualizar su paciente.
+    Con If-Match (el ETag de GET /patients/{id}) solo se actualiza si nadie lo ha
+    cambiado desde entonces; si no, responde 412.
     """
-    db_patient = crud.get_patient(db, patient_id=patient_id)
+    # Una sola sentencia: UPDATE ... WHERE id = ? AND owner_id = ? [AND version IN (...)]
+    # RETURNING *; si no devuelve la fila, el owner_id actual decide entre 404, 403 y 412
+    patient_owner, db_patient = await async_crud.update_owned_patient(
+        db, patient_id=patient_id, owner_id=current_user.id, patient_update=patient_update,
+        expected_versions=versioning.if_match_versions(if_match, patient_id)
+    )
+    _check_owner(patient_owner, current_user.id)
     if db_patient is None:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-    
-    # Verificación de propiedad
-    if db_patient.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Operación no permitida. No eres el propietario de este paciente.")
-
-    # --- LÍNEA CORREGIDA ---
-    # Se pasa el objeto `db_patient` completo, no el `patient_id`.
-    return crud.update_patient(db=db, db_patient=db_patient, patient_update=patient_update)
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="El paciente ha cambiado desde que se leyó (If-Match). Vuelve a cargarlo.",
+        )
+    response.headers.update(
+        versioning.validator_headers(versioning.patient_etag(patient_id, db_patient.version), db_patient.updated_at)
+    )
+    return db_patient
 
 @router.delete("/{patient_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_patient(
+async def delete_patient(
     patient_id: int,
-    db: Session = Depends(dependencies.get_db),
+    db: AsyncSession = Depends(dependencies.get_async_db),
     current_user: models.User = Depends(dependencies.get_current_active_medico)
 ):
     """
     Elimina un paciente específico.
     Solo el médico propietario puede eliminar su paciente.
     """
-    # --- LÍNEA CORREGIDA ---
-    # Cambiamos get_patient_by_id por la función correcta: get_patient
-    db_patient = crud.get_patient(db, patient_id=patient_id)
-    
-    if db_patient is None:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-    
-    # Verificación de propiedad
-    if db_patient.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Operación no permitida. No eres el propietario de este paciente.")
-
-    # Si todo está bien, procedemos a eliminar
-    db.delete(db_patient)
-    db.commit()
+    # Una sola sentencia: DELETE ... WHERE id = ? AND owner_id = ? (404 o 403 si no borra nada)
+    patient_owner = await async_crud.delete_owned_patient(db, patient_id=patient_id, owner_id=current_user.id)
+    _check_owner(patient_owner, current_user.id)
     
     # Devolvemos una respuesta sin contenido, como indica el código de estado 204
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
-@router.post("/{patient_id}/predict", response_model=schemas.PredictionOutput)
-def predict_patient_profile(
+def _parse_include(include: Optional[str]) -> set:
+    """Convierte `include=proba,explanation` en un conjunto de schemas.PredictionInclude."""
+    if not include:
+        return set()
+    try:
+        return {schemas.PredictionInclude(value.strip()) for value in include.split(",") if value.strip()}
+    except ValueError:
+        allowed = ", ".join(option.value for option in schemas.PredictionInclude)
+        raise HTTPException(status_code=400, detail=f"Valor no válido en 'include'. Opciones: {allowed}")
+
+@router.post("/{patient_id}/predict", response_model=schemas.PredictionOutput,
+             dependencies=[Depends(dependencies.rate_limit_predict), Depends(dependencies.prediction_slot)])
+async def predict_patient_profile(
     patient_id: int, 
-    db: Session = Depends(dependencies.get_db),
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(dependencies.get_async_db),
     current_user: models.User = Depends(dependencies.get_current_active_medico)
 ):
-    db_patient = read_patient(patient_id, db, current_user)
+    """
+    Predice el perfil del paciente y lo guarda junto con la probabilidad de cada perfil.
+    Con `include` (separado por comas) la respuesta añade:
+      - proba: la probabilidad de cada perfil (índice = perfil)
+      - explanation: las variables que más contribuyen al perfil predicho
+    Sin `explanation`, si la predicción guardada corresponde a los datos actuales y al
+    modelo activo se devuelve sin llamar al modelo; si no, se usa la caché y el
+    micro-batching. Con `explanation` la predicción, las probabilidades y la
+    explicación salen de una sola pasada por el modelo.
+    Limitado por usuario y por IP, y a PREDICT_MAX_IN_FLIGHT_PER_USER predicciones
+    simultáneas por usuario (429 al superarlo).
+    """
+    extras = _parse_include(include)
+    db_patient = await _get_owned_patient(db, patient_id, current_user.id)
     prediction_data = schemas.PredictionInput.model_validate(db_patient)
     
-    # Convertimos los datos a un DataFrame. Los nombres de las columnas
-    # ('edad', 'genero', etc.) ya coinciden con lo que el nuevo modelo espera.
-    input_df = pd.DataFrame([prediction_data.model_dump()])
+    # Los valores van en el orden de schemas.PREDICTION_FEATURES, que coincide
+    # con las columnas ('edad', 'genero', etc.) con las que se entrenó el modelo.
+    row = tuple(prediction_data.model_dump().values())
+    features_hash = features_fingerprint(row)
+    explanation = None
 
     try:
-        # Cargar el modelo cuando se necesite
-        model = get_model()
-        
-        # Pasamos el DataFrame directamente al modelo.
-        prediction = model.predict(input_df)
-        profile = int(prediction[0]) # La predicción ahora es un array simple
+        loaded = await get_loaded_model_async()
+
+        is_fresh = (db_patient.prediction_profile is not None and db_patient.prediction_probabilities is not None
+                    and db_patient.prediction_model_version == loaded.version
+                    and db_patient.prediction_features_hash == features_hash)
+        if is_fresh and schemas.PredictionInclude.explanation not in extras:
+            profile, probabilities = db_patient.prediction_profile, db_patient.prediction_probabilities
+        elif schemas.PredictionInclude.explanation in extras:
+            detail = await predict_detailed_async([row], loaded=loaded, explain=True)
+            profile, probabilities = int(detail.profiles[0]), round_probabilities(detail.probabilities[0])
+            if detail.contributions is not None:
+                explanation = top_contributions(row, detail.contributions[0])
+            prediction_cache.set(loaded.version, row, (profile, probabilities))
+        else:
+            # Muchos pacientes comparten exactamente las mismas variables: se consulta
+            # primero la caché (clave = fila canónica + versión del modelo).
+            cached = prediction_cache.get(loaded.version, row)
+            if cached is None:
+                # Las predicciones concurrentes se agrupan en un solo lote (micro-batching);
+                # la inferencia (CPU) corre en el pool de inferencia, no en el event loop.
+                cached = await inference_batcher.predict(row, loaded)
+                prediction_cache.set(loaded.version, row, cached)
+            profile, probabilities = cached
         
         # Creamos una descripción de ejemplo basada en el perfil
-        descriptions = {
-            0: "Perfil de Barreras Bajas",
-            1: "Perfil de Barreras Moderadas",
-            2: "Perfil de Barreras Altas"
-        }
-        description = descriptions.get(profile, "Perfil no determinado")
+        description = describe_profile(profile)
 
+    except InferenceQueueFull:
+        raise dependencies.inference_queue_full_exception()
     except RuntimeError as e:
         raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error durante la ejecución del modelo: {e}")
 
-    crud.update_patient_prediction(db, patient_id=patient_id, profile=profile, description=description)
-    return {"profile": profile, "description": description}
\ No newline at end of file
+    # Si el paciente ya tiene guardada esta misma predicción (con la misma versión
+    # del modelo) no hace falta escribir en la BD
+    if (db_patient.prediction_profile != profile or db_patient.prediction_description != description
+            or db_patient.prediction_model_version != loaded.version
+            or db_patient.prediction_probabilities != probabilities
+            or db_patient.prediction_features_hash != features_hash
+            or db_patient.features_hash != features_hash):
+        await async_crud.update_owned_patient_prediction(
+            db, patient_id=patient_id, owner_id=current_user.id, profile=profile, description=description,
+            model_version=loaded.version, probabilities=probabilities, features_hash=features_hash,
+            previous=db_patient
+        )
+    return {
+        "profile": profile,
+        "description": description,
+        "model_version": loaded.version,
+        "probabilities": probabilities if schemas.PredictionInclude.proba in extras else None,
+        "explanation": explanation,
+    }
+
+@router.post("/predict/batch", response_model=schemas.BatchPredictionOutput,
+             responses={202: {"model": schemas.Job, "description": "Predicción encolada (background=true)"}},
+             dependencies=[Depends(dependencies.prediction_slot)])
+def predict_patient_profiles_batch(
+    batch: schemas.BatchPredictionInput,
+    background: bool = False,
+    db: Session = Depends(dependencies.get_db),
+    current_user: models.User = Depends(dependencies.get_current_active_medico)
+):
+    """
+    Predice el perfil de muchos pacientes del médico en una sola petición.
+    Los pacientes se procesan por bloques: una sola llamada al modelo
+    y un único UPDATE masivo por bloque. Con `only_stale` solo se predicen los
+    que no tienen predicción o cuya predicción no corresponde a sus datos
+    actuales o al modelo activo. Con `background=true` se encola y se responde
+    202 con el trabajo (sin la lista de resultados, solo el recuento).
+    """
+    patient_ids = sorted(set(batch.patient_ids)) if batch.patient_ids is not None else None
+    if background:
+        params = {"patient_ids": patient_ids, "only_unscored": batch.only_unscored, "only_stale": batch.only_stale}
+        return _accepted(jobs.enqueue(db, schemas.JobKind.predict_batch, current_user.id, params))
+
+    try:
+        loaded = get_loaded_model()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    results = []
+
+    try:
+        for updates in rescoring.iter_predict_patients(
+            db, loaded, current_user.id, patient_ids, batch.only_unscored, batch.only_stale, BATCH_CHUNK_SIZE
+        ):
+            results.extend(
+                {"patient_id": item["id"], "profile": item["prediction_profile"],
+                 "description": item["prediction_description"]}
+                for item in updates
+            )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error durante la ejecución del modelo: {e}")
+
+    not_found = []
+    if patient_ids is not None and not (batch.only_unscored or batch.only_stale):
+        processed_ids = {item["patient_id"] for item in results}
+        not_found = [patient_id for patient_id in patient_ids if patient_id not in processed_ids]
+
+    return {"processed": len(results), "results": results, "not_found": not_found, "model_version": loaded.version}
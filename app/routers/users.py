@@ -2,7 +2,7 @@
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 
 from .. import schemas, auth, dependencies
@@ -14,15 +14,21 @@ router = APIRouter()
 # La creación de usuarios ahora es responsabilidad exclusiva del admin
 # a través del endpoint /admin/users/register.
 
-@router.post("/login", response_model=schemas.Token)
-def login_for_access_token(
+@router.post("/login", response_model=schemas.Token, dependencies=[Depends(dependencies.rate_limit_login)])
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
-    db: Session = Depends(dependencies.get_db)
+    db: AsyncSession = Depends(dependencies.get_async_db)
 ):
     """
     Proporciona un token de acceso para un usuario autenticado.
+    La verificación bcrypt corre en el pool dedicado de `auth`; si está
+    saturado se responde 429 en lugar de bloquear al resto de endpoints.
+    Los intentos están limitados por IP y por cuenta (429 al superarlos).
     """
-    user = auth.authenticate_user(db, email=form_data.username, password=form_data.password)
+    try:
+        user = await auth.authenticate_user_async(db, email=form_data.username, password=form_data.password)
+    except auth.PasswordPoolSaturated:
+        raise dependencies.password_pool_saturated_exception()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,14 +1,35 @@
 # app/schemas.py
 
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from typing import Optional
-from datetime import date
+from typing import Dict, List, Optional
+from datetime import date, datetime
 from enum import Enum
 
 class Role(str, Enum):
     admin = "admin"
     medico = "médico"
 
+class DataFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+class PredictionInclude(str, Enum):
+    proba = "proba"
+    explanation = "explanation"
+
+class JobKind(str, Enum):
+    rescore = "rescore"
+    predict_batch = "predict_batch"
+    import_patients = "import"
+    export_patients = "export"
+    reconcile_stats = "reconcile_stats"
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -61,8 +82,55 @@ class Patient(PatientBase):
     owner_id: int
     prediction_profile: Optional[int] = None
     prediction_description: Optional[str] = None
+    # Versión del modelo que generó la predicción guardada
+    prediction_model_version: Optional[str] = None
+    # Probabilidad de cada perfil (índice = perfil) de la predicción guardada
+    prediction_probabilities: Optional[List[float]] = None
     model_config = ConfigDict(from_attributes=True)
 
+# Columnas (y su orden) de un paciente tal como se devuelve en la API
+PATIENT_FIELDS = list(Patient.model_fields)
+
+class PatientSort(str, Enum):
+    # Con '-' delante el orden es descendente; el id desempata siempre
+    id = "id"
+    id_desc = "-id"
+    nombre_apellidos = "nombre_apellidos"
+    nombre_apellidos_desc = "-nombre_apellidos"
+    edad = "edad"
+    edad_desc = "-edad"
+    nivel_global = "nivel_global"
+    nivel_global_desc = "-nivel_global"
+
+class PatientFilters(BaseModel):
+    """Filtros del listado de pacientes (parámetros de consulta de GET /patients/)."""
+    # Búsqueda por nombre: cada palabra debe aparecer en nombre_apellidos
+    q: Optional[str] = Field(None, max_length=100)
+    profile: Optional[int] = None
+    # Solo los pacientes sin predicción
+    unscored: bool = False
+    genero: Optional[str] = None
+    orientacion_sexual: Optional[str] = None
+    causa_deficiencia: Optional[str] = None
+    cat_fisica: Optional[str] = None
+    cat_psicosocial: Optional[str] = None
+    edad_min: Optional[int] = Field(None, ge=0)
+    edad_max: Optional[int] = Field(None, ge=0)
+    nivel_d1_min: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d1_max: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d2_min: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d2_max: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d3_min: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d3_max: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d4_min: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d4_max: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d5_min: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d5_max: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d6_min: Optional[int] = Field(None, ge=0, le=100)
+    nivel_d6_max: Optional[int] = Field(None, ge=0, le=100)
+    nivel_global_min: Optional[int] = Field(None, ge=0, le=100)
+    nivel_global_max: Optional[int] = Field(None, ge=0, le=100)
+
 class PredictionInput(BaseModel):
     edad: int
     genero: str
@@ -79,6 +147,163 @@ class PredictionInput(BaseModel):
     nivel_global: int
     model_config = ConfigDict(from_attributes=True)
 
+# Orden canónico de las 13 variables que recibe el modelo
+PREDICTION_FEATURES = list(PredictionInput.model_fields)
+
+class FeatureContribution(BaseModel):
+    feature: str
+    value: int | str
+    # Contribución al perfil predicho en la escala cruda del modelo (log-odds)
+    contribution: float
+
 class PredictionOutput(BaseModel):
     profile: int
-    description: str
\ No newline at end of file
+    description: str
+    model_version: str
+    # Solo se rellenan si se piden con ?include=proba,explanation
+    probabilities: Optional[List[float]] = None
+    explanation: Optional[List[FeatureContribution]] = None
+    model_config = ConfigDict(protected_namespaces=())
+
+class PasswordPoolStats(BaseModel):
+    workers: int
+    max_queue: int
+    in_flight: int
+    queued: int
+    completed: int
+    rejected: int
+
+class RateLimitStats(BaseModel):
+    enabled: bool
+    backend: str
+    allowed: int
+    # Rechazos por "regla:ámbito" (p. ej. "predict:user", "predict:in_flight")
+    limited: Dict[str, int]
+    backend_errors: int
+    max_in_flight_predictions: int
+    # Reglas activas "peticiones/segundos" por ruta y ámbito
+    rules: Dict[str, Dict[str, str]]
+
+class ModelStatus(BaseModel):
+    version: str
+    loaded_at: datetime
+    compiled: bool
+    reloading: bool
+    # Solo para versiones del registro (no para model_pipeline.joblib)
+    created_at: Optional[datetime] = None
+    sha256: Optional[str] = None
+
+class InferenceBatcherStats(BaseModel):
+    max_wait_ms: float
+    max_batch_size: int
+    max_queue: int
+    queued: int
+    batches: int
+    rows: int
+    mean_batch_size: float
+    rejected: int
+
+class ModelVersion(BaseModel):
+    version: str
+    created_at: datetime
+    sha256: str
+    size_bytes: int
+    classifier: str
+    compiled: bool
+    active: bool = False
+    features: List[dict]
+    training: dict
+
+class ModelActivate(BaseModel):
+    version: str
+
+class Job(BaseModel):
+    id: int
+    kind: JobKind
+    status: JobStatus
+    owner_id: Optional[int] = None
+    params: Optional[dict] = None
+    # Filas procesadas hasta ahora (y total, si se conoce de antemano)
+    progress: int
+    total: Optional[int] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class JobRunnerStats(BaseModel):
+    workers: int
+    running: int
+    completed: int
+    failed: int
+
+class RescoringStatus(BaseModel):
+    # Pacientes desactualizados respecto al modelo activo de este worker
+    stale: int
+    # Último trabajo de re-predicción de todos los pacientes
+    job: Optional[Job] = None
+
+class ProfileStats(BaseModel):
+    # None agrupa a los pacientes sin predicción
+    profile: Optional[int] = None
+    description: Optional[str] = None
+    patients: int
+    # Media de la edad y de cada nivel_* del grupo
+    means: Dict[str, float]
+
+class PatientStatsSummary(BaseModel):
+    patients: int
+    unscored: int
+    means: Dict[str, float]
+    profiles: List[ProfileStats]
+
+class DoctorStatsSummary(PatientStatsSummary):
+    owner_id: int
+
+class AdminStatsSummary(BaseModel):
+    overall: PatientStatsSummary
+    doctors: List[DoctorStatsSummary]
+
+class PredictionCacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    hit_ratio: float
+    size: int
+    maxsize: int
+    ttl_seconds: float
+    model_version: Optional[str] = None
+    model_config = ConfigDict(protected_namespaces=())
+
+class BatchPredictionInput(BaseModel):
+    # Si no se envían ids, se re-perfilan todos los pacientes del médico
+    # (o solo los que aún no tienen predicción si only_unscored=True, o solo
+    # aquellos cuya predicción está desactualizada si only_stale=True).
+    patient_ids: Optional[List[int]] = None
+    only_unscored: bool = False
+    only_stale: bool = False
+
+class BatchPredictionItem(BaseModel):
+    patient_id: int
+    profile: int
+    description: str
+
+class BatchPredictionOutput(BaseModel):
+    processed: int
+    results: List[BatchPredictionItem]
+    not_found: List[int] = []
+    model_version: Optional[str] = None
+    model_config = ConfigDict(protected_namespaces=())
+
+class BulkImportError(BaseModel):
+    row: int
+    errors: List[str]
+
+class BulkImportOutput(BaseModel):
+    inserted: int
+    scored: int
+    error_count: int
+    errors: List[BulkImportError]
@@ -0,0 +1,56 @@
+# app/serialization.py
+#
+# Camino rápido de serialización para los listados de pacientes. En lugar de
+# validar cada objeto ORM con Pydantic (from_attributes) y codificarlo con el
+# codificador JSON por defecto, el listado lee solo las columnas de
+# schemas.Patient como tuplas y las codifica con orjson. Los nombres, el orden y
+# los tipos de los campos son los mismos que produce schemas.Patient.
+
+import json
+from datetime import date
+
+from starlette.responses import Response
+
+from . import schemas
+
+try:
+    import orjson
+except ImportError:  # sin orjson se usa json de la biblioteca estándar (más lento)
+    orjson = None
+
+# Columnas (y su orden) que se leen de la BD para cada paciente del listado
+PATIENT_COLUMNS = schemas.PATIENT_FIELDS
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    """JSON compacto en UTF-8 (las fechas en ISO 8601, como en Pydantic)."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+def patient_rows_to_dicts(rows) -> list[dict]:
+    """Convierte filas con las columnas PATIENT_COLUMNS en dicts con la forma de schemas.Patient."""
+    items = []
+    for row in rows:
+        item = dict(zip(PATIENT_COLUMNS, row))
+        # schemas.Patient declara List[float]: un 1 guardado como entero sale como 1.0
+        probabilities = item["prediction_probabilities"]
+        if probabilities is not None:
+            item["prediction_probabilities"] = [float(value) for value in probabilities]
+        items.append(item)
+    return items
+
+
+class FastJSONResponse(Response):
+    """Respuesta JSON codificada con orjson (o json si no está instalado)."""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
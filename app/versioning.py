@@ -0,0 +1,144 @@
+# app/versioning.py
+#
+# Caché HTTP de los pacientes con peticiones condicionales:
+#   - GET /patients/{id}: ETag = id y versión de la fila (models.Patient.version),
+#     Last-Modified = updated_at.
+#   - GET /patients/: ETag = versión de la lista del médico (models.PatientRoster),
+#     que sube con cada alta, cambio o baja de uno de sus pacientes.
+# Con If-None-Match (o If-Modified-Since) vigente se responde 304 leyendo solo la
+# versión, sin cargar ni serializar los pacientes. PUT /patients/{id} admite
+# If-Match: si la versión ya no es la indicada responde 412 sin escribir.
+#
+# Las respuestas llevan Cache-Control: private, no-cache para que el navegador
+# guarde la copia pero la revalide siempre (el contenido es de un solo médico).
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Response, status
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+
+CACHE_CONTROL = "private, no-cache"
+
+
+# --- Versión de la lista de cada médico ---
+
+def roster_bump_statement(dialect_name: str):
+    """
+    INSERT ... ON CONFLICT (owner_id) DO UPDATE que sube la versión de la lista
+    (o la crea). Se ejecuta con una lista de {"owner_id", "updated_at"}.
+    """
+    roster = models.PatientRoster
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    statement = insert(roster).values(version=1)
+    return statement.on_conflict_do_update(
+        index_elements=[roster.owner_id],
+        set_={"version": roster.version + 1, "updated_at": statement.excluded.updated_at},
+    )
+
+
+def _bump_params(owner_ids) -> list[dict]:
+    now = models.utcnow()
+    return [{"owner_id": owner_id, "updated_at": now} for owner_id in sorted(set(owner_ids)) if owner_id is not None]
+
+
+def bump_rosters(db: Session, owner_ids) -> None:
+    """Sube la versión de la lista de cada médico en la transacción de `db` (sin commit)."""
+    params = _bump_params(owner_ids)
+    if params:
+        db.connection().execute(roster_bump_statement(db.get_bind().dialect.name), params)
+
+
+async def bump_roster_async(db: AsyncSession, owner_id: int) -> None:
+    await (await db.connection()).execute(roster_bump_statement(db.get_bind().dialect.name), _bump_params([owner_id]))
+
+
+async def get_roster_version(db: AsyncSession, owner_id: int):
+    """(versión, updated_at) de la lista del médico; (0, None) si nunca cambió."""
+    roster = models.PatientRoster
+    row = (await db.execute(
+        select(roster.version, roster.updated_at).where(roster.owner_id == owner_id)
+    )).first()
+    return (row.version, row.updated_at) if row is not None else (0, None)
+
+
+# --- ETag y Last-Modified ---
+
+def patient_etag(patient_id: int, version: int | None) -> str:
+    return f'"{patient_id}-{version or 0}"'
+
+
+def roster_etag(owner_id: int, version: int | None) -> str:
+    return f'"roster-{owner_id}-{version or 0}"'
+
+
+def http_date(value: datetime) -> str:
+    # SQLite devuelve las fechas sin zona horaria: se guardan en UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def validator_headers(etag: str, updated_at: datetime | None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if updated_at is not None:
+        headers["Last-Modified"] = http_date(updated_at)
+    return headers
+
+
+def _etags(header: str) -> list[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def is_not_modified(headers, etag: str, updated_at: datetime | None) -> bool:
+    """
+    Evalúa If-None-Match (comparación débil) o, si no viene, If-Modified-Since
+    (con precisión de segundos, la de la cabecera).
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = _etags(if_none_match)
+        return "*" in tags or etag in [tag.removeprefix("W/") for tag in tags]
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is None or updated_at is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(http_date(updated_at)) <= since
+
+
+def not_modified(etag: str, updated_at: datetime | None) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers(etag, updated_at))
+
+
+def version_in(versions: list[int]):
+    """Condición SQL "la versión del paciente es una de `versions`" (0 = sin versión, como en el ETag)."""
+    return func.coalesce(models.Patient.version, 0).in_(versions)
+
+
+def if_match_versions(header: str | None, patient_id: int) -> list[int] | None:
+    """
+    Versiones aceptadas por If-Match para el paciente: None si no hay condición
+    (sin cabecera o '*'), lista vacía si ninguna etiqueta es de este paciente.
+    Las etiquetas débiles (W/) no valen para If-Match.
+    """
+    if header is None:
+        return None
+    tags = _etags(header)
+    if "*" in tags:
+        return None
+    prefix = f'"{patient_id}-'
+    versions = []
+    for tag in tags:
+        if tag.startswith(prefix) and tag.endswith('"') and tag[len(prefix):-1].isdigit():
+            versions.append(int(tag[len(prefix):-1]))
+    return versions
@@ -0,0 +1,117 @@
+# benchmarks/bench_model.py
+#
+# Micro-benchmark del modelo: `model.predict` de sklearn (con DataFrame de pandas)
+# frente al motor compilado de app/inference.py, para 1, 100, 200, 500, 1000 y
+# 10.000 filas (500 y 1000 son IMPORT_CHUNK_SIZE y RESCORE_CHUNK_SIZE, los lotes de
+# la importación, la re-predicción y la predicción por lotes). 'compiled_explain'
+# mide la misma pasada devolviendo probabilidades y contribuciones; 'auto' es
+# inference.predict_profiles, que elige motor según COMPILED_MAX_ROWS.
+#
+# Uso:
+#   python benchmarks/bench_model.py
+#   python benchmarks/bench_model.py --sizes 1 100 500 1000 10000 --repeat 50 --json /tmp/model.json
+#
+# Requiere model/model_pipeline.joblib (python model/train_model.py).
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pandas as pd
+
+from app import inference, schemas
+from benchmarks.bench_api import make_patient
+
+
+def time_calls(fn, repeat: int, budget: float) -> list:
+    """Ejecuta `fn` hasta `repeat` veces (o hasta agotar `budget` segundos) y devuelve los tiempos."""
+    timings = []
+    deadline = time.perf_counter() + budget
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        if time.perf_counter() > deadline and len(timings) >= 3:
+            break
+    return sorted(timings)
+
+
+def summarize(name: str, rows: int, timings: list) -> dict:
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(round(p / 100 * (len(timings) - 1))))] * 1000
+
+    return {
+        "group": "model",
+        "scenario": f"{name}_{rows}",
+        "requests": len(timings),
+        "errors": 0,
+        "rows_per_s": rows / statistics.fmean(timings),
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de la inferencia del modelo")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1, 100, 200, 500, 1000, 10000], help="Filas por llamada")
+    parser.add_argument("--repeat", type=int, default=50, help="Llamadas por tamaño")
+    parser.add_argument("--budget", type=float, default=10.0, help="Segundos máximos por tamaño y motor")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Ruta donde guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    loaded = inference.get_loaded_model()
+    rng = random.Random(args.seed)
+    pool = [make_patient(rng) for _ in range(max(args.sizes))]
+    rows = [tuple(patient[name] for name in schemas.PREDICTION_FEATURES) for patient in pool]
+
+    results = []
+    for size in args.sizes:
+        batch = rows[:size]
+        # El DataFrame se construye dentro de la llamada: es lo que paga la API
+        results.append(summarize("sklearn", size, time_calls(
+            lambda: loaded.model.predict(pd.DataFrame(batch, columns=schemas.PREDICTION_FEATURES)),
+            args.repeat, args.budget,
+        )))
+        if loaded.engine is not None:
+            results.append(summarize("compiled", size, time_calls(
+                lambda: loaded.engine.predict(batch), args.repeat, args.budget,
+            )))
+            results.append(summarize("compiled_explain", size, time_calls(
+                lambda: loaded.engine.predict_detailed(batch, explain=True), args.repeat, args.budget,
+            )))
+        results.append(summarize("auto", size, time_calls(
+            lambda: inference.predict_profiles(batch, loaded=loaded), args.repeat, args.budget,
+        )))
+
+    print(f"\n{'escenario':<26}{'filas/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['scenario']:<26}{r['rows_per_s']:>12.0f}{r['p50_ms']:>10.3f}"
+              f"{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+
+    if args.json:
+        environment = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model_version": loaded.version,
+            "compiled_max_rows": inference.COMPILED_MAX_ROWS,
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        }
+        with open(args.json, "w") as f:
+            json.dump({"environment": environment, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
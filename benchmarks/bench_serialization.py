@@ -0,0 +1,121 @@
+# benchmarks/bench_serialization.py
+#
+# Micro-benchmark de la serialización del listado de pacientes (GET /patients/):
+#   - 'orm_pydantic': objetos ORM completos, validados con List[schemas.Patient]
+#     (from_attributes) y codificados con json, como hace FastAPI con response_model.
+#   - 'rows_orjson': solo las columnas de schemas.Patient como tuplas, codificadas
+#     con app/serialization.py (orjson), como hace ahora el endpoint.
+# Cada llamada incluye la consulta a la BD. Antes de medir se comprueba que los
+# dos caminos producen el mismo JSON.
+#
+# Uso:
+#   python benchmarks/bench_serialization.py
+#   python benchmarks/bench_serialization.py --sizes 100 1000 --repeat 50 --json /tmp/serialization.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import warnings
+from datetime import date
+from typing import List
+
+if "DATABASE_URL" not in os.environ:
+    DB_DIR = tempfile.mkdtemp(prefix="bench-serialization-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DB_DIR, 'serialization.db')}"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter("ignore")
+
+from pydantic import TypeAdapter
+
+from app import crud, models, patient_search, schemas, serialization
+from app.database import Base, SessionLocal, engine
+from benchmarks.bench_api import make_patient
+from benchmarks.bench_model import summarize, time_calls
+
+PATIENTS_LIST = TypeAdapter(List[schemas.Patient])
+
+
+def seed(db, rng: random.Random, n_rows: int) -> int:
+    doctor = models.User(email="bench-serialization@salud.co", full_name="Médico", role="médico", hashed_password="-")
+    db.add(doctor)
+    db.commit()
+    patients = []
+    for _ in range(n_rows):
+        patient = make_patient(rng)
+        patient["fecha_nacimiento"] = date(1980, 1, 15)
+        if rng.random() < 0.8:
+            probabilities = [rng.random() for _ in range(4)]
+            total = sum(probabilities)
+            patient["prediction_probabilities"] = [p / total for p in probabilities]
+            patient["prediction_profile"] = max(range(4), key=patient["prediction_probabilities"].__getitem__)
+        patients.append(patient)
+    crud.bulk_create_user_patients(db, patients, user_id=doctor.id)
+    return doctor.id
+
+
+def orm_pydantic(db, owner_id: int, size: int) -> bytes:
+    patients = db.execute(patient_search.listing_statement(owner_id, engine.dialect.name).limit(size)).scalars().all()
+    content = PATIENTS_LIST.dump_python(PATIENTS_LIST.validate_python(patients, from_attributes=True), mode="json")
+    # Igual que fastapi.responses.JSONResponse.render
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    db.expunge_all()
+    return body
+
+
+def rows_orjson(db, owner_id: int, size: int) -> bytes:
+    statement = patient_search.listing_statement(
+        owner_id, engine.dialect.name, columns=serialization.PATIENT_COLUMNS
+    ).limit(size)
+    return serialization.dumps(serialization.patient_rows_to_dicts(db.execute(statement).all()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de la serialización del listado de pacientes")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000], help="Pacientes por página")
+    parser.add_argument("--repeat", type=int, default=50, help="Llamadas por tamaño")
+    parser.add_argument("--budget", type=float, default=10.0, help="Segundos máximos por tamaño y camino")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Ruta donde guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    owner_id = seed(db, random.Random(args.seed), max(args.sizes))
+
+    results = []
+    for size in args.sizes:
+        if json.loads(orm_pydantic(db, owner_id, size)) != json.loads(rows_orjson(db, owner_id, size)):
+            print(f"❌ Los dos caminos no producen el mismo JSON con {size} pacientes")
+            sys.exit(1)
+        for name, fn in (("orm_pydantic", orm_pydantic), ("rows_orjson", rows_orjson)):
+            timings = time_calls(lambda: fn(db, owner_id, size), args.repeat, args.budget)
+            results.append({**summarize(name, size, timings), "group": "serialization"})
+    db.close()
+
+    print(f"\n{'escenario':<26}{'filas/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['scenario']:<26}{r['rows_per_s']:>12.0f}{r['p50_ms']:>10.3f}"
+              f"{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+    if serialization.orjson is None:
+        print("\n⚠ orjson no está instalado: 'rows_orjson' usa json de la biblioteca estándar")
+
+    if args.json:
+        environment = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "orjson": getattr(serialization.orjson, "__version__", None),
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        }
+        with open(args.json, "w") as f:
+            json.dump({"environment": environment, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
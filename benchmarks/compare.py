@@ -0,0 +1,92 @@
+# benchmarks/compare.py
+#
+# Compara los resultados JSON de bench_api.py / bench_model.py con una línea
+# base y termina con código 1 si algún escenario empeora más de la tolerancia.
+#
+# Uso:
+#   python benchmarks/compare.py benchmarks/baseline.json /tmp/api.json /tmp/model.json
+#   python benchmarks/compare.py benchmarks/baseline.json /tmp/api.json --tolerance 0.25
+#
+#   # Regenerar la línea base (combina varios archivos de resultados).
+#   # La incluida se generó con SQLite, 1 CPU y estos comandos:
+#   python benchmarks/bench_api.py --spawn --concurrency 16 --json /tmp/api.json
+#   python benchmarks/bench_model.py --json /tmp/model.json
+#   python benchmarks/compare.py --write benchmarks/baseline.json /tmp/api.json /tmp/model.json
+#
+# Las latencias dependen de la máquina: la comparación solo tiene sentido
+# contra una línea base generada en el mismo tipo de máquina (p. ej. el runner de CI).
+
+import argparse
+import json
+import sys
+
+# Métrica que decide la regresión: latencia p95 (más es peor)
+METRIC = "p95_ms"
+
+
+def load_results(paths: list) -> tuple:
+    environments, results = {}, {}
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        for result in data["results"]:
+            group = result.get("group", "api")
+            results[(group, result["scenario"])] = result
+            environments[group] = data.get("environment", {})
+    return environments, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara resultados de benchmark con una línea base")
+    parser.add_argument("baseline", help="JSON con la línea base")
+    parser.add_argument("results", nargs="+", help="JSON generados por bench_api.py / bench_model.py")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="Empeoramiento máximo admitido (0.20 = 20%%)")
+    parser.add_argument("--write", action="store_true", help="Escribir los resultados como nueva línea base")
+    args = parser.parse_args()
+
+    environments, current = load_results(args.results)
+
+    if args.write:
+        baseline = {
+            "environment": environments,
+            "results": [current[key] for key in sorted(current)],
+        }
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"✓ Línea base escrita en {args.baseline} ({len(current)} escenarios)")
+        return
+
+    with open(args.baseline) as f:
+        baseline_data = json.load(f)
+    baseline = {(r.get("group", "api"), r["scenario"]): r for r in baseline_data["results"]}
+
+    # Avisar si los parámetros o la máquina no coinciden (la comparación pierde sentido)
+    for group, environment in environments.items():
+        reference = baseline_data.get("environment", {}).get(group, {})
+        different = sorted(k for k in environment if k in reference and environment[k] != reference[k])
+        if different:
+            print(f"⚠ Entorno de '{group}' distinto de la línea base: {', '.join(different)}")
+
+    regressions = 0
+    print(f"\n{'escenario':<26}{'base ' + METRIC:>14}{'actual':>12}{'cambio':>10}")
+    for key in sorted(current):
+        result = current[key]
+        name = f"{key[0]}/{key[1]}"
+        reference = baseline.get(key)
+        if reference is None or not reference.get(METRIC) or result.get(METRIC) is None:
+            print(f"{name:<26}{'-':>14}{result.get(METRIC) or 0:>12.2f}{'nuevo':>10}")
+            continue
+        change = result[METRIC] / reference[METRIC] - 1
+        regressed = change > args.tolerance or result["errors"] > reference["errors"]
+        regressions += regressed
+        mark = "❌" if regressed else "✅"
+        print(f"{name:<26}{reference[METRIC]:>14.2f}{result[METRIC]:>12.2f}{change:>+10.0%} {mark}")
+
+    if regressions:
+        print(f"\n❌ {regressions} escenario(s) empeoran más de un {args.tolerance:.0%} respecto a la línea base")
+        sys.exit(1)
+    print("\n✅ Sin regresiones respecto a la línea base")
+
+
+if __name__ == "__main__":
+    main()
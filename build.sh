@@ -11,9 +11,14 @@ echo "======================================"
 echo "✓ Dependencias ya están instaladas"
 
 # Paso 2: Generar el modelo si no existe
+# El registro de versiones (MODEL_REGISTRY_DIR, por defecto model/registry) no se
+# versiona en git: sin versión activa se sirve model/model_pipeline.joblib. Para
+# desplegar otro modelo, entrénalo en el servidor con model/train_model.py, con
+# MODEL_REGISTRY_DIR en un disco persistente para que sobreviva a los redeploys.
 echo ""
 echo "Verificando modelo ML..."
-if [ ! -f "model/model_pipeline.joblib" ]; then
+REGISTRY_DIR="${MODEL_REGISTRY_DIR:-model/registry}"
+if [ ! -f "model/model_pipeline.joblib" ] && [ ! -f "$REGISTRY_DIR/ACTIVE" ]; then
     echo "⚠️ Modelo no encontrado. Generando modelo..."
     python model/train_model.py
     echo "✓ Modelo generado correctamente"
@@ -1,80 +1,468 @@
 # train_model.py
+#
+# Entrenamiento del pipeline de perfilamiento. Se puede importar como módulo
+# (train_model.train, train_model.scan_training_data, ...) o usar como script:
+#
+#   # Datos simulados (comportamiento por defecto, lo usa build.sh); el modelo se
+#   # guarda como una nueva versión del registro (model/registry) y queda activo
+#   python model/train_model.py
+#
+#   # Registro real por bloques, con el motor HistGradientBoosting en 4 núcleos
+#   python model/train_model.py --input registros.csv --engine hgb --n-jobs 4
+#   python model/train_model.py --input registros.parquet --chunk-size 200000
+#
+#   # El clustering y las estadísticas recorren todas las filas bloque a bloque; el
+#   # clasificador se entrena con una muestra aleatoria de como máximo --max-train-rows
+#   python model/train_model.py --input registros.csv --max-train-rows 500000
+#
+#   # Registrar sin activar (se activa luego con PUT /admin/model/active)
+#   python model/train_model.py --no-activate
+#
+# Leer Parquet requiere pyarrow (no es necesario para la API).
 
-import pandas as pd
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import NamedTuple
+
+import joblib
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
-from sklearn.cluster import KMeans
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.compose import ColumnTransformer
-from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.ensemble import GradientBoostingClassifier, HistGradientBoostingClassifier
 from sklearn.pipeline import Pipeline
-import joblib
-import os
+from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
+from threadpoolctl import threadpool_limits
 
-print("--- Iniciando Proceso de Entrenamiento Final (con snake_case) ---")
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
-# --- 1. Simulación de Datos ALINEADA CON LA API (usando snake_case) ---
-# CORRECCIÓN CRÍTICA: Los nombres de las columnas ahora están en snake_case.
-data = {
-    'edad': np.random.randint(18, 70, size=1000),
-    'genero': np.random.choice(['Femenino', 'Masculino', 'No responde'], size=1000),
-    'orientacion_sexual': np.random.choice(['Heterosexual', 'Homosexual', 'Bisexual', 'No responde'], size=1000),
-    'causa_deficiencia': np.random.choice([
-        "Enfermedad general", "Accidente de tránsito", "Alteración genética o hereditaria",
-        "Complicaciones durante el parto", "Violencia por delincuencia común"
-    ], size=1000),
-    'cat_fisica': np.random.choice(['SI', 'NO'], size=1000),
-    'cat_psicosocial': np.random.choice(['SI', 'NO'], size=1000),
-    'nivel_d1': np.random.randint(0, 101, size=1000),
-    'nivel_d2': np.random.randint(0, 101, size=1000),
-    'nivel_d3': np.random.randint(0, 101, size=1000),
-    'nivel_d4': np.random.randint(0, 101, size=1000),
-    'nivel_d5': np.random.randint(0, 101, size=1000),
-    'nivel_d6': np.random.randint(0, 101, size=1000),
-    'nivel_global': np.random.randint(0, 101, size=1000),
-}
-df = pd.DataFrame(data)
-
-# --- 2. Etapa de Clustering (Simulada) ---
-cluster_vars = ['nivel_d1', 'nivel_d2', 'nivel_d3', 'nivel_d4']
-kmeans = KMeans(n_clusters=3, random_state=42, n_init=10)
-df['Perfil'] = kmeans.fit_predict(df[cluster_vars])
-
-# --- 3. Etapa de Clasificación ---
-print("Entrenando el modelo de clasificación final...")
-
-# CORRECCIÓN CRÍTICA: La lista de características también usa snake_case.
-feature_columns = [
+# Permite importar el paquete 'app' (registro de modelos) al ejecutar el script directamente
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import model_registry
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_pipeline.joblib')
+
+# CORRECCIÓN CRÍTICA: Los nombres de las columnas están en snake_case (alineados con la API).
+NUMERIC_FEATURES = [
+    'edad', 'nivel_d1', 'nivel_d2', 'nivel_d3', 'nivel_d4', 'nivel_d5', 'nivel_d6', 'nivel_global'
+]
+CATEGORICAL_FEATURES = ['genero', 'orientacion_sexual', 'causa_deficiencia', 'cat_fisica', 'cat_psicosocial']
+FEATURE_COLUMNS = [
     'edad', 'genero', 'orientacion_sexual', 'causa_deficiencia', 'cat_fisica',
     'cat_psicosocial', 'nivel_d1', 'nivel_d2', 'nivel_d3', 'nivel_d4',
     'nivel_d5', 'nivel_d6', 'nivel_global'
 ]
-X = df[feature_columns]
-y = df['Perfil']
-
-numeric_features = X.select_dtypes(include=np.number).columns.tolist()
-categorical_features = X.select_dtypes(include=['object']).columns.tolist()
-
-preprocessor = ColumnTransformer(
-    transformers=[
-        ('num', MinMaxScaler(), numeric_features),
-        ('cat', OneHotEncoder(handle_unknown='ignore'), categorical_features)
-    ],
-    remainder='passthrough'
-)
-
-model_pipeline = Pipeline(steps=[
-    ('preprocessor', preprocessor),
-    ('classifier', GradientBoostingClassifier(random_state=42))
-])
-
-model_pipeline.fit(X, y)
-
-# --- 4. Guardado del Modelo ---
-model_dir = os.path.join(os.path.dirname(__file__))
-if not os.path.exists(model_dir):
-    os.makedirs(model_dir)
-model_path = os.path.join(model_dir, 'model_pipeline.joblib')
-joblib.dump(model_pipeline, model_path)
-
-print(f"✅ Modelo final guardado exitosamente en '{model_path}'")
-print("Este modelo está ahora 100% alineado con la API (espera snake_case).")
\ No newline at end of file
+# Variables con las que se etiqueta el perfil (clustering)
+CLUSTER_VARS = ['nivel_d1', 'nivel_d2', 'nivel_d3', 'nivel_d4']
+N_PROFILES = 3
+
+ENGINES = ["gb", "hgb"]
+# Filas con las que se entrena como máximo el clasificador (muestra aleatoria uniforme)
+MAX_TRAIN_ROWS = 1_000_000
+
+
+# --- 1. Simulación de Datos ALINEADA CON LA API (usando snake_case) ---
+# Se expone como función para que tests/test_inference_parity.py pueda muestrear la misma distribución.
+def generate_training_data(n_samples=1000, random_state=None):
+    rng = np.random.RandomState(random_state)
+    data = {
+        'edad': rng.randint(18, 70, size=n_samples),
+        'genero': rng.choice(['Femenino', 'Masculino', 'No responde'], size=n_samples),
+        'orientacion_sexual': rng.choice(['Heterosexual', 'Homosexual', 'Bisexual', 'No responde'], size=n_samples),
+        'causa_deficiencia': rng.choice([
+            "Enfermedad general", "Accidente de tránsito", "Alteración genética o hereditaria",
+            "Complicaciones durante el parto", "Violencia por delincuencia común"
+        ], size=n_samples),
+        'cat_fisica': rng.choice(['SI', 'NO'], size=n_samples),
+        'cat_psicosocial': rng.choice(['SI', 'NO'], size=n_samples),
+        'nivel_d1': rng.randint(0, 101, size=n_samples),
+        'nivel_d2': rng.randint(0, 101, size=n_samples),
+        'nivel_d3': rng.randint(0, 101, size=n_samples),
+        'nivel_d4': rng.randint(0, 101, size=n_samples),
+        'nivel_d5': rng.randint(0, 101, size=n_samples),
+        'nivel_d6': rng.randint(0, 101, size=n_samples),
+        'nivel_global': rng.randint(0, 101, size=n_samples),
+    }
+    return pd.DataFrame(data)
+
+
+# --- Medición por etapa ---
+
+def _max_rss_mb() -> float | None:
+    """Pico de memoria residente del proceso hasta ahora (incluye la memoria nativa)."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+class StageReport:
+    """
+    Tiempo de reloj y memoria de cada etapa:
+      - python_peak_mb: pico del heap de Python en la etapa (tracemalloc; incluye los
+        arrays de NumPy, no la memoria nativa de sklearn/OpenMP)
+      - max_rss_mb: pico de memoria residente del proceso al terminar la etapa
+        (acumulado desde el arranque, no por etapa)
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 2**20 if self.trace_memory else None
+        max_rss = _max_rss_mb() if self.trace_memory else None
+        self.stages.append({"stage": name, "seconds": elapsed, "python_peak_mb": peak, "max_rss_mb": max_rss})
+        memory = ""
+        if peak is not None:
+            memory += f", pico del heap de Python {peak:.1f} MB"
+        if max_rss is not None:
+            memory += f", RSS máximo del proceso {max_rss:.1f} MB"
+        print(f"✓ {name}: {elapsed:.2f} s{memory}")
+
+    def close(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+# --- 2. Lectura por bloques ---
+
+def _compact(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Reduce la memoria de un bloque: categorías para el texto y enteros pequeños para los niveles."""
+    missing = [column for column in FEATURE_COLUMNS if column not in chunk.columns]
+    if missing:
+        raise ValueError(f"Faltan columnas en los datos de entrada: {', '.join(missing)}")
+    chunk = chunk[FEATURE_COLUMNS].dropna()
+    compact = {}
+    for column in NUMERIC_FEATURES:
+        compact[column] = pd.to_numeric(chunk[column], downcast="integer")
+    for column in CATEGORICAL_FEATURES:
+        compact[column] = chunk[column].astype(str).astype("category")
+    return pd.DataFrame(compact, index=chunk.index)[FEATURE_COLUMNS]
+
+
+def iter_input_chunks(path: str, chunk_size: int = 100_000, input_format: str | None = None):
+    """Genera bloques de como máximo `chunk_size` filas de un CSV o un Parquet."""
+    input_format = input_format or ("parquet" if path.lower().endswith((".parquet", ".pq")) else "csv")
+    if input_format == "csv":
+        yield from pd.read_csv(path, usecols=FEATURE_COLUMNS, chunksize=chunk_size)
+    elif input_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Para leer Parquet instala pyarrow: pip install pyarrow")
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=FEATURE_COLUMNS):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Formato de entrada no soportado: {input_format}")
+
+
+def iter_frame_chunks(df: pd.DataFrame, chunk_size: int = 100_000):
+    """Bloques de un DataFrame ya en memoria (datos simulados), como iter_input_chunks."""
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+def _as_categories(df: pd.DataFrame) -> pd.DataFrame:
+    # pd.concat pasa a object las columnas cuyas categorías difieren entre bloques
+    for column in CATEGORICAL_FEATURES:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(str).astype("category")
+    return df
+
+
+class RowSample:
+    """
+    Muestra aleatoria uniforme de como máximo `max_rows` filas, en una pasada: cada
+    fila recibe una clave aleatoria y se quedan las de menor clave. Si caben todas,
+    es el registro completo en su orden original.
+    """
+
+    def __init__(self, max_rows: int = MAX_TRAIN_ROWS, random_state: int = 42):
+        self.max_rows = max_rows
+        self.rng = np.random.default_rng(random_state)
+        self.frame = None
+        self.keys = np.empty(0)
+        self.seen = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.seen > self.max_rows
+
+    def add(self, chunk: pd.DataFrame):
+        chunk = chunk.set_axis(np.arange(self.seen, self.seen + len(chunk)))
+        self.seen += len(chunk)
+        keys = self.rng.random(len(chunk))
+        if self.frame is None:
+            frame = chunk
+        else:
+            frame = pd.concat([self.frame, chunk])
+            keys = np.concatenate([self.keys, keys])
+        if len(frame) > self.max_rows:
+            keep = np.argpartition(keys, self.max_rows)[:self.max_rows]
+            frame, keys = frame.iloc[keep], keys[keep]
+        self.frame, self.keys = _as_categories(frame), keys
+
+    def result(self) -> pd.DataFrame:
+        return self.frame.sort_index().reset_index(drop=True)
+
+
+class RunningStats:
+    """Media, desviación típica y frecuencias de todas las filas, acumuladas por bloques."""
+
+    def __init__(self):
+        self.rows = 0
+        self.sums = {column: 0.0 for column in NUMERIC_FEATURES}
+        self.squares = {column: 0.0 for column in NUMERIC_FEATURES}
+        self.counts = {column: {} for column in CATEGORICAL_FEATURES}
+
+    def add(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        for column in NUMERIC_FEATURES:
+            values = chunk[column].to_numpy(dtype=np.float64)
+            self.sums[column] += float(values.sum())
+            self.squares[column] += float(np.square(values).sum())
+        for column in CATEGORICAL_FEATURES:
+            counts = self.counts[column]
+            for value, count in chunk[column].value_counts().items():
+                counts[str(value)] = counts.get(str(value), 0) + int(count)
+
+    def summary(self) -> dict:
+        numeric = {}
+        for column in NUMERIC_FEATURES:
+            mean = self.sums[column] / self.rows
+            # Desviación muestral (ddof=1), como pandas
+            variance = (self.squares[column] - self.rows * mean**2) / (self.rows - 1) if self.rows > 1 else float("nan")
+            numeric[column] = {"mean": mean, "std": float(np.sqrt(max(variance, 0.0)))}
+        categorical = {
+            column: dict(sorted(counts.items(), key=lambda item: -item[1]))
+            for column, counts in self.counts.items()
+        }
+        return {"rows": self.rows, "numeric": numeric, "categorical": categorical}
+
+
+class TrainingScan(NamedTuple):
+    # Muestra con la que se entrena el clasificador (todas las filas si caben)
+    sample: pd.DataFrame
+    # Clustering ajustado con partial_fit sobre todas las filas
+    kmeans: MiniBatchKMeans
+    truncated: bool
+    stats: dict
+
+
+def new_kmeans(batch_size: int = 4096, random_state: int = 42) -> MiniBatchKMeans:
+    return MiniBatchKMeans(n_clusters=N_PROFILES, batch_size=batch_size, n_init=3, random_state=random_state)
+
+
+def scan_training_data(chunks, max_rows: int = MAX_TRAIN_ROWS, batch_size: int = 4096,
+                       random_state: int = 42) -> TrainingScan:
+    """
+    Recorre los bloques una sola vez: ajusta el clustering con partial_fit, acumula
+    las estadísticas y guarda una muestra acotada. La memoria depende de
+    `max_rows` y del tamaño de bloque, no del tamaño del registro.
+    """
+    kmeans = new_kmeans(batch_size, random_state)
+    sample = RowSample(max_rows, random_state)
+    stats = RunningStats()
+    for chunk in chunks:
+        chunk = _compact(chunk)
+        if chunk.empty:
+            continue
+        stats.add(chunk)
+        sample.add(chunk)
+        features = chunk[CLUSTER_VARS].to_numpy(dtype=np.float32)
+        for start in range(0, len(features), batch_size):
+            batch = features[start:start + batch_size]
+            # El primer partial_fit necesita al menos un punto por perfil
+            if len(batch) >= N_PROFILES or hasattr(kmeans, "cluster_centers_"):
+                kmeans.partial_fit(batch)
+    if stats.rows == 0:
+        raise ValueError("Los datos de entrada no contienen filas")
+    return TrainingScan(sample.result(), kmeans, sample.truncated, stats.summary())
+
+
+def load_training_data(path: str, chunk_size: int = 100_000, input_format: str | None = None,
+                       max_rows: int = MAX_TRAIN_ROWS) -> pd.DataFrame:
+    """
+    Lee el archivo por bloques y devuelve solo las columnas del modelo en tipos
+    compactos: todas las filas si caben en `max_rows`, si no una muestra aleatoria.
+    """
+    return scan_training_data(iter_input_chunks(path, chunk_size, input_format), max_rows).sample
+
+
+# --- 3. Etiquetado (clustering) ---
+
+def label_profiles(df: pd.DataFrame, batch_size: int = 4096, random_state: int = 42) -> np.ndarray:
+    """Asigna un perfil a cada fila con MiniBatchKMeans sobre CLUSTER_VARS."""
+    return new_kmeans(batch_size, random_state).fit_predict(df[CLUSTER_VARS].to_numpy(dtype=np.float32))
+
+
+# --- 4. Clasificación ---
+
+def build_pipeline(engine: str = "gb", random_state: int = 42) -> Pipeline:
+    """
+    Pipeline de preprocesado + clasificador.
+      - gb:  GradientBoostingClassifier (un hilo; el que compila app/inference.py)
+      - hgb: HistGradientBoostingClassifier (multinúcleo, para registros grandes;
+             la API lo sirve con sklearn porque el motor compilado no lo soporta)
+    """
+    if engine == "gb":
+        classifier = GradientBoostingClassifier(random_state=random_state)
+        encoder = OneHotEncoder(handle_unknown='ignore')
+    elif engine == "hgb":
+        classifier = HistGradientBoostingClassifier(random_state=random_state)
+        # HistGradientBoosting no acepta matrices dispersas
+        encoder = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
+    else:
+        raise ValueError(f"Motor no soportado: {engine}")
+
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', MinMaxScaler(), NUMERIC_FEATURES),
+            ('cat', encoder, CATEGORICAL_FEATURES)
+        ],
+        remainder='passthrough'
+    )
+    return Pipeline(steps=[
+        ('preprocessor', preprocessor),
+        ('classifier', classifier)
+    ])
+
+
+def save_model(model_pipeline: Pipeline, model_path: str = MODEL_PATH):
+    """
+    Guarda el modelo como un único archivo (formato clásico, sin registro).
+    Se escribe en un archivo temporal y se renombra: la API recarga el modelo
+    al cambiar el archivo y nunca debe leer uno a medio escribir.
+    """
+    model_dir = os.path.dirname(os.path.abspath(model_path))
+    os.makedirs(model_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=model_dir, suffix=".joblib.tmp")
+    os.close(fd)
+    try:
+        joblib.dump(model_pipeline, tmp_path)
+        os.replace(tmp_path, model_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def training_stats(scan: TrainingScan, labels: np.ndarray, engine: str, report: StageReport) -> dict:
+    """
+    Estadísticas de entrenamiento que se guardan en el manifiesto del registro.
+    Las medias, desviaciones y frecuencias son de todas las filas; los perfiles,
+    de la muestra con la que se entrenó el clasificador.
+    """
+    return {
+        **scan.stats,
+        "engine": engine,
+        "training_rows": int(len(scan.sample)),
+        "profile_counts": {str(profile): int(count) for profile, count in enumerate(np.bincount(labels))},
+        "stages": report.stages,
+    }
+
+
+def train(df: pd.DataFrame, engine: str = "gb", n_jobs: int | None = None,
+          random_state: int = 42, report: StageReport | None = None,
+          kmeans: MiniBatchKMeans | None = None) -> tuple:
+    """
+    Etiqueta los perfiles y entrena el pipeline sobre `df` (columnas FEATURE_COLUMNS).
+    Con `kmeans` (ya ajustado sobre el registro completo, ver scan_training_data)
+    solo se predicen los perfiles de `df`; sin él se ajusta el clustering sobre `df`.
+    Devuelve (pipeline, perfiles asignados por el clustering).
+    """
+    report = report or StageReport(trace_memory=False)
+    # n_jobs limita los hilos OpenMP/BLAS (HistGradientBoosting, MiniBatchKMeans)
+    with threadpool_limits(limits=n_jobs):
+        with report.stage("Etiquetado de perfiles (MiniBatchKMeans)"):
+            if kmeans is None:
+                y = label_profiles(df, random_state=random_state)
+            else:
+                y = kmeans.predict(df[CLUSTER_VARS].to_numpy(dtype=np.float32))
+
+        with report.stage(f"Entrenamiento del clasificador ({engine})"):
+            model_pipeline = build_pipeline(engine, random_state=random_state)
+            model_pipeline.fit(df[FEATURE_COLUMNS], y)
+    return model_pipeline, y
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Entrena y guarda el modelo de perfilamiento")
+    parser.add_argument("--input", help="CSV o Parquet con los registros (por defecto, datos simulados)")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="Formato de --input (por defecto, por extensión)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Filas por bloque al leer --input")
+    parser.add_argument("--samples", type=int, default=1000, help="Filas simuladas si no se indica --input")
+    parser.add_argument("--max-train-rows", type=int, default=MAX_TRAIN_ROWS,
+                        help="Filas como máximo (muestra aleatoria) con las que se entrena el clasificador")
+    parser.add_argument("--engine", choices=ENGINES, default="gb", help="Clasificador a entrenar")
+    parser.add_argument("--n-jobs", type=int, help="Hilos para el entrenamiento (por defecto, todos)")
+    parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--registry", default=model_registry.REGISTRY_DIR, help="Directorio del registro de modelos")
+    parser.add_argument("--no-activate", action="store_true", help="Registrar la versión sin activarla")
+    parser.add_argument("--output", help="Guardar como un único archivo en esta ruta, sin usar el registro")
+    parser.add_argument("--no-memory", action="store_true", help="No medir el pico de memoria (más rápido)")
+    args = parser.parse_args(argv)
+
+    print("--- Iniciando Proceso de Entrenamiento Final (con snake_case) ---")
+    report = StageReport(trace_memory=not args.no_memory)
+    try:
+        with report.stage("Lectura por bloques (estadísticas, clustering y muestra)"):
+            if args.input:
+                chunks = iter_input_chunks(args.input, args.chunk_size, args.format)
+            else:
+                chunks = iter_frame_chunks(generate_training_data(n_samples=args.samples), args.chunk_size)
+            with threadpool_limits(limits=args.n_jobs):
+                scan = scan_training_data(chunks, args.max_train_rows, random_state=args.random_state)
+        df = scan.sample
+        print(f"  {scan.stats['rows']} filas; el clasificador se entrena con {len(df)} "
+              f"({df.memory_usage(deep=True).sum() / 2**20:.2f} MB en memoria)")
+
+        # Si la muestra es el registro completo, el clustering se ajusta sobre él con
+        # varias pasadas (como fit_predict); si no, vale el de partial_fit sobre todas las filas
+        model_pipeline, labels = train(df, engine=args.engine, n_jobs=args.n_jobs,
+                                       random_state=args.random_state, report=report,
+                                       kmeans=scan.kmeans if scan.truncated else None)
+
+        with report.stage("Guardado del modelo"):
+            if args.output:
+                save_model(model_pipeline, args.output)
+                destination = args.output
+            else:
+                stats = training_stats(scan, labels, args.engine, report)
+                version = model_registry.register_model(
+                    model_pipeline, training=stats, activate=not args.no_activate, registry_dir=args.registry
+                )
+                state = "registrada" if args.no_activate else "registrada y activa"
+                destination = f"{args.registry} (versión {version}, {state})"
+    except (OSError, ValueError, RuntimeError) as e:
+        raise SystemExit(f"❌ ERROR: {e}")
+    finally:
+        report.close()
+
+    total = sum(stage["seconds"] for stage in report.stages)
+    print(f"✅ Modelo final guardado exitosamente en '{destination}' ({total:.2f} s en total)")
+    print("Este modelo está ahora 100% alineado con la API (espera snake_case).")
+    return report.stages
+
+
+if __name__ == "__main__":
+    main()
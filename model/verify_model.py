@@ -1,18 +1,22 @@
 # verify_model.py
 
 import pandas as pd
-import joblib
 import os
+import sys
+
+# Permite importar el paquete 'app' (motor compilado) al ejecutar el script directamente
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 print("--- Iniciando Script de Verificación del Modelo Unificado ---")
 
-# --- 1. Cargar el modelo recién generado ---
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'model_pipeline.joblib')
+# --- 1. Cargar el modelo activo (registro o model_pipeline.joblib), igual que la API ---
+from app import inference
 try:
-    model = joblib.load(MODEL_PATH)
-    print("✅ Modelo cargado exitosamente.")
-except FileNotFoundError:
-    print("❌ ERROR: No se encontró el modelo. Ejecuta 'python train_model.py' primero.")
+    loaded = inference.get_loaded_model()
+    model = loaded.model
+    print(f"✅ Modelo cargado exitosamente (versión {loaded.version}).")
+except RuntimeError as e:
+    print(f"❌ ERROR: {e}")
     exit()
 
 # --- 2. Crear datos de prueba que simulan la entrada de la API ---
@@ -63,4 +67,8 @@ except Exception as e:
     print(e)
     print("\nSi ves este error, significa que el modelo en 'model_pipeline.joblib' todavía no está alineado con la API.")
 
+# --- 5. Paridad del motor de inferencia compilado ---
+# La comprueban las pruebas (tests/test_inference_parity.py): python -m pytest -q
+print("\nLa paridad del motor compilado con sklearn se verifica con: python -m pytest -q tests/test_inference_parity.py")
+
 print("\n--- Fin del Script de Verificación ---")
\ No newline at end of file
@@ -0,0 +1,17 @@
+# tests/conftest.py
+#
+# Configuración común de las pruebas (python -m pytest desde la raíz del repositorio).
+# La app lee DATABASE_URL al importarse: antes de importar nada de 'app' se apunta
+# a una BD SQLite temporal, o a TEST_DATABASE_URL si se define (p. ej. un
+# PostgreSQL de pruebas). Nunca se usa el DATABASE_URL del entorno.
+
+import os
+import sys
+import tempfile
+
+DB_DIR = tempfile.mkdtemp(prefix="tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{os.path.join(DB_DIR, 'tests.db')}"
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+# model/ para importar train_model (generate_training_data)
+sys.path.insert(0, os.path.join(ROOT, 'model'))
@@ -0,0 +1,88 @@
+# tests/test_inference_parity.py
+#
+# Paridad del motor de inferencia compilado (app/inference.py) con el pipeline de
+# sklearn del modelo activo: mismos perfiles, mismas probabilidades y contribuciones
+# que, más un sesgo constante por perfil, suman el valor crudo del perfil predicho.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import inference
+from app.schemas import PREDICTION_FEATURES
+from train_model import generate_training_data
+
+N_ROWS = 2000
+
+BASE = {
+    'edad': 42, 'genero': 'Masculino', 'orientacion_sexual': 'Heterosexual',
+    'causa_deficiencia': 'Accidente de tránsito', 'cat_fisica': 'NO', 'cat_psicosocial': 'SI',
+    'nivel_d1': 25, 'nivel_d2': 50, 'nivel_d3': 75, 'nivel_d4': 100, 'nivel_d5': 50, 'nivel_d6': 25,
+    'nivel_global': 55,
+}
+# Casos límite: categorías desconocidas y valores fuera del rango de entrenamiento
+EDGE_ROWS = [
+    {**BASE, 'genero': 'Otro', 'causa_deficiencia': 'Desconocida'},
+    {**BASE, 'edad': 120, 'nivel_d1': 0, 'nivel_global': 100},
+    {**BASE, 'edad': 1, 'nivel_d4': 0, 'nivel_d6': 100},
+    {**BASE, 'edad': 0, **{f'nivel_d{k}': 0 for k in range(1, 7)}, 'nivel_global': 0},
+    {**BASE, 'edad': 200, **{f'nivel_d{k}': 100 for k in range(1, 7)}, 'nivel_global': 100},
+]
+
+
+@pytest.fixture(scope="module")
+def loaded():
+    loaded = inference.get_loaded_model()
+    if loaded.engine is None:
+        pytest.skip("El modelo activo no se puede compilar; la API usa pandas + sklearn")
+    return loaded
+
+
+@pytest.fixture(scope="module")
+def data():
+    df = pd.concat([
+        generate_training_data(n_samples=N_ROWS, random_state=0)[PREDICTION_FEATURES],
+        pd.DataFrame(EDGE_ROWS)[PREDICTION_FEATURES],
+    ], ignore_index=True)
+    return df, list(df.itertuples(index=False, name=None))
+
+
+def test_profiles_match_sklearn(loaded, data):
+    df, rows = data
+    np.testing.assert_array_equal(loaded.engine.predict(rows), loaded.model.predict(df))
+    np.testing.assert_allclose(loaded.engine.decision_function(rows), loaded.model.decision_function(df),
+                               rtol=0, atol=1e-9)
+
+
+def test_edge_rows_match_sklearn(loaded):
+    df = pd.DataFrame(EDGE_ROWS)[PREDICTION_FEATURES]
+    rows = list(df.itertuples(index=False, name=None))
+    np.testing.assert_array_equal(loaded.engine.predict(rows), loaded.model.predict(df))
+    np.testing.assert_allclose(loaded.engine.predict_proba(rows), loaded.model.predict_proba(df), rtol=0, atol=1e-9)
+
+
+def test_probabilities_and_contributions(loaded, data):
+    df, rows = data
+    profiles, proba, contributions = loaded.engine.predict_detailed(rows, explain=True)
+    np.testing.assert_array_equal(profiles, loaded.model.predict(df))
+    np.testing.assert_allclose(proba, loaded.model.predict_proba(df), rtol=0, atol=1e-9)
+    assert contributions.shape == (len(rows), len(PREDICTION_FEATURES))
+
+    raw = loaded.model.decision_function(df)
+    raw = np.column_stack([-raw, raw]) if raw.ndim == 1 else raw
+    predicted_raw = raw[np.arange(len(rows)), np.searchsorted(loaded.model.classes_, profiles)]
+    bias = predicted_raw - contributions.sum(axis=1)
+    # El sesgo es el mismo para todas las filas que predicen el mismo perfil
+    for profile in np.unique(profiles):
+        assert np.ptp(bias[profiles == profile]) < 1e-6, f"contribuciones inconsistentes en el perfil {profile}"
+
+
+def test_large_batches_fall_back_to_sklearn(loaded, data):
+    df, rows = data
+    assert len(rows) > inference.COMPILED_MAX_ROWS
+    np.testing.assert_array_equal(inference.predict_profiles(rows, loaded), loaded.model.predict(df))
+    small = rows[:inference.COMPILED_MAX_ROWS]
+    np.testing.assert_array_equal(inference.predict_profiles(small, loaded),
+                                  loaded.model.predict(df.iloc[:inference.COMPILED_MAX_ROWS]))
+    detail = inference.predict_detailed(rows, loaded)
+    np.testing.assert_allclose(detail.probabilities, loaded.model.predict_proba(df), rtol=0, atol=1e-9)
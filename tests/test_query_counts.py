@@ -0,0 +1,109 @@
+# tests/test_query_counts.py
+#
+# Fija cuántas sentencias SQL ejecuta cada endpoint de paciente, para detectar
+# regresiones (consultas de más) en los flujos de lectura, actualización,
+# predicción y borrado. Levanta la app en proceso (requiere httpx).
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.main import app
+from app.database import async_engine, engine
+
+# (código HTTP, sentencias esperadas) por endpoint (la autenticación sale de la caché de tokens).
+# Las escrituras llevan además la de las estadísticas precalculadas (app/patient_stats.py):
+# un UPDATE de patient_stats antes de actualizar o borrar y un upsert (INSERT) al cambiar de perfil;
+# y, si escriben, el upsert (INSERT) de la versión de la lista del médico (app/versioning.py).
+# El listado lee primero esa versión; con If-None-Match vigente no lee nada más.
+# Las escrituras filtran por owner_id (y versión con If-Match); sus 403, 404 y 412 leen
+# después el owner_id de la fila. Los de la lectura salen de la misma sentencia.
+# Los casos se ejecutan en este orden: cada uno parte del estado que deja el anterior.
+EXPECTED = {
+    "list": (200, ["SELECT", "SELECT"]),
+    "list (304)": (304, ["SELECT"]),
+    "read": (200, ["SELECT"]),
+    "read (304)": (304, ["SELECT"]),
+    "read (403)": (403, ["SELECT"]),
+    "update": (200, ["UPDATE", "UPDATE", "INSERT"]),
+    "update (412)": (412, ["UPDATE", "UPDATE", "SELECT"]),
+    "update (404)": (404, ["UPDATE", "UPDATE", "SELECT"]),
+    "predict": (200, ["SELECT", "INSERT", "UPDATE", "INSERT"]),
+    "predict (sin cambios)": (200, ["SELECT"]),
+    "delete": (204, ["UPDATE", "DELETE", "INSERT"]),
+    "delete (403)": (403, ["UPDATE", "DELETE", "SELECT"]),
+    "update (403)": (403, ["UPDATE", "UPDATE", "SELECT"]),
+}
+
+PATIENT = {
+    "nombre_apellidos": "Paciente Prueba", "fecha_nacimiento": "1980-01-15", "edad": 42,
+    "genero": "Masculino", "orientacion_sexual": "Heterosexual", "causa_deficiencia": "Accidente de tránsito",
+    "cat_fisica": "NO", "cat_psicosocial": "SI", "nivel_d1": 25, "nivel_d2": 50, "nivel_d3": 75,
+    "nivel_d4": 100, "nivel_d5": 50, "nivel_d6": 25, "nivel_global": 55,
+}
+
+
+def login(client, email, password):
+    response = client.post("/users/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="module")
+def recorded():
+    """Ejecuta los casos de EXPECTED en orden y devuelve {caso: (código HTTP, sentencias)}."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split(None, 1)[0].upper())
+
+    with TestClient(app) as client:
+        admin = login(client, "administrador@salud.co", "adminpassword")
+        doctors = []
+        for email in ("check-1@salud.co", "check-2@salud.co"):
+            client.post("/admin/users/register", headers=admin, json={
+                "email": email, "password": "checkpassword", "full_name": "Médico", "role": "médico"
+            }).raise_for_status()
+            doctors.append(login(client, email, "checkpassword"))
+        mine, theirs = doctors
+        own_id = client.post("/patients/", headers=mine, json=PATIENT).json()["id"]
+        other_id = client.post("/patients/", headers=theirs, json=PATIENT).json()["id"]
+        client.get("/patients/", headers=mine)  # deja el token en la caché de autenticación
+
+        list_etag = client.get("/patients/", headers=mine).headers["ETag"]
+        read_etag = client.get(f"/patients/{own_id}", headers=mine).headers["ETag"]
+
+        calls = {
+            "list": lambda: client.get("/patients/", headers=mine),
+            "list (304)": lambda: client.get("/patients/", headers={**mine, "If-None-Match": list_etag}),
+            "read": lambda: client.get(f"/patients/{own_id}", headers=mine),
+            "read (304)": lambda: client.get(f"/patients/{own_id}", headers={**mine, "If-None-Match": read_etag}),
+            "read (403)": lambda: client.get(f"/patients/{other_id}", headers=mine),
+            "update": lambda: client.put(f"/patients/{own_id}", headers=mine, json={**PATIENT, "edad": 43}),
+            # read_etag ya no es la versión actual tras el "update" anterior
+            "update (412)": lambda: client.put(f"/patients/{own_id}", headers={**mine, "If-Match": read_etag}, json=PATIENT),
+            "update (404)": lambda: client.put("/patients/999999", headers=mine, json=PATIENT),
+            "predict": lambda: client.post(f"/patients/{own_id}/predict", headers=mine),
+            "predict (sin cambios)": lambda: client.post(f"/patients/{own_id}/predict", headers=mine),
+            "delete": lambda: client.delete(f"/patients/{own_id}", headers=mine),
+            "delete (403)": lambda: client.delete(f"/patients/{other_id}", headers=mine),
+            "update (403)": lambda: client.put(f"/patients/{other_id}", headers=mine, json=PATIENT),
+        }
+        targets = (engine, async_engine.sync_engine)
+        for target in targets:
+            event.listen(target, "before_cursor_execute", record)
+        try:
+            results = {}
+            for name, call in calls.items():
+                statements.clear()
+                status_code = call().status_code
+                results[name] = (status_code, list(statements))
+        finally:
+            for target in targets:
+                event.remove(target, "before_cursor_execute", record)
+    return results
+
+
+@pytest.mark.parametrize("name", list(EXPECTED))
+def test_statement_count(recorded, name):
+    assert recorded[name] == EXPECTED[name]
@@ -0,0 +1,185 @@
+# tests/test_query_plans.py
+#
+# Comprueba con EXPLAIN que cada filtro y orden del listado de pacientes
+# (app/patient_search.py) usa el índice previsto, sin recorrer la tabla entera
+# ni ordenar en memoria cuando el índice ya da el orden; y que la paginación por
+# cursor recorre a todos los pacientes, también a los que no tienen valor en la
+# columna de orden.
+#
+# Siembra unos miles de pacientes en la BD de pruebas (SQLite temporal, o
+# TEST_DATABASE_URL). En PostgreSQL se desactiva el recorrido secuencial y se usa
+# el coste de página de un SSD para que el plan no dependa del volumen.
+
+import random
+import uuid
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+from app import crud, models, patient_search, schemas
+from app.database import Base, SessionLocal, engine
+
+# Muchos médicos: con pocos, cada uno tiene una fracción tan grande de una tabla tan
+# pequeña que PostgreSQL prefiere con razón la clave primaria y filtrar
+DOCTORS = 20
+PATIENTS_PER_DOCTOR = 1000
+SEED_BATCH = 100
+
+F = schemas.PatientFilters
+S = schemas.PatientSort
+
+# (caso, filtros, orden, cursor, índice esperado en el plan)
+CASES = [
+    ("listado por id", F(), S.id, None, "ix_patients_owner_id_id"),
+    ("página siguiente por id", F(), S.id, (5000, 5000), "ix_patients_owner_id_id"),
+    ("perfil", F(profile=1), S.id, None, "ix_patients_owner_profile_id"),
+    ("sin predicción", F(unscored=True), S.id, None, "ix_patients_owner_profile_id"),
+    ("causa de la deficiencia", F(causa_deficiencia="Enfermedad general"), S.id, None, "ix_patients_owner_causa_id"),
+    ("rango de edad", F(edad_min=30, edad_max=40), S.edad, None, "ix_patients_owner_edad_id"),
+    ("orden por edad", F(), S.edad, None, "ix_patients_owner_edad_id"),
+    ("orden por edad, página siguiente", F(), S.edad, (30, 5000), "ix_patients_owner_edad_id"),
+    # La última fila de la página no tenía edad (cursor con valor None)
+    ("orden por edad, página tras un NULL", F(), S.edad, (None, 5000), "ix_patients_owner_edad_id"),
+    ("edad descendente, página siguiente", F(), S.edad_desc, (30, 5000), "ix_patients_owner_edad_id"),
+    ("edad descendente, página tras un NULL", F(), S.edad_desc, (None, 5000), "ix_patients_owner_edad_id"),
+    ("rango de nivel_global descendente", F(nivel_global_min=50), S.nivel_global_desc, None,
+     "ix_patients_owner_nivel_global_id"),
+    ("orden por nombre", F(), S.nombre_apellidos, None, "ix_patients_owner_nombre_id"),
+]
+
+SEARCH_INDEXES = {"fts5": "VIRTUAL TABLE INDEX", "pg_trgm": "ix_patients_nombre_trgm"}
+
+# Casos que PostgreSQL no puede resolver con el índice previsto
+POSTGRESQL_LIMITS = {
+    # IS NULL no fija el orden del índice (owner_id, prediction_profile, id): o lo
+    # ordena en memoria o recorre (owner_id, id) filtrando
+    "sin predicción": "PostgreSQL no usa IS NULL como igualdad para el orden del índice",
+}
+
+
+def patient(seed: int) -> dict:
+    rng = random.Random(seed)
+    return {
+        "nombre_apellidos": f"{rng.choice(['María', 'José', 'Ana', 'Luis'])} {rng.choice(['Núñez', 'Pérez', 'Gómez'])} {seed}",
+        # Algunos pacientes sin edad: las columnas de orden admiten NULL
+        "fecha_nacimiento": date(1980, 1, 15), "edad": rng.randint(18, 80) if rng.random() > 0.05 else None,
+        "genero": rng.choice(["Femenino", "Masculino"]), "orientacion_sexual": "Heterosexual",
+        "causa_deficiencia": rng.choice(["Enfermedad general", "Accidente de tránsito", "Congénita"]),
+        "cat_fisica": rng.choice(["SI", "NO"]), "cat_psicosocial": rng.choice(["SI", "NO"]),
+        **{f"nivel_d{k}": rng.randint(0, 100) for k in range(1, 7)}, "nivel_global": rng.randint(0, 100),
+        "prediction_profile": rng.choice([None, 0, 1, 2]),
+    }
+
+
+@pytest.fixture(scope="module")
+def owner_id() -> int:
+    """Siembra DOCTORS médicos y devuelve el id del primero."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        doctors = []
+        for _ in range(DOCTORS):
+            doctor = models.User(email=f"plans-{uuid.uuid4().hex[:8]}@salud.co", full_name="Médico",
+                                 role="médico", hashed_password="-")
+            db.add(doctor)
+            doctors.append(doctor)
+        db.commit()
+        # Por bloques alternos, como llegan en la práctica: los ids de un médico no son contiguos
+        for start in range(0, PATIENTS_PER_DOCTOR, SEED_BATCH):
+            for n, doctor in enumerate(doctors):
+                crud.bulk_create_user_patients(
+                    db, [patient(n * PATIENTS_PER_DOCTOR + i) for i in range(start, start + SEED_BATCH)],
+                    user_id=doctor.id,
+                )
+        if engine.dialect.name == "postgresql":
+            db.execute(text("ANALYZE patients"))
+            db.commit()
+        return doctors[0].id
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def search_index(owner_id) -> str | None:
+    # Como en el startup: sin la extensión (pg_trgm) no hay índice de búsqueda
+    try:
+        return patient_search.create_search_index()
+    except Exception:
+        return None
+
+
+@pytest.fixture
+def connection():
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            connection.execute(text("SET enable_seqscan = off"))
+            # Coste de disco SSD (el de un PostgreSQL gestionado): con el 4 por defecto y
+            # una tabla tan pequeña, recorrer la clave primaria en orden parece más barato
+            connection.execute(text("SET random_page_cost = 1.1"))
+        yield connection
+
+
+def explain(connection, statement) -> str:
+    sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    if engine.dialect.name == "sqlite":
+        return "\n".join(row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    return "\n".join(row[0] for row in connection.execute(text("EXPLAIN " + sql)))
+
+
+def plan_problems(plan: str, sort: schemas.PatientSort, expected: str) -> list[str]:
+    problems = []
+    if expected not in plan:
+        problems.append(f"no usa {expected}")
+    if engine.dialect.name == "sqlite" and "SCAN patients" in plan.replace("SCAN patients_fts", ""):
+        problems.append("recorre toda la tabla")
+    if engine.dialect.name == "sqlite" and sort.value.lstrip("-") != "id" and "TEMP B-TREE" in plan:
+        problems.append("ordena en memoria")
+    return problems
+
+
+@pytest.mark.parametrize("name, filters, sort, after_key, expected", CASES, ids=[case[0] for case in CASES])
+def test_listing_uses_index(owner_id, connection, name, filters, sort, after_key, expected):
+    if engine.dialect.name == "postgresql" and name in POSTGRESQL_LIMITS:
+        pytest.xfail(POSTGRESQL_LIMITS[name])
+    statement = patient_search.listing_statement(owner_id, engine.dialect.name, filters, sort, after_key).limit(101)
+    plan = explain(connection, statement)
+    assert not plan_problems(plan, sort, expected), plan
+
+
+def test_name_search_uses_index(owner_id, search_index, connection):
+    if search_index not in SEARCH_INDEXES:
+        pytest.skip("No hay índice de búsqueda por nombre en esta BD")
+    statement = patient_search.listing_statement(owner_id, engine.dialect.name, F(q="maria nunez"), S.id).limit(101)
+    plan = explain(connection, statement)
+    assert not plan_problems(plan, S.id, SEARCH_INDEXES[search_index]), plan
+
+
+@pytest.mark.parametrize("sort", [S.id, S.edad, S.edad_desc, S.nivel_global_desc], ids=lambda sort: sort.value)
+def test_cursor_pages_cover_null_sort_keys(owner_id, sort):
+    column = sort.value.lstrip("-")
+    descending = sort.value.startswith("-")
+    nulls_largest = patient_search.nulls_are_largest(engine.dialect.name)
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            patient_search.listing_statement(owner_id, engine.dialect.name, columns=["id", column]).limit(None)
+        ).all()
+        expected = [row.id for row in sorted(
+            rows, key=lambda row: ((row[1] is None) == nulls_largest, row[1] or 0, row.id), reverse=descending
+        )]
+        got, after_key = [], None
+        while True:
+            page = db.execute(
+                patient_search.listing_statement(owner_id, engine.dialect.name, None, sort, after_key,
+                                                 columns=["id", column]).limit(500)
+            ).all()
+            if not page:
+                break
+            got += [row.id for row in page]
+            after_key = (page[-1][1], page[-1].id)
+    finally:
+        db.close()
+    if column == "edad":
+        assert None in [row[1] for row in rows], "la siembra debe incluir pacientes sin edad"
+    assert got == expected